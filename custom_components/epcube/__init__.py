@@ -1,59 +1,126 @@
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from .const import DOMAIN, PLATFORMS, DEFAULT_SCAN_INTERVAL
-from .sensor import async_update_data_with_stats
-from .state import EpCubeDataState
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from datetime import timedelta
+from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
+from .const import DOMAIN, PLATFORMS, DEFAULT_SCAN_INTERVAL, API_BASE_URL, CONF_BASE_URL
+from .api import EpCubeApiClient
+from .coordinator import EpCubeCoordinator, entry_device_sns
+from .metrics import create_trace_config
+from .resilience import TokenBucket
+from .store import EpCubeStatePersistence, async_import_restore_states
+from .backfill import EpCubeStatisticsBackfill, async_register_services
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers import config_validation as cv, device_registry as dr, entity_registry as er
+from homeassistant.core import callback
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config) -> bool:
+    async_register_services(hass)
+    return True
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     if DOMAIN not in hass.data:
         hass.data[DOMAIN] = {}
 
     token = entry.data["token"]
-    sn = entry.data["sn"]
     scan_interval = entry.options.get("scan_interval", DEFAULT_SCAN_INTERVAL)
 
-    session = async_get_clientsession(hass)
-    url = f"https://monitoring-us.epcube.com/api/device/homeDeviceInfo?&sgSn={sn}"
-    headers = {
-        "accept": "*/*",
-        "accept-language": "it-IT",
-        "accept-encoding": "gzip, deflate, br",
-        "user-agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-        "authorization": token
-    }
+    # Sessione dedicata (sempre con keep-alive) per poter tracciare DNS e connessione
+    session = async_create_clientsession(hass, trace_configs=[create_trace_config()])
+    # Un solo limite di richieste per account, anche con più config entry
+    rate_limiters = hass.data[DOMAIN].setdefault("rate_limiters", {})
+    rate_limiter = rate_limiters.setdefault(token, TokenBucket())
+    base_url = entry.data.get(CONF_BASE_URL) or API_BASE_URL
+    client = EpCubeApiClient(session, token, base_url, rate_limiter=rate_limiter)
+
+    sns = entry_device_sns(entry)
+    await _async_migrate_legacy_ids(hass, entry, sns)
 
-    state = EpCubeDataState()
+    # Accumulatori ripristinati prima che le piattaforme vengano caricate
+    persistence = EpCubeStatePersistence(hass, entry.entry_id)
+    if not await persistence.async_load(sns) and async_import_restore_states(hass, persistence.states):
+        persistence.async_schedule_save()
 
-    async def async_update_data():
-        return await async_update_data_with_stats(session, url, headers, sn, token, hass=hass, entry_id=entry.entry_id)
+    # Posizione dell'entry tra quelle del dominio, usata per sfasare il phase lock
+    entry_ids = [domain_entry.entry_id for domain_entry in hass.config_entries.async_entries(DOMAIN)]
+    phase_index = entry_ids.index(entry.entry_id) if entry.entry_id in entry_ids else 0
+    coordinator = EpCubeCoordinator(hass, entry, client, scan_interval, phase_index)
+    for queue in coordinator.commands.values():
+        entry.async_on_unload(queue.async_cancel)
 
-    coordinator = DataUpdateCoordinator(
-        hass,
-        _LOGGER,
-        name="epcube_data",
-        update_method=async_update_data,
-        update_interval=timedelta(seconds=scan_interval),
-    )
+    backfill = EpCubeStatisticsBackfill(hass, entry, coordinator)
+    await backfill.async_load()
 
     hass.data[DOMAIN][entry.entry_id] = {
         "coordinator": coordinator,
-        "state": state
+        "client": client,
+        "session": session,
+        "states": persistence.states,
+        "persistence": persistence,
+        "backfill": backfill,
     }
     
-    await coordinator.async_refresh()
-    
+    # Con un ultimo snapshot salvato le entità partono subito e il cloud viene letto in background
+    restored = coordinator.async_set_restored_data(persistence.snapshots)
+    if not restored:
+        try:
+            await coordinator.async_config_entry_first_refresh()
+        except (ConfigEntryNotReady, ConfigEntryAuthFailed):
+            await persistence.async_save()
+            await session.close()
+            hass.data[DOMAIN].pop(entry.entry_id)
+            raise
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(_async_reload_entry))
+    entry.async_on_unload(backfill.async_track_daily())
+    entry.async_on_unload(coordinator.async_track_token_expiry())
+    if restored:
+        _LOGGER.debug("Snapshot salvato ripristinato per %s, primo refresh in background", entry.title)
+        entry.async_create_background_task(
+            hass, coordinator.async_refresh(), f"{DOMAIN}_first_refresh_{entry.entry_id}"
+        )
     return True
 
+async def _async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    await hass.config_entries.async_reload(entry.entry_id)
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+        entry_data = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if entry_data is not None:
+            await entry_data["persistence"].async_save()
+            await entry_data["session"].close()
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    await EpCubeStatePersistence(hass, entry.entry_id).async_remove()
+    await EpCubeStatisticsBackfill(hass, entry, None).async_remove()
+
+
+async def _async_migrate_legacy_ids(hass: HomeAssistant, entry: ConfigEntry, sns):
+    """Porta unique_id e dispositivo della versione mono-dispositivo sul SN principale."""
+    primary_sn = sns[0]
+    prefixes = tuple(f"epcube_{sn}_" for sn in sns)
+
+    @callback
+    def _migrate(entity_entry):
+        unique_id = entity_entry.unique_id
+        if not unique_id.startswith("epcube_") or unique_id.startswith(prefixes):
+            return None
+        return {"new_unique_id": f"epcube_{primary_sn}_{unique_id.removeprefix('epcube_')}"}
+
+    await er.async_migrate_entries(hass, entry.entry_id, _migrate)
+
+    device_registry = dr.async_get(hass)
+    legacy_device = device_registry.async_get_device(identifiers={(DOMAIN, "epcube_device")})
+    if legacy_device is not None and device_registry.async_get_device(identifiers={(DOMAIN, primary_sn)}) is None:
+        device_registry.async_update_device(
+            legacy_device.id, new_identifiers={(DOMAIN, primary_sn)}
+        )
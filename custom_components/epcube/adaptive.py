@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+# Chiavi di potenza osservate per stimare quanto velocemente cambia l'impianto
+ACTIVITY_KEYS = ("solarpower", "backuppower", "gridtotalpower", "batterysoc")
+
+# Variazione (unità grezze dell'API, decine di W) oltre la quale l'impianto è "attivo"
+ACTIVITY_THRESHOLD = 5
+
+# Refresh più lento di questa frazione dell'intervallo = API lenta
+SLOW_REFRESH_RATIO = 0.5
+
+INTERVAL_DECREASE_FACTOR = 0.5
+INTERVAL_INCREASE_FACTOR = 1.5
+
+
+class AdaptiveScanInterval:
+    """Calcola l'intervallo di polling in base all'attività osservata.
+
+    L'intervallo scende verso il minimo quando le potenze cambiano in fretta o
+    c'è una scrittura switchMode in attesa, e sale verso il massimo quando i
+    dati sono fermi oppure l'API è lenta o in errore. Un cambio avviene solo
+    dopo `hysteresis` cicli consecutivi nella stessa direzione.
+    """
+
+    def __init__(self, min_interval, max_interval, hysteresis):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.hysteresis = max(1, hysteresis)
+        self.interval = min_interval
+        self._streak = 0
+
+    @staticmethod
+    def is_active(previous, current):
+        for key in ACTIVITY_KEYS:
+            old = previous.get(key)
+            new = current.get(key)
+            if old is None or new is None:
+                continue
+            try:
+                if abs(float(new) - float(old)) >= ACTIVITY_THRESHOLD:
+                    return True
+            except (TypeError, ValueError):
+                continue
+        return False
+
+    def _vote(self, direction):
+        # direction: -1 accorcia, +1 allunga
+        if (self._streak > 0) != (direction > 0):
+            self._streak = 0
+        self._streak += direction
+        if abs(self._streak) < self.hysteresis:
+            return
+        self._streak = 0
+        factor = INTERVAL_DECREASE_FACTOR if direction < 0 else INTERVAL_INCREASE_FACTOR
+        self.interval = min(self.max_interval, max(self.min_interval, self.interval * factor))
+
+    def record_refresh(self, active, duration, write_pending=False):
+        if write_pending:
+            self._streak = 0
+            self.interval = self.min_interval
+        elif duration > self.interval * SLOW_REFRESH_RATIO:
+            self._vote(1)
+        elif active:
+            self._vote(-1)
+        else:
+            self._vote(1)
+        return timedelta(seconds=self.interval)
+
+    def record_error(self):
+        self._vote(1)
+        return timedelta(seconds=self.interval)
@@ -0,0 +1,324 @@
+from .auth import EpCubeCredentials
+from .const import API_BASE_URL, USER_AGENT, PROBE_ATTEMPTS, PROBE_TIMEOUT
+from .metrics import EpCubeMetrics, RequestTiming
+from .snapshot import LowerKeyView
+
+import aiohttp
+import async_timeout
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+_LOGGER = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = 32
+
+# Corpi più grandi di così vengono decodificati nell'executor, fuori dall'event loop
+EXECUTOR_PARSE_THRESHOLD = 64 * 1024
+
+# orjson è incluso in Home Assistant; il modulo json resta come ripiego
+try:
+    import orjson
+except ImportError:
+    json_loads = json.loads
+else:
+    json_loads = orjson.loads
+
+
+class EpCubeApiError(Exception):
+    """Errore nella comunicazione con il cloud EP Cube."""
+
+
+class EpCubeAuthError(EpCubeApiError):
+    """Token rifiutato dal cloud EP Cube, o già noto come scaduto."""
+
+
+# Stati HTTP con cui il cloud rifiuta il token
+AUTH_ERROR_STATUSES = (401, 403)
+
+
+def decode_body(body):
+    """Decodifica un corpo JSON dell'API e restituisce il campo `data`."""
+    try:
+        payload = json_loads(body)
+    except ValueError as err:
+        raise EpCubeApiError(f"Risposta JSON non valida: {err}") from err
+    if not isinstance(payload, dict):
+        raise EpCubeApiError("Risposta JSON inattesa")
+    return payload.get("data") or {}
+
+
+def period_end(date_str):
+    """Fine del periodo indicato da queryDateStr (giorno, mese o anno)."""
+    if date_str is None:
+        return None
+    if len(date_str) == 10:
+        start = datetime.strptime(date_str, "%Y-%m-%d")
+        return start + timedelta(days=1)
+    if len(date_str) == 7:
+        start = datetime.strptime(date_str, "%Y-%m")
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return datetime(int(date_str) + 1, 1, 1)
+
+
+@dataclass
+class CachedResponse:
+    data: LowerKeyView
+    digest: bytes
+    etag: str | None
+    last_modified: str | None
+    expires: datetime | None
+
+
+class ResponseCache:
+    """Cache LRU limitata delle risposte già normalizzate."""
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires is not None and datetime.now() >= entry.expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+
+class EpCubeApiClient:
+    """Client unico per le API EP Cube, condiviso da tutte le piattaforme di una config entry."""
+
+    def __init__(self, session, token, base_url=API_BASE_URL, rate_limiter=None):
+        self._session = session
+        self._base_url = base_url
+        self._rate_limiter = rate_limiter
+        self.credentials = EpCubeCredentials(token)
+        self._headers = {
+            "accept": "*/*",
+            "accept-language": "it-IT",
+            "accept-encoding": "gzip, deflate, br",
+            "user-agent": USER_AGENT,
+            "authorization": self.credentials.token,
+        }
+        self.cache = ResponseCache()
+        self.metrics = EpCubeMetrics()
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def rate_limiter_throttled(self):
+        """Richieste rallentate dal token bucket dell'account."""
+        return self._rate_limiter.throttled if self._rate_limiter is not None else 0
+
+    async def _fetch(self, path, params, headers=None):
+        """GET che restituisce (status, headers, corpo) registrando i tempi di ogni fase."""
+        url = f"{self._base_url}{path}"
+        endpoint = path.rsplit("/", 1)[-1]
+        timing = RequestTiming()
+        self._check_credentials()
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire()
+        try:
+            async with self._session.get(
+                url, headers=headers or self._headers, params=params, trace_request_ctx=timing
+            ) as resp:
+                if resp.status == 304:
+                    return resp.status, resp.headers, b""
+                self._check_status(resp.status, path)
+                if resp.status != 200:
+                    raise EpCubeApiError(f"HTTP {resp.status} da {path}")
+                if resp.content_type != "application/json":
+                    raise EpCubeApiError(f"Tipo MIME non gestito: {resp.content_type}")
+                body_start = time.perf_counter()
+                body = await resp.read()
+                body_ms = (time.perf_counter() - body_start) * 1000
+        except Exception:
+            self.metrics.record_error()
+            raise
+        self.metrics.record_request(endpoint, timing, body_ms, len(body))
+        return resp.status, resp.headers, body
+
+    def _check_credentials(self):
+        # Con un token scaduto o rifiutato non si inviano richieste destinate a fallire
+        if not self.credentials.valid:
+            raise EpCubeAuthError("Token EP Cube scaduto o rifiutato")
+
+    def _check_status(self, status, path):
+        if status in AUTH_ERROR_STATUSES:
+            self.credentials.reject()
+            raise EpCubeAuthError(f"Token rifiutato (HTTP {status}) da {path}")
+
+    async def _parse(self, path, body):
+        parse_start = time.perf_counter()
+        if len(body) > EXECUTOR_PARSE_THRESHOLD:
+            raw_data = await asyncio.get_running_loop().run_in_executor(None, decode_body, body)
+        else:
+            raw_data = decode_body(body)
+        self.metrics.record_parse(path.rsplit("/", 1)[-1], (time.perf_counter() - parse_start) * 1000)
+        return raw_data
+
+    async def _get(self, path, params):
+        _, _, body = await self._fetch(path, params)
+        return await self._parse(path, body)
+
+    async def _get_normalized(self, path, params):
+        return LowerKeyView(await self._get(path, params))
+
+    async def _get_cached(self, path, params, date_str=None):
+        """GET con richieste condizionali e confronto dell'hash del corpo.
+
+        Se il server risponde 304, o il corpo è identico al precedente, viene
+        restituito il dizionario già normalizzato senza rifare il parsing.
+        """
+        key = (path, *params.values())
+        cached = self.cache.get(key)
+
+        headers = None
+        if cached is not None and (cached.etag or cached.last_modified):
+            headers = dict(self._headers)
+            if cached.etag:
+                headers["if-none-match"] = cached.etag
+            if cached.last_modified:
+                headers["if-modified-since"] = cached.last_modified
+
+        status, resp_headers, body = await self._fetch(path, params, headers)
+        if status == 304:
+            if cached is None:
+                raise EpCubeApiError(f"HTTP 304 senza risposta in cache da {path}")
+            self.cache.hits += 1
+            return cached.data
+        etag = resp_headers.get("ETag")
+        last_modified = resp_headers.get("Last-Modified")
+
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if cached is not None and cached.digest == digest:
+            self.cache.hits += 1
+            cached.etag = etag
+            cached.last_modified = last_modified
+            return cached.data
+
+        self.cache.misses += 1
+        raw_data = await self._parse(path, body)
+        data = LowerKeyView(raw_data)
+        self.cache.put(key, CachedResponse(data, digest, etag, last_modified, period_end(date_str)))
+        return data
+
+    async def async_get_user_base(self):
+        return await self._get("/api/user/user/base", None)
+
+    async def async_get_device_sns(self):
+        """SN di tutti gli EP Cube dell'account, quello predefinito per primo."""
+        base = await self.async_get_user_base()
+        sns = []
+        if base.get("defDevSgSn"):
+            sns.append(base["defDevSgSn"])
+        for value in base.values():
+            if not isinstance(value, list):
+                continue
+            for device in value:
+                sn = device.get("sgSn") if isinstance(device, dict) else None
+                if sn and sn not in sns:
+                    sns.append(sn)
+        return sns
+
+    async def async_get_home_device_info(self, sn):
+        return await self._get_normalized("/api/device/homeDeviceInfo", {"sgSn": sn})
+
+    async def async_get_stats(self, dev_id, date_str, scope_type):
+        return await self._get_cached(
+            "/api/device/queryDataElectricityV2",
+            {"devId": dev_id, "queryDateStr": date_str, "scopeType": scope_type},
+            date_str,
+        )
+
+    async def async_get_history_stats(self, dev_id, date_str):
+        """Statistiche giornaliere di una data passata, senza occupare la cache condizionale."""
+        return await self._get_normalized(
+            "/api/device/queryDataElectricityV2",
+            {"devId": dev_id, "queryDateStr": date_str, "scopeType": 1},
+        )
+
+    async def async_get_device_info(self, dev_id):
+        return await self._get_cached("/api/device/userDeviceInfo", {"devId": dev_id})
+
+    async def async_get_switch_mode(self, dev_id):
+        return await self._get_normalized("/api/device/getSwitchMode", {"devId": dev_id})
+
+    async def async_switch_mode(self, payload):
+        url = f"{self._base_url}/api/device/switchMode"
+        self._check_credentials()
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire()
+        try:
+            async with self._session.post(url, headers=self._headers, json=payload) as resp:
+                text = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise EpCubeApiError(str(err)) from err
+        self._check_status(resp.status, "/api/device/switchMode")
+        if resp.status != 200:
+            raise EpCubeApiError(text)
+        return text
+
+
+async def async_probe_base_url(session, token, base_url):
+    """Misura la latenza di un host: (secondi, SN) se accetta il token, altrimenti None.
+
+    Si tiene il tempo migliore su PROBE_ATTEMPTS richieste user/base, così la
+    connessione TLS del primo tentativo non penalizza l'host.
+    """
+    client = EpCubeApiClient(session, token, base_url)
+    best = None
+    sns = []
+    for _ in range(PROBE_ATTEMPTS):
+        start = time.perf_counter()
+        try:
+            async with async_timeout.timeout(PROBE_TIMEOUT):
+                sns = await client.async_get_device_sns()
+        except Exception as err:
+            _LOGGER.debug("Host %s non utilizzabile: %s", base_url, err)
+            return None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if not sns:
+        return None
+    return best, sns
+
+
+async def async_select_base_url(session, token, base_urls):
+    """Host più veloce tra `base_urls` che accetta il token: (base_url, SN), None se nessuno.
+
+    Non esposto nel config flow finché c'è un solo host verificato in REGION_BASE_URLS.
+    """
+    results = await asyncio.gather(
+        *(async_probe_base_url(session, token, base_url) for base_url in base_urls)
+    )
+    candidates = [
+        (result[0], base_url, result[1])
+        for base_url, result in zip(base_urls, results)
+        if result is not None
+    ]
+    candidates.sort(key=lambda candidate: candidate[0])
+    for latency, base_url, _ in candidates:
+        _LOGGER.debug("Latenza di %s: %.0f ms", base_url, latency * 1000)
+    if not candidates:
+        return None
+    _, base_url, sns = candidates[0]
+    _LOGGER.info("Host EP Cube selezionato: %s", base_url)
+    return base_url, sns
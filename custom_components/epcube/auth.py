@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+
+import base64
+import json
+
+
+def normalize_token(token):
+    """Token con il prefisso "Bearer " usato da tutte le richieste, aggiunto una sola volta."""
+    token = token.strip()
+    if not token.startswith("Bearer "):
+        token = f"Bearer {token}"
+    return token
+
+
+def jwt_expiry(token):
+    """Scadenza (UTC) di un token JWT, None se il token non è un JWT con `exp`."""
+    parts = token.removeprefix("Bearer ").split(".")
+    if len(parts) != 3:
+        return None
+    payload = parts[1]
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return datetime.fromtimestamp(int(claims["exp"]), timezone.utc)
+    except (ValueError, TypeError, KeyError, OverflowError):
+        return None
+
+
+class EpCubeCredentials:
+    """Token di un account e relativo stato.
+
+    Un token rifiutato dal cloud (HTTP 401/403) o scaduto secondo il JWT non
+    è più `valid`: il client smette di inviare richieste finché la config
+    entry non viene ricaricata con un token nuovo.
+    """
+
+    def __init__(self, token):
+        self.token = normalize_token(token)
+        self.expires_at = jwt_expiry(self.token)
+        self.rejected = False
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and datetime.now(timezone.utc) >= self.expires_at
+
+    @property
+    def valid(self):
+        return not self.rejected and not self.expired
+
+    def reject(self):
+        self.rejected = True
@@ -0,0 +1,208 @@
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import async_add_external_statistics
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import UnitOfEnergy
+from homeassistant.core import HomeAssistant, ServiceCall, callback
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.event import async_track_time_change
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, BACKFILL_BATCH_DAYS, BACKFILL_DAILY_MINUTE
+
+import asyncio
+import voluptuous as vol
+from datetime import date, timedelta
+
+import logging
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+SERVICE_BACKFILL_STATISTICS = "backfill_statistics"
+ATTR_SERIAL_NUMBERS = "serial_numbers"
+ATTR_START_DATE = "start_date"
+
+BACKFILL_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_SERIAL_NUMBERS): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_START_DATE): cv.date,
+})
+
+# Energie giornaliere (kWh) importate come statistiche esterne cumulative
+BACKFILL_KEYS = {
+    "solarelectricity": "Solar energy",
+    "gridelectricityfrom": "Grid energy imported",
+    "gridelectricityto": "Grid energy exported",
+    "backupelectricity": "Backup load energy",
+    "nonbackupelectricity": "Non-backup load energy",
+    "generatorelectricity": "Generator energy",
+    "evelectricity": "EV energy",
+}
+
+
+def statistic_id(sn, key):
+    return f"{DOMAIN}:{sn.lower()}_{key}"
+
+
+def _metadata(sn, key):
+    return StatisticMetaData(
+        has_mean=False,
+        has_sum=True,
+        name=f"EPCUBE {sn} {BACKFILL_KEYS[key]}",
+        source=DOMAIN,
+        statistic_id=statistic_id(sn, key),
+        unit_of_measurement=UnitOfEnergy.KILO_WATT_HOUR,
+    )
+
+
+def _day_start(day):
+    # Le statistiche partono all'inizio di un'ora UTC, anche nei fusi con la mezz'ora
+    start = dt_util.as_utc(dt_util.start_of_local_day(day))
+    return start.replace(minute=0, second=0, microsecond=0)
+
+
+def _activation_date(value):
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+class EpCubeStatisticsBackfill:
+    """Importa lo storico giornaliero del cloud nelle statistiche a lungo termine.
+
+    Per ogni dispositivo il checkpoint salvato tiene il primo e l'ultimo giorno
+    importati e le somme cumulative: un backfill interrotto riprende dal giorno
+    successivo e i giorni già importati non vengono richiesti di nuovo. Ogni
+    notte vengono aggiunti i giorni mancanti fino a ieri.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, coordinator):
+        self._hass = hass
+        self._entry = entry
+        self._coordinator = coordinator
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry.entry_id}.statistics", atomic_writes=True)
+        self._lock = asyncio.Lock()
+        self.checkpoints = {}
+
+    async def async_load(self):
+        self.checkpoints = await self._store.async_load() or {}
+
+    async def async_remove(self):
+        await self._store.async_remove()
+
+    @callback
+    def async_track_daily(self):
+        """Aggiorna ogni notte le statistiche dei dispositivi già importati."""
+        @callback
+        def _async_daily(now):
+            if self.checkpoints:
+                self.async_start(list(self.checkpoints))
+
+        return async_track_time_change(self._hass, _async_daily, hour=0, minute=BACKFILL_DAILY_MINUTE, second=0)
+
+    @callback
+    def async_start(self, sns, start=None):
+        self._entry.async_create_background_task(
+            self._hass, self.async_backfill(sns, start), f"{DOMAIN}_backfill_{self._entry.entry_id}"
+        )
+
+    async def async_backfill(self, sns, start=None):
+        # Un solo backfill alla volta per entry: le somme cumulative dipendono dall'ordine
+        async with self._lock:
+            for sn in sns:
+                try:
+                    await self._async_backfill_device(sn, start)
+                except Exception:
+                    _LOGGER.exception("Backfill delle statistiche di %s interrotto", sn)
+
+    def _device_value(self, sn, key):
+        data = self._coordinator.data
+        return data["devices"].get(sn, {}).get(key) if data else None
+
+    async def _async_backfill_device(self, sn, start):
+        dev_id = self._device_value(sn, "devid")
+        if dev_id is None:
+            _LOGGER.warning("Backfill di %s rimandato: dispositivo non ancora letto dal cloud", sn)
+            return
+
+        checkpoint = self.checkpoints.get(sn)
+        if start is None:
+            start = (
+                date.fromisoformat(checkpoint["first"]) if checkpoint
+                else _activation_date(self._device_value(sn, "activationdata"))
+            )
+        if start is None:
+            _LOGGER.warning("Backfill di %s: data di attivazione sconosciuta, indicare start_date", sn)
+            return
+
+        if checkpoint and date.fromisoformat(checkpoint["first"]) <= start:
+            first = date.fromisoformat(checkpoint["first"])
+            day = date.fromisoformat(checkpoint["last"]) + timedelta(days=1)
+            sums = dict(checkpoint["sums"])
+        else:
+            # Inizio più vecchio del checkpoint: le somme vanno ricalcolate da capo
+            first = day = start
+            sums = {}
+
+        end = dt_util.now().date() - timedelta(days=1)
+        if day > end:
+            return
+        _LOGGER.info("Backfill delle statistiche di %s dal %s al %s", sn, day, end)
+
+        while day <= end:
+            days = [day + timedelta(days=i) for i in range(min(BACKFILL_BATCH_DAYS, (end - day).days + 1))]
+            results = await asyncio.gather(
+                *(self._fetch_day(dev_id, batch_day) for batch_day in days), return_exceptions=True
+            )
+
+            rows = {key: [] for key in BACKFILL_KEYS}
+            imported = None
+            for batch_day, result in zip(days, results):
+                # Le somme sono cumulative: ci si ferma al primo giorno non disponibile
+                if isinstance(result, Exception):
+                    _LOGGER.warning("Statistiche del %s non disponibili per %s: %s", batch_day, sn, result)
+                    break
+                for key in BACKFILL_KEYS:
+                    try:
+                        value = float(result[key])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    sums[key] = sums.get(key, 0.0) + value
+                    rows[key].append(StatisticData(start=_day_start(batch_day), state=value, sum=sums[key]))
+                imported = batch_day
+
+            for key, statistics in rows.items():
+                if statistics:
+                    async_add_external_statistics(self._hass, _metadata(sn, key), statistics)
+            if imported is None:
+                return
+
+            self.checkpoints[sn] = {"first": first.isoformat(), "last": imported.isoformat(), "sums": sums}
+            await self._store.async_save(self.checkpoints)
+            if imported != days[-1]:
+                return
+            day = imported + timedelta(days=1)
+
+        _LOGGER.info("Statistiche di %s aggiornate fino al %s", sn, end)
+
+    async def _fetch_day(self, dev_id, day):
+        return await self._coordinator.async_limited_background(
+            self._coordinator.client.async_get_history_stats(dev_id, day.isoformat())
+        )
+
+
+@callback
+def async_register_services(hass: HomeAssistant):
+    async def _async_backfill(call: ServiceCall):
+        sns = call.data.get(ATTR_SERIAL_NUMBERS)
+        start = call.data.get(ATTR_START_DATE)
+        for entry in hass.config_entries.async_entries(DOMAIN):
+            entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+            if entry_data is None:
+                continue
+            entry_sns = [sn for sn in entry_data["coordinator"].sns if sns is None or sn in sns]
+            if entry_sns:
+                entry_data["backfill"].async_start(entry_sns, start)
+
+    hass.services.async_register(DOMAIN, SERVICE_BACKFILL_STATISTICS, _async_backfill, schema=BACKFILL_SCHEMA)
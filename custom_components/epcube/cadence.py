@@ -0,0 +1,107 @@
+from collections import deque
+from statistics import median
+
+# Intervalli tra aggiornamenti osservati su cui stimare il periodo del cloud
+CADENCE_SAMPLES = 8
+CADENCE_MIN_SAMPLES = 4
+
+# Incertezza (secondi) sulla fase sotto la quale si smette di restringere la finestra
+PHASE_RESOLUTION = 1.0
+
+# Ritardo (secondi) del poll rispetto all'aggiornamento atteso; copre anche
+# l'arrotondamento al secondo con cui Home Assistant programma i refresh
+PHASE_MARGIN = 1.5
+
+# Scostamento di fase (secondi) tra config entry successive: Home Assistant
+# arrotonda al secondo l'istante del refresh, quindi con meno di 2 s due
+# entry vicine potrebbero comunque cadere nello stesso secondo
+PHASE_STAGGER = 2.0
+
+# Intervallo minimo (secondi) tra due poll programmati dal phase lock
+MIN_POLL_SPACING = 1.0
+
+
+class UpstreamCadence:
+    """Stima periodo e fase con cui il cloud aggiorna i dati live di un dispositivo.
+
+    Un poll che trova dati nuovi colloca l'aggiornamento tra il poll
+    precedente e quello corrente. Il periodo è la mediana degli intervalli tra
+    gli aggiornamenti osservati; la finestra (lo, hi) del prossimo
+    aggiornamento viene ristretta a metà ad ogni poll finché l'incertezza è
+    sotto PHASE_RESOLUTION, poi i poll cadono subito dopo `hi`. Se i dati
+    nuovi non arrivano quando previsto la finestra viene riaperta.
+    """
+
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.period = None
+        self._intervals = deque(maxlen=CADENCE_SAMPLES)
+        self._last_poll = None
+        self._last_change = None
+        # Finestra dell'ultimo aggiornamento osservato (istanti monotoni)
+        self._window = None
+
+    @property
+    def locked(self):
+        return self.period is not None and self._window is not None
+
+    def observe(self, now, changed):
+        """Registra un poll all'istante `now` che ha trovato (o no) dati live nuovi."""
+        last_poll, self._last_poll = self._last_poll, now
+        if last_poll is None:
+            return
+
+        if not changed:
+            if self.locked:
+                lo, hi = self._next_window()
+                if now >= hi:
+                    # Aggiornamento in ritardo rispetto alla previsione: fase da ristimare
+                    self._window = None
+                elif now > lo:
+                    self._window = (now - self.period, hi - self.period)
+            return
+
+        observed = (last_poll, now)
+        if self.locked:
+            lo, hi = self._next_window()
+            lo, hi = max(lo, observed[0]), min(hi, observed[1])
+            self._window = (lo, hi) if lo < hi else observed
+        else:
+            self._window = observed
+
+        if self._last_change is not None:
+            self._intervals.append(now - self._last_change)
+        self._last_change = now
+        self._update_period()
+
+    def _update_period(self):
+        self.period = None
+        if len(self._intervals) < CADENCE_MIN_SAMPLES:
+            return
+        period = median(self._intervals)
+        # Senza un periodo stabile e più lungo di due poll il phase lock non serve
+        tolerance = self.poll_interval + PHASE_RESOLUTION
+        if period < 2 * self.poll_interval:
+            return
+        if any(abs(interval - period) > tolerance for interval in list(self._intervals)[-CADENCE_MIN_SAMPLES:]):
+            return
+        self.period = period
+
+    def _next_window(self):
+        lo, hi = self._window
+        return lo + self.period, hi + self.period
+
+    def next_poll(self, now, offset=0.0):
+        """Istante monotono del prossimo poll, None se il periodo non è ancora noto."""
+        if not self.locked:
+            return None
+        lo, hi = self._next_window()
+        while hi + PHASE_MARGIN + offset <= now + MIN_POLL_SPACING:
+            lo, hi = lo + self.period, hi + self.period
+        if hi - lo > PHASE_RESOLUTION:
+            # Ricerca binaria della fase: un poll a metà finestra la dimezza.
+            # Anche i poll di ricerca sono sfasati, per non allineare le entry
+            target = (lo + hi) / 2 + offset
+            if target > now + MIN_POLL_SPACING:
+                return target
+        return hi + PHASE_MARGIN + offset
@@ -0,0 +1,122 @@
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .api import EpCubeApiError
+from .const import SWITCH_MODE_DEBOUNCE
+
+import logging
+_LOGGER = logging.getLogger(__name__)
+
+# Chiavi dello snapshot → campi del payload switchMode
+SWITCH_MODE_FIELDS = {
+    "workstatus": "workStatus",
+    "selfconsumptioinreservesoc": "selfConsumptioinReserveSoc",
+    "backuppowerreservesoc": "backupPowerReserveSoc",
+}
+
+# SOC di riserva inviato insieme a ciascuna modalità, con il valore predefinito
+MODE_RESERVE_SOC = {
+    "1": ("selfconsumptioinreservesoc", "15"),
+    "3": ("backuppowerreservesoc", "50"),
+}
+
+
+class SwitchModeQueue:
+    """Coda dei comandi switchMode di un EP Cube.
+
+    Le modifiche di modalità e SOC ricevute entro `SWITCH_MODE_DEBOUNCE`
+    secondi vengono unite in un solo payload; gli invii sono serializzati e
+    seguiti da un refresh del solo switchMode. Le modifiche arrivate durante
+    un invio partono con il successivo. Fino alla conferma le entità
+    mostrano il valore richiesto tramite `value`.
+    """
+
+    def __init__(self, hass, coordinator, sn):
+        self._hass = hass
+        self._coordinator = coordinator
+        self._sn = sn
+        self._pending = {}
+        self._in_flight = {}
+        self._flushing = False
+        self._unsub_timer = None
+
+    def _device_data(self):
+        data = self._coordinator.data
+        return data["devices"].get(self._sn, {}) if data else {}
+
+    def value(self, key):
+        """Valore da mostrare: richiesta in attesa, poi in conferma, poi dato del cloud."""
+        if key in self._pending:
+            return self._pending[key]
+        if key in self._in_flight:
+            return self._in_flight[key]
+        return self._device_data().get(key)
+
+    async def async_update(self, changes):
+        self._pending.update(changes)
+        self._coordinator.async_notify_keys(self._sn, changes)
+        self._schedule_flush()
+
+    @callback
+    def async_cancel(self):
+        if self._unsub_timer is not None:
+            self._unsub_timer()
+            self._unsub_timer = None
+
+    @callback
+    def _schedule_flush(self):
+        # L'attesa parte dalla prima modifica: quelle successive si accodano allo stesso invio
+        if self._unsub_timer is None:
+            self._unsub_timer = async_call_later(self._hass, SWITCH_MODE_DEBOUNCE, self._async_timer_fired)
+
+    @callback
+    def _async_timer_fired(self, _now):
+        self._unsub_timer = None
+        # Con un invio in corso le nuove modifiche vengono riprogrammate alla sua fine
+        if not self._flushing:
+            self._hass.async_create_task(self._async_flush(), f"epcube_switch_mode_{self._sn}")
+
+    def _payload(self, changes):
+        data = self._device_data()
+        requested = {**self._in_flight, **changes}
+        mode = str(requested.get("workstatus", data.get("workstatus")))
+        payload = {
+            "devId": data.get("devid"),
+            "workStatus": mode,
+            "weatherWatch": "0",
+            "onlySave": "0",
+        }
+        reserve = MODE_RESERVE_SOC.get(mode)
+        if reserve is not None:
+            key, default = reserve
+            payload[SWITCH_MODE_FIELDS[key]] = str(requested.get(key, data.get(key, default)))
+        for key, value in changes.items():
+            payload[SWITCH_MODE_FIELDS[key]] = str(value)
+        return payload
+
+    async def _async_flush(self):
+        changes, self._pending = self._pending, {}
+        if not changes:
+            return
+
+        self._flushing = True
+        payload = self._payload(changes)
+        self._in_flight.update(changes)
+        _LOGGER.debug("Invio payload switchMode per %s: %s", self._sn, payload)
+        client = self._coordinator.client
+        try:
+            text = await client.async_switch_mode(payload)
+        except EpCubeApiError as err:
+            _LOGGER.error("Errore nell'invio switchMode a EP Cube %s: %s", self._sn, err)
+        else:
+            _LOGGER.info("switchMode EP Cube %s aggiornato correttamente. Risposta: %s", self._sn, text)
+            self._coordinator.mark_write_pending(self._sn)
+            await self._coordinator.async_refresh_groups(("switch",), (self._sn,))
+        finally:
+            self._flushing = False
+            for key, value in changes.items():
+                if self._in_flight.get(key) == value:
+                    del self._in_flight[key]
+            self._coordinator.async_notify_keys(self._sn, changes)
+            if self._pending:
+                self._schedule_flush()
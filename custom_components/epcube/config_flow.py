@@ -1,9 +1,15 @@
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.core import callback
-import aiohttp
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import logging
-from .const import DOMAIN, DEFAULT_SCAN_INTERVAL, CONF_SCALE_POWER, CONF_ENABLE_TOTAL, CONF_ENABLE_ANNUAL, CONF_ENABLE_MONTHLY
+from .api import EpCubeApiClient, EpCubeApiError
+from .auth import normalize_token
+from .const import DOMAIN, DEFAULT_SCAN_INTERVAL, CONF_SCALE_POWER, CONF_ENABLE_TOTAL, CONF_ENABLE_ANNUAL, CONF_ENABLE_MONTHLY, CONF_EXTRA_SNS
+from .const import CONF_ADAPTIVE_SCAN, CONF_MAX_SCAN_INTERVAL, CONF_ADAPTIVE_HYSTERESIS, DEFAULT_MAX_SCAN_INTERVAL, DEFAULT_ADAPTIVE_HYSTERESIS
+from .const import CONF_AGGREGATE_WINDOWS, DEFAULT_AGGREGATE_WINDOWS, CONF_PHASE_LOCK
+from .const import CONF_REGION, CONF_BASE_URL, REGION_BASE_URLS, DEFAULT_REGION, API_BASE_URL
+from .coordinator import entry_device_sns
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -12,22 +18,26 @@ class EpCubeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     def __init__(self):
         self._errors = {}
+        self._reauth_entry = None
 
     async def async_step_user(self, user_input=None):
         self._errors = {}
 
         if user_input is not None:
-            token = user_input["token"].strip()
-            if not token.startswith("Bearer "):
-                token = f"Bearer {token}"
+            token = normalize_token(user_input["token"])
 
-            sn = await self._get_sn_from_token(token)
+            base_url = user_input.get(CONF_BASE_URL, "").strip().rstrip("/")
+            region = user_input.get(CONF_REGION, DEFAULT_REGION)
+            if not base_url:
+                base_url = REGION_BASE_URLS[region]
+            sns = await self._get_sns_from_token(token, base_url)
 
-            if not sn:
+            if not sns:
                 self._errors["base"] = "sn_not_found"
             else:
+                sn = sns[0]
                 for entry in self._async_current_entries():
-                    if entry.data.get("sn") == sn:
+                    if set(entry_device_sns(entry)) & set(sns):
                         return self.async_abort(reason="already_configured")
 
                 await self.async_set_unique_id(sn)
@@ -36,6 +46,8 @@ class EpCubeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     data={
                         "token": token,
                         "sn": sn,
+                        "sns": sns,
+                        CONF_BASE_URL: base_url,
                     },
                 )
 
@@ -43,31 +55,53 @@ class EpCubeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             step_id="user",
             data_schema=vol.Schema({
                 vol.Required("token"): str,
+                vol.Optional(CONF_REGION, default=DEFAULT_REGION): vol.In(list(REGION_BASE_URLS)),
+                vol.Optional(CONF_BASE_URL, default=""): str,
             }),
             errors=self._errors,
         )
 
-    async def _get_sn_from_token(self, token):
-        url = "https://monitoring-us.epcube.com/api/user/user/base"
-        headers = {
-            "accept": "*/*",
-            "accept-language": "it-IT",
-            "accept-encoding": "gzip, deflate, br",
-            "user-agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-            "authorization": token
-        }
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        _LOGGER.debug("Risposta user/base: %s", data)
-                        return data.get("data", {}).get("defDevSgSn")
-                    else:
-                        _LOGGER.error("Errore HTTP %s nella richiesta user/base", response.status)
-            except Exception as e:
-                _LOGGER.exception("Errore durante la richiesta user/base: %s", e)
-            return None
+    async def async_step_reauth(self, entry_data):
+        self._reauth_entry = self.hass.config_entries.async_get_entry(self.context["entry_id"])
+        return await self.async_step_reauth_confirm()
+
+    async def async_step_reauth_confirm(self, user_input=None):
+        """Nuovo token per un account con il token scaduto o rifiutato."""
+        self._errors = {}
+        entry = self._reauth_entry
+
+        if user_input is not None:
+            token = normalize_token(user_input["token"])
+            sns = await self._get_sns_from_token(token, entry.data.get(CONF_BASE_URL) or API_BASE_URL)
+            if not sns:
+                self._errors["base"] = "invalid_auth"
+            elif entry.data["sn"] not in sns:
+                self._errors["base"] = "wrong_account"
+            else:
+                return self.async_update_reload_and_abort(
+                    entry, data={**entry.data, "token": token, "sns": sns}
+                )
+
+        return self.async_show_form(
+            step_id="reauth_confirm",
+            data_schema=vol.Schema({
+                vol.Required("token"): str,
+            }),
+            description_placeholders={"sn": entry.data["sn"]},
+            errors=self._errors,
+        )
+
+    async def _get_sns_from_token(self, token, base_url):
+        client = EpCubeApiClient(async_get_clientsession(self.hass), token, base_url)
+        try:
+            sns = await client.async_get_device_sns()
+            _LOGGER.debug("Dispositivi trovati in user/base: %s", sns)
+            return sns
+        except EpCubeApiError as e:
+            _LOGGER.error("Errore nella richiesta user/base: %s", e)
+        except Exception as e:
+            _LOGGER.exception("Errore durante la richiesta user/base: %s", e)
+        return []
 
     @staticmethod
     @callback
@@ -80,9 +114,7 @@ class EpCubeOptionsFlow(config_entries.OptionsFlow):
 
     async def async_step_init(self, user_input=None):
         if user_input is not None:
-            token = user_input.get("token", "").strip()
-            if not token.startswith("Bearer "):
-                token = f"Bearer {token}"
+            token = normalize_token(user_input.get("token", ""))
             return self.async_create_entry(title="", data={
                 "token": token,
                 "scan_interval": user_input.get("scan_interval", DEFAULT_SCAN_INTERVAL),
@@ -90,6 +122,17 @@ class EpCubeOptionsFlow(config_entries.OptionsFlow):
                 CONF_ENABLE_TOTAL: user_input.get(CONF_ENABLE_TOTAL, False),
                 CONF_ENABLE_ANNUAL: user_input.get(CONF_ENABLE_ANNUAL, False),
                 CONF_ENABLE_MONTHLY: user_input.get(CONF_ENABLE_MONTHLY, False),
+                CONF_EXTRA_SNS: [
+                    sn.strip() for sn in user_input.get(CONF_EXTRA_SNS, "").split(",") if sn.strip()
+                ],
+                CONF_ADAPTIVE_SCAN: user_input.get(CONF_ADAPTIVE_SCAN, False),
+                CONF_MAX_SCAN_INTERVAL: user_input.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL),
+                CONF_ADAPTIVE_HYSTERESIS: user_input.get(CONF_ADAPTIVE_HYSTERESIS, DEFAULT_ADAPTIVE_HYSTERESIS),
+                CONF_PHASE_LOCK: user_input.get(CONF_PHASE_LOCK, False),
+                CONF_AGGREGATE_WINDOWS: sorted({
+                    int(window) for window in user_input.get(CONF_AGGREGATE_WINDOWS, "").split(",")
+                    if window.strip().isdigit() and int(window) > 0
+                }),
             })
 
         return self.async_show_form(
@@ -100,5 +143,11 @@ class EpCubeOptionsFlow(config_entries.OptionsFlow):
                 vol.Optional(CONF_ENABLE_TOTAL, default=self._config_entry.options.get(CONF_ENABLE_TOTAL, False)): bool,
                 vol.Optional(CONF_ENABLE_ANNUAL, default=self._config_entry.options.get(CONF_ENABLE_ANNUAL, False)): bool,
                 vol.Optional(CONF_ENABLE_MONTHLY, default=self._config_entry.options.get(CONF_ENABLE_MONTHLY, False)): bool,
+                vol.Optional(CONF_EXTRA_SNS, default=", ".join(self._config_entry.options.get(CONF_EXTRA_SNS, []))): str,
+                vol.Optional(CONF_ADAPTIVE_SCAN, default=self._config_entry.options.get(CONF_ADAPTIVE_SCAN, False)): bool,
+                vol.Optional(CONF_MAX_SCAN_INTERVAL, default=self._config_entry.options.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL)): vol.All(int, vol.Range(min=1)),
+                vol.Optional(CONF_ADAPTIVE_HYSTERESIS, default=self._config_entry.options.get(CONF_ADAPTIVE_HYSTERESIS, DEFAULT_ADAPTIVE_HYSTERESIS)): vol.All(int, vol.Range(min=1)),
+                vol.Optional(CONF_PHASE_LOCK, default=self._config_entry.options.get(CONF_PHASE_LOCK, False)): bool,
+                vol.Optional(CONF_AGGREGATE_WINDOWS, default=", ".join(str(w) for w in self._config_entry.options.get(CONF_AGGREGATE_WINDOWS, DEFAULT_AGGREGATE_WINDOWS))): str,
             })
         )
\ No newline at end of file
@@ -7,3 +7,70 @@ CONF_SCALE_POWER = "scale_power"
 CONF_ENABLE_TOTAL = "enable_total"
 CONF_ENABLE_ANNUAL = "enable_annual"
 CONF_ENABLE_MONTHLY = "enable_monthly"
+
+# Timeout (secondi) per singola richiesta verso il cloud EP Cube
+REQUEST_TIMEOUT = 10
+
+# Richieste contemporanee massime verso il cloud per account
+MAX_CONCURRENT_REQUESTS = 4
+
+# Backoff (secondi) per le richieste fallite: base esponenziale e tetto massimo
+BACKOFF_BASE = 5
+BACKOFF_MAX = 5 * 60
+
+# Token bucket per account, condiviso tra le config entry con lo stesso token
+RATE_LIMIT_RATE = 2.0
+RATE_LIMIT_BURST = 10
+
+# Refresh falliti consecutivi che aprono il circuito e durata dell'apertura
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_TIME = 2 * 60
+
+# Attesa (secondi) per raggruppare le modifiche switchMode in un solo invio
+SWITCH_MODE_DEBOUNCE = 1.5
+
+CONF_EXTRA_SNS = "extra_sns"
+
+CONF_ADAPTIVE_SCAN = "adaptive_scan"
+CONF_MAX_SCAN_INTERVAL = "max_scan_interval"
+CONF_ADAPTIVE_HYSTERESIS = "adaptive_hysteresis"
+DEFAULT_MAX_SCAN_INTERVAL = 60
+DEFAULT_ADAPTIVE_HYSTERESIS = 3
+
+# Poll allineati alla cadenza con cui il cloud aggiorna i dati live
+CONF_PHASE_LOCK = "phase_lock"
+
+# Finestre (minuti) dei sensori min/max/media sulle potenze live
+CONF_AGGREGATE_WINDOWS = "aggregate_windows"
+DEFAULT_AGGREGATE_WINDOWS = [1, 5]
+
+# Intervalli (secondi) dei livelli di polling: i dati live seguono scan_interval
+DAILY_TIER_INTERVAL = 60
+PERIODIC_TIER_INTERVAL = 20 * 60
+STATIC_TIER_INTERVAL = 24 * 60 * 60
+
+# Anticipo (secondi) sulla scadenza del token JWT con cui viene chiesto un token nuovo
+TOKEN_RENEW_MARGIN = 24 * 60 * 60
+
+# Backfill delle statistiche: giorni richiesti e importati per blocco, minuto dell'aggiornamento notturno
+BACKFILL_BATCH_DAYS = 31
+BACKFILL_DAILY_MINUTE = 15
+# Pausa (secondi) tra le richieste del backfill, che ne lascia gran parte del token bucket al polling live
+BACKFILL_REQUEST_INTERVAL = 1.0
+
+API_BASE_URL = "https://monitoring-us.epcube.com"
+
+# Host del cloud EP Cube per regione. Solo host verificati: quello US è l'host usato
+# dalle app ufficiali e da questa integrazione fin dall'inizio. Per altri server si usa
+# l'URL personalizzato; la scelta automatica dell'host tornerà con un secondo host confermato
+CONF_REGION = "region"
+CONF_BASE_URL = "base_url"
+REGION_BASE_URLS = {
+    "us": API_BASE_URL,
+}
+DEFAULT_REGION = "us"
+
+# Tentativi e timeout (secondi) della misura di latenza verso ogni host
+PROBE_ATTEMPTS = 2
+PROBE_TIMEOUT = 5
+USER_AGENT = "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)"
@@ -0,0 +1,613 @@
+from homeassistant.core import callback
+from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from .const import (
+    DOMAIN,
+    REQUEST_TIMEOUT,
+    MAX_CONCURRENT_REQUESTS,
+    BACKFILL_REQUEST_INTERVAL,
+    CONF_EXTRA_SNS,
+    CONF_ADAPTIVE_SCAN,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_ADAPTIVE_HYSTERESIS,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    DEFAULT_ADAPTIVE_HYSTERESIS,
+    CONF_AGGREGATE_WINDOWS,
+    DEFAULT_AGGREGATE_WINDOWS,
+    CONF_PHASE_LOCK,
+    DAILY_TIER_INTERVAL,
+    PERIODIC_TIER_INTERVAL,
+    STATIC_TIER_INTERVAL,
+    TOKEN_RENEW_MARGIN,
+)
+from .adaptive import AdaptiveScanInterval
+from .cadence import UpstreamCadence, PHASE_STAGGER, MIN_POLL_SPACING
+from .api import EpCubeAuthError
+from .resilience import Backoff, BackoffPending, CircuitBreaker, BREAKER_OPEN
+from .state import EpCubeDataState, POWER_CHANNELS, INTEGRATED_KEY
+from .timeseries import PowerSeries
+from .snapshot import DeviceSnapshot, EMPTY_LAYER
+from .commands import SwitchModeQueue
+from .derived import derive_metrics
+
+import async_timeout
+import asyncio
+import time
+from types import MappingProxyType
+from datetime import timedelta, datetime
+
+import logging
+_LOGGER = logging.getLogger(__name__)
+
+# Sorgenti secondarie e relativo intervallo di aggiornamento
+SOURCE_INTERVALS = {
+    "today": DAILY_TIER_INTERVAL,
+    "switch": DAILY_TIER_INTERVAL,
+    "total": PERIODIC_TIER_INTERVAL,
+    "annual": PERIODIC_TIER_INTERVAL,
+    "monthly": PERIODIC_TIER_INTERVAL,
+    "device_info": STATIC_TIER_INTERVAL,
+}
+
+# Gruppi di endpoint aggiornabili singolarmente con async_refresh_groups
+REFRESH_GROUPS = {
+    "live": ("live",),
+    "switch": ("switch",),
+    "stats": ("today", "total", "annual", "monthly"),
+    "device_info": ("device_info",),
+}
+
+# Sorgenti risolte come chiavi suffissate (<chiave>_total, ...) nello snapshot
+SUFFIXED_SOURCES = ("total", "annual", "monthly")
+
+INCLUDED_LIVE_KEYS = {
+    "gridelectricity", "gridelectricityfrom", "gridelectricityto",
+    "solarelectricity", "backupelectricity", "selfhelprate", "treenum", "coal",
+}
+
+DEVICE_INFO_KEYS = ["activationdata", "warrantydata", "modeltype", "batterycapacity"]
+
+
+def entry_device_sns(entry):
+    """Numeri di serie gestiti da una config entry, il principale per primo."""
+    sns = list(entry.data.get("sns") or [entry.data["sn"]])
+    for sn in entry.options.get(CONF_EXTRA_SNS, []):
+        if sn not in sns:
+            sns.append(sn)
+    return sns
+
+
+class EpCubeDevicePoller:
+    """Stato di polling a livelli di un singolo EP Cube."""
+
+    def __init__(self, sn):
+        self.sn = sn
+        self._sources = {}
+        self._source_fetched = {}
+        self.last_fetched = set()
+        self.dev_id = None
+        self._live = None
+        # Istante (monotono) dell'ultima richiesta live e se ha portato dati nuovi
+        self.live_polled_at = None
+        self.live_changed = False
+        # Sottoinsiemi di "today" e "device_info" ricalcolati solo quando la sorgente cambia
+        self._filtered = {}
+        # (sorgenti usate, metriche derivate): ricalcolate solo se cambia una delle sorgenti
+        self._derived = None
+
+    def invalidate(self, source):
+        self._source_fetched.pop(source, None)
+
+    def _source_due(self, source, period_key, now, backoff):
+        if not backoff.ready((self.sn, source), now):
+            return False
+        last = self._source_fetched.get(source)
+        if last is None:
+            return True
+        fetched_at, last_key = last
+        return last_key != period_key or now - fetched_at >= SOURCE_INTERVALS[source]
+
+    async def _fetch_live(self, coordinator):
+        backoff = coordinator.backoff
+        if not backoff.ready((self.sn, "live")):
+            raise BackoffPending(f"{self.sn} in backoff dopo errori ripetuti")
+        polled_at = time.monotonic()
+        try:
+            live = await coordinator.async_limited(
+                coordinator.client.async_get_home_device_info(self.sn)
+            )
+        except Exception:
+            backoff.failure((self.sn, "live"))
+            raise
+        backoff.success((self.sn, "live"))
+        self.live_polled_at = polled_at
+        self.live_changed = self._live is None or live != self._live
+        self._live = live
+        self.dev_id = live.get("devid")
+        return live
+
+    async def async_update(self, coordinator):
+        backoff = coordinator.backoff
+        live = await self._fetch_live(coordinator)
+
+        requests = self._requests(coordinator.client)
+        tick = time.monotonic()
+        due = [
+            source for source, (period_key, _) in requests.items()
+            if self._source_due(source, period_key, tick, backoff)
+        ]
+        await self._fetch_sources(coordinator, requests, due, tick)
+        self.last_fetched.add("live")
+
+        merge_start = time.perf_counter()
+        snapshot = self._snapshot(live)
+        coordinator.metrics.add_processing(time.perf_counter() - merge_start)
+        return snapshot
+
+    async def async_refresh_sources(self, coordinator, sources):
+        """Aggiorna solo le sorgenti indicate ("live" compreso), riusando le altre.
+
+        Le sorgenti aggiornate finiscono in `last_fetched`.
+        """
+        fetch_live = "live" in sources
+        sources = [source for source in sources if source != "live"]
+        requests = self._requests(coordinator.client)
+        # Azzerato prima delle richieste: dopo un errore non restano le sorgenti del poll precedente
+        self.last_fetched = set()
+        live_result, sources_result = await asyncio.gather(
+            self._fetch_live(coordinator) if fetch_live else asyncio.sleep(0),
+            self._fetch_sources(coordinator, requests, sources, time.monotonic()),
+            return_exceptions=True,
+        )
+        for result in (live_result, sources_result):
+            if isinstance(result, EpCubeAuthError):
+                raise ConfigEntryAuthFailed(str(result)) from result
+        if isinstance(sources_result, Exception):
+            _LOGGER.warning("Aggiornamento di %s fallito per %s: %s", ", ".join(sources), self.sn, sources_result)
+        if isinstance(live_result, Exception):
+            _LOGGER.warning("Richiesta live fallita per %s: %s", self.sn, live_result)
+        elif fetch_live:
+            self.last_fetched.add("live")
+        return self._snapshot(self._live)
+
+    def _requests(self, client):
+        now = datetime.now()
+        year_str = str(now.year)
+        month_str = now.strftime("%Y-%m")
+        today_str = now.strftime("%Y-%m-%d")
+        dev_id = self.dev_id
+
+        # Il cambio di periodo forza l'aggiornamento anche prima dell'intervallo
+        return {
+            "today": (today_str, lambda: client.async_get_stats(dev_id, today_str, 1)),
+            "switch": (None, lambda: client.async_get_switch_mode(dev_id)),
+            "total": (year_str, lambda: client.async_get_stats(dev_id, year_str, 0)),
+            "annual": (year_str, lambda: client.async_get_stats(dev_id, year_str, 3)),
+            "monthly": (month_str, lambda: client.async_get_stats(dev_id, month_str, 2)),
+            "device_info": (None, lambda: client.async_get_device_info(dev_id)),
+        }
+
+    async def _fetch_sources(self, coordinator, requests, sources, tick):
+        results = await asyncio.gather(
+            *(self._fetch_source(coordinator, source, requests[source][1]()) for source in sources)
+        )
+        self.last_fetched = set()
+        for source, result in results:
+            if result is None:
+                continue
+            self.last_fetched.add(source)
+            self._sources[source] = result
+            self._source_fetched[source] = (tick, requests[source][0])
+
+    async def _fetch_source(self, coordinator, source, coro):
+        try:
+            result = await coordinator.async_limited(coro)
+        except EpCubeAuthError:
+            raise
+        except Exception as err:
+            delay = coordinator.backoff.failure((self.sn, source))
+            _LOGGER.warning(
+                "Richiesta %s fallita per %s, nuovo tentativo tra %.0f s: %s", source, self.sn, delay, err
+            )
+            return source, None
+        coordinator.backoff.success((self.sn, source))
+        return source, result
+
+    def _filtered_source(self, source, build):
+        data = self._sources.get(source)
+        if data is None:
+            return EMPTY_LAYER
+        cached = self._filtered.get(source)
+        if cached is None or cached[0] is not data:
+            cached = self._filtered[source] = (data, build(data))
+        return cached[1]
+
+    def _snapshot(self, live):
+        """Snapshot a livelli: derivate > today > device_info > switch > live, più le chiavi suffissate."""
+        today = self._filtered_source(
+            "today", lambda data: {k: v for k, v in data.items() if k in INCLUDED_LIVE_KEYS}
+        )
+        device_info = self._filtered_source(
+            "device_info", lambda data: {k: data.get(k) for k in DEVICE_INFO_KEYS}
+        )
+        layers = (today, device_info, self._sources.get("switch", EMPTY_LAYER), live)
+        suffixed = {source: self._sources.get(source, EMPTY_LAYER) for source in SUFFIXED_SOURCES}
+        return DeviceSnapshot((self._derived_layer(layers, suffixed), *layers), suffixed)
+
+    def _derived_layer(self, layers, suffixed):
+        # Le metriche dipendono da live, device_info e switch: "today" non conta
+        inputs = layers[1:]
+        if self._derived is None or any(new is not old for new, old in zip(inputs, self._derived[0])):
+            self._derived = (inputs, derive_metrics(DeviceSnapshot(layers, suffixed)))
+        return self._derived[1]
+
+
+class BackoffSkipped(UpdateFailed):
+    """Refresh saltato perché tutti i dispositivi aspettano la fine del backoff."""
+
+
+class EpCubeCoordinator(DataUpdateCoordinator):
+    """Coordinator unico per account: interroga tutti gli EP Cube della config entry.
+
+    I dati live arrivano ad ogni ciclo, le altre sorgenti solo quando scadono.
+    `data` ha la forma {"devices": {sn: full_data}, "stale": bool}: con il
+    circuito aperto viene servito l'ultimo snapshot valido marcato come stale.
+    """
+
+    def __init__(self, hass, entry, client, scan_interval, phase_index=0):
+        super().__init__(
+            hass,
+            _LOGGER,
+            name="epcube_data",
+            update_interval=timedelta(seconds=scan_interval),
+        )
+        self.entry = entry
+        self.client = client
+        self.metrics = client.metrics
+        self.sns = entry_device_sns(entry)
+        self._pollers = {sn: EpCubeDevicePoller(sn) for sn in self.sns}
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        # Richieste di background (backfill): una alla volta e solo con il polling live fermo
+        self._background_semaphore = asyncio.Semaphore(1)
+        self._live_requests = 0
+        self._live_idle = asyncio.Event()
+        self._live_idle.set()
+        self.device_available = {}
+        # Chiavi cambiate nell'ultimo ciclo per dispositivo; None = notifica tutte le entità
+        self.changed_keys = None
+        self.refresh_stats = {"refreshes": 0, "changed_keys": 0, "total_keys": 0}
+        self._pending_writes = set()
+        self.commands = {sn: SwitchModeQueue(hass, self, sn) for sn in self.sns}
+        # Campioni recenti delle potenze (W) e relativi aggregati per finestra
+        self.aggregate_windows = entry.options.get(CONF_AGGREGATE_WINDOWS, DEFAULT_AGGREGATE_WINDOWS)
+        # Capacità iniziale per l'intervallo normale: con poll più fitti (phase lock,
+        # refresh mirati) il buffer cresce fino a coprire la finestra più lunga
+        horizon = max(self.aggregate_windows, default=0) * 60
+        capacity = int(horizon / scan_interval) + 2
+        self.series = {
+            sn: {channel: PowerSeries(capacity, horizon) for channel in POWER_CHANNELS} for sn in self.sns
+        }
+        self.power_aggregates = {sn: {} for sn in self.sns}
+        self.backoff = Backoff()
+        self.breaker = CircuitBreaker()
+        self._scan_interval = timedelta(seconds=scan_interval)
+        self.cadence = None
+        if entry.options.get(CONF_PHASE_LOCK, False):
+            self.cadence = {sn: UpstreamCadence(scan_interval) for sn in self.sns}
+        # Le config entry successive vengono sfasate per non interrogare il cloud insieme
+        self.phase_offset = PHASE_STAGGER * phase_index
+        self.adaptive = None
+        if entry.options.get(CONF_ADAPTIVE_SCAN, False):
+            self.adaptive = AdaptiveScanInterval(
+                scan_interval,
+                entry.options.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL),
+                entry.options.get(CONF_ADAPTIVE_HYSTERESIS, DEFAULT_ADAPTIVE_HYSTERESIS),
+            )
+
+    @callback
+    def async_set_restored_data(self, snapshots):
+        """Serve gli snapshot salvati, marcati stale, finché il primo refresh non termina.
+
+        Restituisce False, senza cambiare nulla, se manca qualche dispositivo.
+        """
+        if any(sn not in snapshots for sn in self.sns):
+            return False
+        self.data = {
+            "devices": {
+                sn: DeviceSnapshot((MappingProxyType(snapshots[sn]),), {}) for sn in self.sns
+            },
+            "stale": True,
+        }
+        return True
+
+    def mark_write_pending(self, sn):
+        """Segnala una scrittura switchMode da confermare al prossimo refresh."""
+        self._pending_writes.add(sn)
+        self._pollers[sn].invalidate("switch")
+        if self.adaptive is not None:
+            self.update_interval = self.adaptive.record_refresh(False, 0, write_pending=True)
+
+    async def async_refresh_groups(self, groups, sns=None):
+        """Rilegge solo alcuni gruppi di endpoint (vedi REFRESH_GROUPS) e li unisce ai dati correnti.
+
+        Senza `sns` vengono aggiornati tutti i dispositivi. A differenza di un
+        refresh completo non riprogramma il prossimo ciclo di polling.
+        Restituisce False se non è stato aggiornato nulla.
+        """
+        if not self.data:
+            return False
+        sources = [source for group in groups for source in REFRESH_GROUPS[group]]
+        pollers = [
+            self._pollers[sn] for sn in (sns or self.sns)
+            if sn in self.data["devices"] and self._pollers[sn].dev_id is not None
+        ]
+        try:
+            snapshots = await asyncio.gather(
+                *(poller.async_refresh_sources(self, sources) for poller in pollers)
+            )
+        except ConfigEntryAuthFailed as err:
+            # Fuori dal refresh del coordinator il reauth non parte da solo
+            _LOGGER.warning("Token rifiutato durante un aggiornamento parziale: %s", err)
+            self.entry.async_start_reauth(self.hass)
+            return False
+
+        devices = dict(self.data["devices"])
+        changed_keys = {sn: set() for sn in devices}
+        for poller, snapshot in zip(pollers, snapshots):
+            sn = poller.sn
+            if not poller.last_fetched:
+                continue
+            if "switch" in poller.last_fetched:
+                self._pending_writes.discard(sn)
+            if "live" in poller.last_fetched:
+                self._update_state(sn, snapshot)
+            changed_keys[sn] = snapshot.changed_keys(devices[sn])
+            devices[sn] = snapshot
+        if not any(poller.last_fetched for poller in pollers):
+            return False
+
+        if any("live" in poller.last_fetched for poller in pollers):
+            self._schedule_state_save(devices)
+        self.changed_keys = changed_keys
+        self._mark_integrated([poller.sn for poller in pollers if "live" in poller.last_fetched])
+        self.data = {**self.data, "devices": devices}
+        self.async_update_listeners()
+        return True
+
+    @callback
+    def async_notify_keys(self, sn, keys):
+        """Notifica le entità di un dispositivo che dipendono da `keys` senza nuovi dati."""
+        self.changed_keys = {device_sn: set() for device_sn in self.sns}
+        self.changed_keys[sn] = set(keys)
+        self.async_update_listeners()
+
+    async def async_limited(self, coro):
+        """Esegue una richiesta rispettando il limite di concorrenza dell'account."""
+        self._live_requests += 1
+        self._live_idle.clear()
+        try:
+            async with self._semaphore:
+                async with async_timeout.timeout(REQUEST_TIMEOUT):
+                    return await coro
+        finally:
+            self._live_requests -= 1
+            if not self._live_requests:
+                self._live_idle.set()
+
+    async def async_limited_background(self, coro):
+        """Esegue una richiesta a bassa priorità, che cede il passo al polling live.
+
+        Le richieste di background non occupano il semaforo live: partono una alla
+        volta, solo quando nessuna richiesta live è in corso, e distanziate di
+        BACKFILL_REQUEST_INTERVAL per non svuotare il token bucket dell'account.
+        """
+        async with self._background_semaphore:
+            await self._live_idle.wait()
+            try:
+                async with async_timeout.timeout(REQUEST_TIMEOUT):
+                    return await coro
+            finally:
+                await asyncio.sleep(BACKFILL_REQUEST_INTERVAL)
+
+    @property
+    def stale(self):
+        return bool(self.data and self.data.get("stale"))
+
+    @callback
+    def async_track_token_expiry(self):
+        """Chiede un token nuovo prima della scadenza del JWT, finché quello attuale vale ancora."""
+        expires_at = self.client.credentials.expires_at
+        if expires_at is None:
+            return lambda: None
+
+        @callback
+        def _async_token_expiring(now):
+            _LOGGER.warning("Il token EP Cube scade il %s: è necessario inserirne uno nuovo", expires_at)
+            self.entry.async_start_reauth(self.hass)
+
+        return async_track_point_in_utc_time(
+            self.hass, _async_token_expiring, expires_at - timedelta(seconds=TOKEN_RENEW_MARGIN)
+        )
+
+    async def _async_update_data(self):
+        # Il coordinator non riprogramma il polling dopo ConfigEntryAuthFailed e avvia il reauth
+        if not self.client.credentials.valid:
+            raise ConfigEntryAuthFailed("Token EP Cube scaduto o rifiutato")
+        if not self.breaker.allow_request():
+            if not self.data:
+                raise UpdateFailed("Circuito aperto: cloud EP Cube non raggiungibile")
+            return self._stale_snapshot()
+        try:
+            data = await self._async_update_devices()
+        except BackoffSkipped:
+            # Nessuna richiesta inviata: l'attesa del backoff non è un guasto per il circuito
+            if not self.data:
+                raise
+            return self._stale_snapshot()
+        except UpdateFailed:
+            self.breaker.record_failure()
+            if self.breaker.state == BREAKER_OPEN and self.data:
+                _LOGGER.warning(
+                    "Cloud EP Cube non raggiungibile dopo %d tentativi: circuito aperto, uso l'ultimo snapshot",
+                    self.breaker.consecutive_failures,
+                )
+                return self._stale_snapshot()
+            raise
+        self.breaker.record_success()
+        return data
+
+    def _stale_snapshot(self):
+        # Nessun valore cambia: vanno notificate solo le entità che seguono ogni ciclo
+        if self.last_update_success:
+            self.changed_keys = {sn: set() for sn in self.data["devices"]}
+        else:
+            self.changed_keys = None
+        return {"devices": self.data["devices"], "stale": True}
+
+    async def _async_update_devices(self):
+        refresh_start = time.perf_counter()
+        results = await asyncio.gather(
+            *(poller.async_update(self) for poller in self._pollers.values()),
+            return_exceptions=True,
+        )
+
+        previous = self.data["devices"] if self.data else {}
+        was_available = dict(self.device_available)
+        devices = {}
+        errors = []
+        integrated = []
+        for sn, result in zip(self._pollers, results):
+            if isinstance(result, EpCubeAuthError):
+                raise ConfigEntryAuthFailed(str(result)) from result
+            if isinstance(result, Exception):
+                _LOGGER.warning("Aggiornamento di %s fallito: %s", sn, result)
+                errors.append(result)
+                self.device_available[sn] = False
+                if sn in previous:
+                    devices[sn] = previous[sn]
+                continue
+            self.device_available[sn] = True
+            devices[sn] = result
+            self._update_state(sn, result)
+            integrated.append(sn)
+            poller = self._pollers[sn]
+            if self.cadence is not None and "live" in poller.last_fetched:
+                self.cadence[sn].observe(poller.live_polled_at, poller.live_changed)
+
+        if len(errors) == len(self._pollers):
+            # Lo snapshot precedente resta valido per un eventuale circuito aperto
+            self.device_available = was_available
+            if all(isinstance(error, BackoffPending) for error in errors):
+                raise BackoffSkipped("Tutti i dispositivi sono in backoff: refresh saltato")
+            if self.adaptive is not None:
+                self.update_interval = self.adaptive.record_error()
+            elif self.cadence is not None:
+                self.update_interval = self._scan_interval
+            raise UpdateFailed(f"Errore nell'aggiornamento dei dati: {errors[0]}")
+
+        self._schedule_state_save(devices)
+        processing_start = time.perf_counter()
+        self._track_changes(devices, was_available)
+        self._mark_integrated(integrated)
+        self.metrics.add_processing(time.perf_counter() - processing_start)
+        refresh_duration = time.perf_counter() - refresh_start
+        self.metrics.record_refresh(
+            refresh_duration,
+            sum(len(full_data) for full_data in devices.values()),
+        )
+        self._update_scan_interval(previous, devices, refresh_duration, bool(errors))
+        return {"devices": devices, "stale": False}
+
+    def _update_scan_interval(self, previous, devices, refresh_duration, had_errors):
+        write_pending = bool(self._pending_writes)
+        self._pending_writes = {
+            sn for sn in self._pending_writes
+            if "switch" not in self._pollers[sn].last_fetched
+        }
+        if self.adaptive is None:
+            self.update_interval = self._scan_interval
+        elif had_errors:
+            self.update_interval = self.adaptive.record_error()
+        else:
+            active = any(
+                AdaptiveScanInterval.is_active(previous[sn], full_data)
+                for sn, full_data in devices.items()
+                if sn in previous
+            )
+            self.update_interval = self.adaptive.record_refresh(active, refresh_duration, write_pending)
+
+        if self.cadence is not None and not had_errors and not write_pending:
+            self._apply_phase_lock()
+
+    def _apply_phase_lock(self):
+        """Programma il poll subito dopo il prossimo aggiornamento atteso del cloud.
+
+        Finché la cadenza di qualche dispositivo non è nota resta l'intervallo normale.
+        """
+        now = time.monotonic()
+        targets = [cadence.next_poll(now, self.phase_offset) for cadence in self.cadence.values()]
+        if None in targets:
+            return
+        self.update_interval = timedelta(seconds=max(min(targets) - now, MIN_POLL_SPACING))
+
+    def _update_state(self, sn, full_data):
+        tick = time.monotonic()
+        try:
+            state: EpCubeDataState = self.hass.data[DOMAIN][self.entry.entry_id]["states"][sn]
+            state.update(full_data, tick)
+        except Exception as e:
+            _LOGGER.warning("Errore nell'integrazione dell'energia: %s", e)
+        self._record_series(sn, full_data, tick)
+
+    def _mark_integrated(self, sns):
+        # L'energia integrata cresce ad ogni poll anche se le potenze non cambiano
+        if self.changed_keys is None:
+            return
+        for sn in sns:
+            self.changed_keys.setdefault(sn, set()).add(INTEGRATED_KEY)
+
+    def _record_series(self, sn, full_data, tick):
+        series = self.series[sn]
+        for channel, power_fn in POWER_CHANNELS.items():
+            try:
+                series[channel].append(tick, float(power_fn(full_data)))
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.power_aggregates[sn] = {
+            (channel, window): series[channel].aggregate(window * 60, tick)
+            for channel in series
+            for window in self.aggregate_windows
+        }
+
+    def _schedule_state_save(self, devices):
+        persistence = self.hass.data[DOMAIN][self.entry.entry_id].get("persistence")
+        if persistence is not None:
+            persistence.snapshots = devices
+            persistence.async_schedule_save()
+
+    def _track_changes(self, devices, was_available):
+        previous = self.data["devices"] if self.data else None
+        total_keys = sum(len(full_data) for full_data in devices.values())
+
+        # Dopo un errore le entità devono tornare disponibili: notifica tutto
+        if previous is None or not self.last_update_success:
+            self.changed_keys = None
+            changed_count = total_keys
+        else:
+            self.changed_keys = {}
+            for sn, full_data in devices.items():
+                old = previous.get(sn)
+                # Un cambio di disponibilità va notificato a tutte le entità del dispositivo
+                if old is None or was_available.get(sn, True) != self.device_available[sn]:
+                    self.changed_keys[sn] = set(full_data)
+                    continue
+                self.changed_keys[sn] = full_data.changed_keys(old)
+            changed_count = sum(len(keys) for keys in self.changed_keys.values())
+
+        self.refresh_stats = {
+            "refreshes": self.refresh_stats["refreshes"] + 1,
+            "changed_keys": changed_count,
+            "total_keys": total_keys,
+        }
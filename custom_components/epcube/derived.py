@@ -0,0 +1,87 @@
+from .commands import MODE_RESERVE_SOC
+from .state import power_balance
+
+# Sotto questa potenza (W) la batteria è considerata ferma: l'API ha una risoluzione di 10 W
+BATTERY_IDLE_THRESHOLD = 10
+
+# Capacità dichiarate oltre questo valore sono in Wh anziché in kWh
+CAPACITY_WH_THRESHOLD = 1000
+
+BATTERY_CHARGING = "charging"
+BATTERY_DISCHARGING = "discharging"
+BATTERY_IDLE = "idle"
+
+# Chiavi calcolate localmente e aggiunte allo snapshot: potenze in kW, percentuali, minuti
+DERIVED_KEYS = (
+    "battery_power",
+    "battery_direction",
+    "house_load_power",
+    "grid_import_power",
+    "grid_export_power",
+    "self_sufficiency",
+    "battery_time_to_full",
+    "battery_time_to_empty",
+)
+
+
+def _float(data, key):
+    try:
+        return float(data[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def battery_capacity_wh(data):
+    capacity = _float(data, "batterycapacity")
+    if not capacity or capacity <= 0:
+        return None
+    return capacity if capacity > CAPACITY_WH_THRESHOLD else capacity * 1000
+
+
+def _reserve_soc(data):
+    reserve = MODE_RESERVE_SOC.get(str(data.get("workstatus")))
+    if reserve is None:
+        return 0.0
+    return _float(data, reserve[0]) or 0.0
+
+
+def derive_metrics(data):
+    """Metriche derivate da uno snapshot, calcolate una volta per refresh.
+
+    Le potenze sono in kW come il sensore storico della batteria, i tempi di
+    carica e scarica in minuti; i valori senza dati sufficienti restano None.
+    """
+    derived = dict.fromkeys(DERIVED_KEYS)
+    try:
+        # Un solo bilancio per tutte le metriche, così non possono contraddirsi
+        _, grid_w, load_w, battery_w = power_balance(data)
+    except (KeyError, TypeError, ValueError):
+        return derived
+
+    grid_import_w = max(grid_w, 0.0)
+    derived["battery_power"] = round(battery_w / 1000, 3)
+    derived["house_load_power"] = round(load_w / 1000, 3)
+    derived["grid_import_power"] = round(grid_import_w / 1000, 3)
+    derived["grid_export_power"] = round(max(-grid_w, 0.0) / 1000, 3)
+    if load_w > 0:
+        derived["self_sufficiency"] = round(min(100.0, max(0.0, (load_w - grid_import_w) / load_w * 100)), 1)
+
+    if battery_w >= BATTERY_IDLE_THRESHOLD:
+        derived["battery_direction"] = BATTERY_CHARGING
+    elif battery_w <= -BATTERY_IDLE_THRESHOLD:
+        derived["battery_direction"] = BATTERY_DISCHARGING
+    else:
+        derived["battery_direction"] = BATTERY_IDLE
+        return derived
+
+    soc = _float(data, "batterysoc")
+    capacity_wh = battery_capacity_wh(data)
+    if soc is None or capacity_wh is None:
+        return derived
+    if battery_w > 0:
+        derived["battery_time_to_full"] = round(max(100 - soc, 0) / 100 * capacity_wh / battery_w * 60)
+    else:
+        # La scarica si ferma al SOC di riserva della modalità corrente
+        usable = max(soc - _reserve_soc(data), 0)
+        derived["battery_time_to_empty"] = round(usable / 100 * capacity_wh / -battery_w * 60)
+    return derived
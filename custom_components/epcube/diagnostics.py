@@ -0,0 +1,43 @@
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN, CONF_EXTRA_SNS
+
+TO_REDACT = {"token", "sn", "sns", CONF_EXTRA_SNS}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry):
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    coordinator = entry_data["coordinator"]
+    client = entry_data["client"]
+
+    return {
+        "entry": {
+            "data": async_redact_data(dict(entry.data), TO_REDACT),
+            "options": async_redact_data(dict(entry.options), TO_REDACT),
+        },
+        "coordinator": {
+            "last_update_success": coordinator.last_update_success,
+            "update_interval": coordinator.update_interval.total_seconds() if coordinator.update_interval else None,
+            "devices": len(coordinator.sns),
+            "devices_available": sum(coordinator.device_available.values()),
+            "refresh_stats": coordinator.refresh_stats,
+        },
+        "resilience": {
+            "circuit": coordinator.breaker.state,
+            "consecutive_failures": coordinator.breaker.consecutive_failures,
+            "stale": coordinator.stale,
+            "retries_pending": coordinator.backoff.retries_pending,
+            "rate_limited_requests": client.rate_limiter_throttled,
+        },
+        "phase_lock": {
+            "offset": coordinator.phase_offset,
+            "devices": [
+                {"period": cadence.period, "locked": cadence.locked}
+                for cadence in coordinator.cadence.values()
+            ],
+        } if coordinator.cadence is not None else None,
+        "cache": {"hits": client.cache.hits, "misses": client.cache.misses},
+        "metrics": client.metrics.as_dict(),
+    }
@@ -0,0 +1,56 @@
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .const import DOMAIN, API_BASE_URL
+
+
+def epcube_device_info(sn, base_url=API_BASE_URL):
+    return {
+        "identifiers": {(DOMAIN, sn)},
+        "name": f"EPCUBE {sn}",
+        "manufacturer": "CanadianSolar",
+        "model": "EPCUBE",
+        "serial_number": sn,
+        "entry_type": "service",
+        "configuration_url": f"{base_url}/"
+    }
+
+
+class EpCubeCoordinatorEntity(CoordinatorEntity):
+    """Entità legata ad un singolo EP Cube, identificato dal numero di serie.
+
+    Scrive lo stato solo quando cambiano le chiavi che legge: `_watched_keys`
+    elenca le chiavi di `full_data` da cui dipende lo stato; None significa
+    che l'entità va aggiornata ad ogni ciclo. `_process_data` ricalcola i
+    valori dell'entità una sola volta, prima di scrivere lo stato.
+    """
+
+    _watched_keys = None
+
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator)
+        self._sn = sn
+        self._attr_device_info = epcube_device_info(sn, coordinator.client.base_url)
+
+    @property
+    def device_data(self):
+        if not self.coordinator.data:
+            return {}
+        return self.coordinator.data["devices"].get(self._sn, {})
+
+    @property
+    def available(self):
+        return super().available and self.coordinator.device_available.get(self._sn, True)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        changed = self.coordinator.changed_keys
+        if self._watched_keys is not None and changed is not None:
+            device_changed = changed.get(self._sn)
+            if device_changed is not None and device_changed.isdisjoint(self._watched_keys):
+                return
+        self._process_data()
+        super()._handle_coordinator_update()
+
+    def _process_data(self):
+        """Aggiorna i valori calcolati dai dati del coordinator."""
@@ -0,0 +1,158 @@
+from collections import deque
+from types import SimpleNamespace
+
+import aiohttp
+import asyncio
+
+# Campioni conservati per calcolare i percentili
+METRICS_WINDOW = 200
+
+REQUEST_PHASES = ("dns", "connect", "ttfb", "body", "parse", "total")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def _summary(samples):
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "max": max(samples) if samples else None,
+    }
+
+
+class RequestTiming(SimpleNamespace):
+    """Tempi (ms) di una singola richiesta, riempiti dal TraceConfig e dal client."""
+
+    def __init__(self):
+        super().__init__(start=None, dns_start=None, connect_start=None, dns=0.0, connect=0.0, ttfb=None)
+
+
+def create_trace_config():
+    """TraceConfig aiohttp che misura DNS, connessione e tempo al primo byte."""
+
+    def _now():
+        return asyncio.get_running_loop().time()
+
+    async def on_request_start(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming):
+            timing.start = _now()
+
+    async def on_dns_start(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming):
+            timing.dns_start = _now()
+
+    async def on_dns_end(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming) and timing.dns_start is not None:
+            timing.dns = (_now() - timing.dns_start) * 1000
+
+    async def on_connect_start(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming):
+            timing.connect_start = _now()
+
+    async def on_connect_end(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming) and timing.connect_start is not None:
+            timing.connect = (_now() - timing.connect_start) * 1000
+
+    async def on_request_end(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if isinstance(timing, RequestTiming) and timing.start is not None:
+            timing.ttfb = (_now() - timing.start) * 1000 - timing.dns - timing.connect
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connect_start)
+    trace_config.on_connection_create_end.append(on_connect_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class EpCubeMetrics:
+    """Istogrammi di latenza per endpoint e diagnostica dei refresh."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.refresh_durations = deque(maxlen=METRICS_WINDOW)
+        self.processing_durations = deque(maxlen=METRICS_WINDOW)
+        self.bytes_received = 0
+        self.keys_merged = 0
+        self.requests = 0
+        self.errors = 0
+        self._processing = 0.0
+
+    def _phases(self, endpoint):
+        phases = self.endpoints.get(endpoint)
+        if phases is None:
+            phases = self.endpoints[endpoint] = {
+                phase: deque(maxlen=METRICS_WINDOW) for phase in REQUEST_PHASES
+            }
+        return phases
+
+    def record_request(self, endpoint, timing, body_ms, nbytes):
+        """Registra le fasi di rete; `total` è il tempo speso sul cloud."""
+        phases = self._phases(endpoint)
+        phases["dns"].append(timing.dns)
+        phases["connect"].append(timing.connect)
+        if timing.ttfb is not None:
+            phases["ttfb"].append(timing.ttfb)
+        phases["body"].append(body_ms)
+        phases["total"].append(timing.dns + timing.connect + (timing.ttfb or 0.0) + body_ms)
+        self.bytes_received += nbytes
+        self.requests += 1
+
+    def record_parse(self, endpoint, parse_ms):
+        self._phases(endpoint)["parse"].append(parse_ms)
+        self._processing += parse_ms / 1000
+
+    def record_error(self):
+        self.errors += 1
+
+    def add_processing(self, seconds):
+        self._processing += seconds
+
+    def record_refresh(self, seconds, keys_merged):
+        self.refresh_durations.append(seconds * 1000)
+        self.processing_durations.append(self._processing * 1000)
+        self._processing = 0.0
+        self.keys_merged = keys_merged
+
+    def refresh_percentile(self, pct):
+        return percentile(self.refresh_durations, pct)
+
+    def processing_percentile(self, pct):
+        return percentile(self.processing_durations, pct)
+
+    def cloud_percentile(self, pct):
+        samples = [
+            sample
+            for phases in self.endpoints.values()
+            for sample in phases["total"]
+        ]
+        return percentile(samples, pct)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_received": self.bytes_received,
+            "keys_merged": self.keys_merged,
+            "refresh_ms": _summary(self.refresh_durations),
+            "processing_ms": _summary(self.processing_durations),
+            "endpoints_ms": {
+                endpoint: {phase: _summary(samples) for phase, samples in phases.items()}
+                for endpoint, phases in self.endpoints.items()
+            },
+        }
@@ -1,9 +1,8 @@
 from homeassistant.components.number import NumberEntity, NumberEntityDescription
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.const import EntityCategory
 from .const import DOMAIN
+from .entity import EpCubeCoordinatorEntity
 
-import aiohttp
 import logging
 
 _LOGGER = logging.getLogger(__name__)
@@ -15,16 +14,19 @@ SOC_KEYS = {
 
 async def async_setup_entry(hass, entry, async_add_entities):
     coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
-    async_add_entities([
-        EpCubeDynamicSocNumber(coordinator, entry),
-        EpCubeStaticSocNumber(coordinator, entry, "selfconsumptioinreservesoc", "SOC Autoconsumo", 0, 100),
-        EpCubeStaticSocNumber(coordinator, entry, "backuppowerreservesoc", "SOC Backup", 50, 100),
-    ], True)
-
-
-class EpCubeDynamicSocNumber(CoordinatorEntity, NumberEntity):
-    def __init__(self, coordinator, entry):
-        super().__init__(coordinator)
+    entities = []
+    for sn in coordinator.sns:
+        entities += [
+            EpCubeDynamicSocNumber(coordinator, entry, sn),
+            EpCubeStaticSocNumber(coordinator, entry, sn, "selfconsumptioinreservesoc", "SOC Autoconsumo", 0, 100),
+            EpCubeStaticSocNumber(coordinator, entry, sn, "backuppowerreservesoc", "SOC Backup", 50, 100),
+        ]
+    async_add_entities(entities)
+
+
+class EpCubeDynamicSocNumber(EpCubeCoordinatorEntity, NumberEntity):
+    def __init__(self, coordinator, entry, sn):
+        super().__init__(coordinator, sn)
         self.entry = entry
         self.coordinator = coordinator
         self.entity_description = NumberEntityDescription(
@@ -33,22 +35,13 @@ class EpCubeDynamicSocNumber(CoordinatorEntity, NumberEntity):
             icon="mdi:battery-charging",
             entity_category=EntityCategory.CONFIG,
         )
-        self._attr_unique_id = "epcube_soc_dynamic"
+        self._attr_unique_id = f"epcube_{sn}_soc_dynamic"
+        self._watched_keys = ("workstatus", *SOC_KEYS)
         self._attr_step = 1
         self._attr_native_unit_of_measurement = "%"
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-            "entry_type": "service",
-            "configuration_url": "https://monitoring-us.epcube.com/"
-        }
-
-        if coordinator.data and coordinator.data.get("data"):
-            mode = str(coordinator.data["data"].get("workstatus", ""))
-        else:
-            mode = ""
+        self._queue = coordinator.commands[sn]
+
+        mode = str(self.device_data.get("workstatus", ""))
 
         if mode == "1":
             self._attr_min_value = 0
@@ -58,7 +51,7 @@ class EpCubeDynamicSocNumber(CoordinatorEntity, NumberEntity):
 
     @property
     def _mode(self):
-        return str(self.coordinator.data.get("data", {}).get("workstatus", ""))
+        return str(self._queue.value("workstatus") or "")
 
     @property
     def _soc_key(self):
@@ -69,52 +62,22 @@ class EpCubeDynamicSocNumber(CoordinatorEntity, NumberEntity):
 
     @property
     def native_value(self):
-        value = self.coordinator.data.get("data", {}).get(self._soc_key.lower())
+        if self._soc_key is None:
+            return None
+        value = self._queue.value(self._soc_key.lower())
         _LOGGER.debug("SOC attuale (%s): %s", self._soc_key.lower(), value)
         return int(value) if value is not None else None
-    
-    
-    
 
     async def async_set_native_value(self, value: float):
-        dev_id = self.coordinator.data.get("data", {}).get("devid")
-        work_status = self._mode
-
-        key_original = self._soc_key
-        payload = {
-            "devId": dev_id,
-            "workStatus": str(work_status),
-            "weatherWatch": "0",
-            "onlySave": "0",
-            key_original: str(int(value)),
-        }
-
-        _LOGGER.debug("Invio payload switchMode (SOC dinamico): %s", payload)
-        await self._post_switch_mode(payload)
-
-    async def _post_switch_mode(self, payload):
-        url = "https://monitoring-us.epcube.com/api/device/switchMode"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": self.entry.data.get("token"),
-            "User-Agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-            "Accept": "*/*",
-            "Accept-Language": "it-IT",
-            "Accept-Encoding": "gzip, deflate, br"
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    _LOGGER.error("Errore nell'invio SoC EP Cube dinamico: %s", text)
-                else:
-                    _LOGGER.info("SOC dinamico aggiornato correttamente. Risposta: %s", text)
-                    await self.coordinator.async_request_refresh()
-
-
-class EpCubeStaticSocNumber(CoordinatorEntity, NumberEntity):
-    def __init__(self, coordinator, entry, key, name, min_val, max_val):
-        super().__init__(coordinator)
+        if self._soc_key is None:
+            _LOGGER.warning("Modalità %s senza SOC di riserva impostabile", self._mode)
+            return
+        await self._queue.async_update({self._soc_key.lower(): str(int(value))})
+
+
+class EpCubeStaticSocNumber(EpCubeCoordinatorEntity, NumberEntity):
+    def __init__(self, coordinator, entry, sn, key, name, min_val, max_val):
+        super().__init__(coordinator, sn)
         self.entry = entry
         self.coordinator = coordinator
         self.original_key = SOC_KEYS.get(key.lower(), key)
@@ -124,59 +87,20 @@ class EpCubeStaticSocNumber(CoordinatorEntity, NumberEntity):
             icon="mdi:battery-charging",
             entity_category=EntityCategory.CONFIG,
         )
-        self._attr_unique_id = f"epcube_soc_{self.original_key}"
+        self._attr_unique_id = f"epcube_{sn}_soc_{self.original_key}"
+        self._watched_keys = (self.original_key.lower(),)
         self._attr_min_value = min_val
         self._attr_max_value = max_val
         self._attr_step = 1
         self._attr_native_unit_of_measurement = "%"
         self._attr_mode = "slider"
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-            "entry_type": "service",
-            "configuration_url": "https://monitoring-us.epcube.com/"
-        }
+        self._queue = coordinator.commands[sn]
 
     @property
     def native_value(self):
-        value = self.coordinator.data.get("data", {}).get(self.original_key.lower())
+        value = self._queue.value(self.original_key.lower())
         _LOGGER.debug("SOC statico attuale (%s): %s", self.original_key.lower(), value)
         return int(value) if value is not None else None
-    
 
     async def async_set_native_value(self, value: float):
-        dev_id = self.coordinator.data.get("data", {}).get("devid")
-        work_status = self.coordinator.data.get("data", {}).get("workstatus")
-        
-
-        payload = {
-            "devId": dev_id,
-            "workStatus": str(work_status),
-            "weatherWatch": "0",
-            "onlySave": "0",
-            self.original_key: str(int(value)),
-        }
-
-        _LOGGER.debug("Invio payload switchMode (SOC statico): %s", payload)
-        await self._post_switch_mode(payload)
-
-    async def _post_switch_mode(self, payload):
-        url = "https://monitoring-us.epcube.com/api/device/switchMode"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": self.entry.data.get("token"),
-            "User-Agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-            "Accept": "*/*",
-            "Accept-Language": "it-IT",
-            "Accept-Encoding": "gzip, deflate, br"
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    _LOGGER.error("Errore nell'invio SoC EP Cube statico: %s", text)
-                else:
-                    _LOGGER.info("SOC statico aggiornato correttamente. Risposta: %s", text)
-                    await self.coordinator.async_request_refresh()
+        await self._queue.async_update({self.original_key.lower(): str(int(value))})
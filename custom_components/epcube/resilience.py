@@ -0,0 +1,104 @@
+import asyncio
+import random
+import time
+
+from .api import EpCubeApiError
+from .const import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_OPEN_TIME,
+    RATE_LIMIT_RATE,
+    RATE_LIMIT_BURST,
+)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class BackoffPending(EpCubeApiError):
+    """Richiesta non inviata: la chiave aspetta ancora la fine del backoff."""
+
+
+class Backoff:
+    """Backoff esponenziale con jitter, per chiave (dispositivo/sorgente)."""
+
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+        self._base = base
+        self._maximum = maximum
+        self._failures = {}
+        self._retry_at = {}
+
+    def ready(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        return now >= self._retry_at.get(key, 0.0)
+
+    def failure(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        delay = min(self._maximum, self._base * 2 ** (failures - 1))
+        # "Equal jitter": metà fissa, metà casuale
+        self._retry_at[key] = now + delay / 2 + random.uniform(0, delay / 2)
+        return self._retry_at[key] - now
+
+    def success(self, key):
+        self._failures.pop(key, None)
+        self._retry_at.pop(key, None)
+
+    @property
+    def retries_pending(self):
+        return len(self._failures)
+
+
+class TokenBucket:
+    """Limite di richieste per account, condiviso da tutte le config entry."""
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self.throttled += 1
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """Apre il circuito dopo troppi refresh falliti; un probe successivo lo richiude."""
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, open_time=BREAKER_OPEN_TIME):
+        self._threshold = threshold
+        self._open_time = open_time
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+
+    def allow_request(self):
+        if self.state == BREAKER_OPEN and time.monotonic() - self._opened_at >= self._open_time:
+            self.state = BREAKER_HALF_OPEN
+        return self.state != BREAKER_OPEN
+
+    def record_success(self):
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == BREAKER_HALF_OPEN or self.consecutive_failures >= self._threshold:
+            self.state = BREAKER_OPEN
+            self._opened_at = time.monotonic()
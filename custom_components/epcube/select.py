@@ -1,10 +1,9 @@
 from homeassistant.components.select import SelectEntity, SelectEntityDescription
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.entity import EntityCategory
 from .const import DOMAIN
+from .entity import EpCubeCoordinatorEntity
 
 import logging
-import aiohttp
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,12 +17,12 @@ REVERSE_MODE_MAP = {v: k for k, v in MODE_MAP.items()}
 
 async def async_setup_entry(hass, entry, async_add_entities):
     coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
-    async_add_entities([EpCubeModeSelect(coordinator, entry)], True)
+    async_add_entities([EpCubeModeSelect(coordinator, entry, sn) for sn in coordinator.sns])
 
 
-class EpCubeModeSelect(CoordinatorEntity, SelectEntity):
-    def __init__(self, coordinator, entry):
-        super().__init__(coordinator)
+class EpCubeModeSelect(EpCubeCoordinatorEntity, SelectEntity):
+    def __init__(self, coordinator, entry, sn):
+        super().__init__(coordinator, sn)
         self.coordinator = coordinator
         self.entry = entry
         self.entity_description = SelectEntityDescription(
@@ -32,17 +31,14 @@ class EpCubeModeSelect(CoordinatorEntity, SelectEntity):
             icon="mdi:transmission-tower",
             entity_category=EntityCategory.CONFIG
         )
-        self._attr_unique_id = "epcube_mode_select"
+        self._attr_unique_id = f"epcube_{sn}_mode_select"
+        self._watched_keys = ("workstatus",)
         self._attr_options = list(MODE_MAP.values())
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EP CUBE",
-            "manufacturer": "CanadianSolar",
-        }
+        self._queue = coordinator.commands[sn]
 
     @property
     def current_option(self):
-        raw = str(self.coordinator.data["data"].get("workstatus"))
+        raw = str(self._queue.value("workstatus"))
         return MODE_MAP.get(raw, "Sconosciuto")
 
     async def async_select_option(self, option: str):
@@ -51,42 +47,5 @@ class EpCubeModeSelect(CoordinatorEntity, SelectEntity):
             _LOGGER.warning("Modalità non valida selezionata: %s", option)
             return
 
-        payload = {
-            "devId": self.coordinator.data["data"].get("devid"),
-            "workStatus": mode,
-            "weatherWatch": "0",
-            "onlySave": "0",
-        }
-
-        # Aggiungi il SOC corretto in base alla modalità
-        if mode == "1":  # Autoconsumo
-            payload["selfConsumptioinReserveSoc"] = str(self.coordinator.data["data"].get("selfconsumptioinreservesoc", 15))
-        elif mode == "3":  # Backup
-            payload["backupPowerReserveSoc"] = str(self.coordinator.data["data"].get("backuppowerreservesoc", 50))
-        
-
-        _LOGGER.debug("Invio payload switchMode (modalità): %s", payload)
-        await self._post_switch_mode(payload)
-
-    async def _post_switch_mode(self, payload):
-        url = "https://monitoring-us.epcube.com/api/device/switchMode"
-        headers = {
-            "accept": "*/*",
-            "content-type": "application/json",
-            "authorization": self.entry.data.get("token"),
-            "user-agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-            "accept-language": "it-IT",
-            "accept-encoding": "gzip, deflate, br",
-        }
-
-        _LOGGER.debug("Invio payload switchMode (modalità): %s", payload)
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    _LOGGER.error("Errore nel cambio modalità EP Cube: %s", text)
-                else:
-                    _LOGGER.info("Modalità EP Cube aggiornata correttamente. Risposta: %s", text)
-                    await self.coordinator.async_request_refresh()
-    
+        # Il SOC di riserva della nuova modalità viene aggiunto dalla coda
+        await self._queue.async_update({"workstatus": mode})
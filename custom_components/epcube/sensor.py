@@ -1,352 +1,357 @@
-from homeassistant.const import UnitOfEnergy, UnitOfPower, PERCENTAGE
-from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.const import UnitOfEnergy, UnitOfPower, UnitOfTime, UnitOfInformation, PERCENTAGE
 from homeassistant.util import dt as dt_util
 from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass, SensorEntityDescription, SensorEntity
-from homeassistant.helpers.entity import EntityCategory, Entity
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed, CoordinatorEntity
-from homeassistant.helpers.entity_registry import async_get, RegistryEntryDisabler
-from homeassistant.helpers.restore_state import RestoreEntity
-
-from .state import EpCubeDataState
-from .const import DOMAIN, DEFAULT_SCAN_INTERVAL, CONF_ENABLE_TOTAL, CONF_ENABLE_ANNUAL, CONF_ENABLE_MONTHLY
-import aiohttp
-import async_timeout
-from datetime import timedelta, datetime, date
+from homeassistant.helpers.entity import EntityCategory
+from homeassistant.helpers.entity_registry import async_get, async_entries_for_config_entry, RegistryEntryDisabler
+from homeassistant.core import callback
+
+from .entity import EpCubeCoordinatorEntity
+from .const import DOMAIN, CONF_ENABLE_TOTAL, CONF_ENABLE_ANNUAL, CONF_ENABLE_MONTHLY
+from .resilience import BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+from .derived import BATTERY_CHARGING, BATTERY_DISCHARGING, BATTERY_IDLE
+from .state import INTEGRATED_KEY
+from dataclasses import dataclass, replace
+from functools import lru_cache
 
 import logging
 _LOGGER = logging.getLogger(__name__)
 
-def generate_sensors(data, enable_total=False, enable_annual=False, enable_monthly=False):
-    """Genera i sensori per i dati ricevuti."""
-    sensors = []
-
-    suffix_map = {
-        "_total": "Totale",
-        "_annual": "Annuale",
-        "_monthly": "Mensile"
-    }
-
-    disabled_by_variant = {
-        "batterysoc": ["annual", "monthly", "total"],
-        "solarflow": ["annual", "monthly", "total"],
-        "solarpower": ["annual", "monthly", "total"],
-        "backuppower": ["annual", "monthly", "total"],
-        "backupflowpower": ["annual", "monthly", "total"],
-        "gridhalfpower": ["annual", "monthly", "total"],
-        "gridtotalpower": ["annual", "monthly", "total"],
-        "gridpower": ["annual", "monthly", "total"],
-        "solardcelectricity": ["annual", "monthly", "total"],
-        "solaracelectricity": ["annual", "monthly", "total"],
-    }
-    diagnostic_sensors = [
+# Energia integrata dalle potenze live: (canale, 0 = positiva / 1 = negativa, nome)
+INTEGRATED_ENERGY_SENSORS = {
+    "integrated_solar_energy": ("solar", 0, "Solar Energy (Integrated)"),
+    "integrated_grid_import": ("grid", 0, "Grid Import (Integrated)"),
+    "integrated_grid_export": ("grid", 1, "Grid Export (Integrated)"),
+    "integrated_backup_energy": ("backup", 0, "Backup Energy (Integrated)"),
+}
+
+# Aggregati delle potenze live: nomi dei canali e indice della statistica
+POWER_AGGREGATE_CHANNELS = {
+    "battery": "Battery Power",
+    "solar": "Solar Power",
+    "grid": "Grid Power",
+    "backup": "Backup Power",
+}
+POWER_AGGREGATE_STATS = {"min": 0, "max": 1, "mean": 2}
+
+# Sensori diagnostici sui tempi di refresh e sulla latenza del cloud
+METRIC_SENSORS = {
+    "refresh_duration_p50": ("Refresh Duration p50", lambda m: m.refresh_percentile(50)),
+    "refresh_duration_p95": ("Refresh Duration p95", lambda m: m.refresh_percentile(95)),
+    "cloud_latency_p95": ("Cloud Latency p95", lambda m: m.cloud_percentile(95)),
+    "processing_p95": ("Local Processing p95", lambda m: m.processing_percentile(95)),
+}
+
+@dataclass(frozen=True, slots=True)
+class SensorSpec:
+    """Metadati di una chiave del payload; `scale` moltiplica il valore grezzo."""
+
+    unit: str | None = None
+    device_class: SensorDeviceClass | None = None
+    state_class: SensorStateClass | None = None
+    category: EntityCategory | None = None
+    enabled: bool = True
+    scale: float | None = None
+    # False = niente sensori _total/_annual/_monthly per questa chiave
+    variants: bool = True
+    # Valori ammessi dei sensori enum
+    options: tuple[str, ...] | None = None
+
+
+@dataclass(frozen=True, kw_only=True)
+class EpCubeSensorEntityDescription(SensorEntityDescription):
+    scale: float | None = None
+
+
+#ectricity = kWh
+#power (i numeri arrivano in decine di watt) = W
+ENERGY = SensorSpec(UnitOfEnergy.KILO_WATT_HOUR, SensorDeviceClass.ENERGY, SensorStateClass.TOTAL_INCREASING)
+POWER = SensorSpec(UnitOfPower.WATT, SensorDeviceClass.POWER, SensorStateClass.MEASUREMENT, scale=10)
+RESERVE_SOC = SensorSpec(PERCENTAGE, None, SensorStateClass.MEASUREMENT, EntityCategory.DIAGNOSTIC)
+DIAGNOSTIC = SensorSpec(category=EntityCategory.DIAGNOSTIC)
+HIDDEN_DIAGNOSTIC = SensorSpec(category=EntityCategory.DIAGNOSTIC, enabled=False)
+PLAIN = SensorSpec()
+
+LIVE_POWER = replace(POWER, variants=False)
+DERIVED_POWER = SensorSpec(UnitOfPower.KILO_WATT, SensorDeviceClass.POWER, SensorStateClass.MEASUREMENT, variants=False)
+DERIVED_DURATION = SensorSpec(UnitOfTime.MINUTES, SensorDeviceClass.DURATION, SensorStateClass.MEASUREMENT, variants=False)
+
+SENSOR_TABLE = {
+    # Potenze live
+    "solarpower": LIVE_POWER,
+    "backuppower": LIVE_POWER,
+    "gridtotalpower": LIVE_POWER,
+    "gridpower": LIVE_POWER,
+    #Sensori ancora senza utilità o con valori uguali ad altri
+    "gridhalfpower": replace(LIVE_POWER, enabled=False),
+    "solarflow": replace(LIVE_POWER, enabled=False),
+    "backupflowpower": replace(LIVE_POWER, enabled=False),
+    "solaracpower": POWER,
+    "solardcpower": POWER,
+    "generatorpower": POWER,
+    "generatorflowpower": POWER,
+    "evpower": POWER,
+    "evflowpower": POWER,
+    "nonbackuppower": POWER,
+    "nonbackupflowpower": POWER,
+    "batterysoc": SensorSpec(PERCENTAGE, SensorDeviceClass.BATTERY, SensorStateClass.MEASUREMENT, variants=False),
+
+    # Energia
+    "solarelectricity": ENERGY,
+    "solardcelectricity": replace(ENERGY, variants=False),
+    "solaracelectricity": replace(ENERGY, variants=False),
+    "gridelectricity": ENERGY,
+    "gridelectricityfrom": ENERGY,
+    "gridelectricityto": ENERGY,
+    "backupelectricity": ENERGY,
+    "nonbackupelectricity": ENERGY,
+    "generatorelectricity": ENERGY,
+    "evelectricity": ENERGY,
+    "batterycurrentelectricity": SensorSpec(UnitOfEnergy.KILO_WATT_HOUR, None, SensorStateClass.MEASUREMENT),
+
+    # Riserve di carica impostate con switchMode
+    "backuppowerreservesoc": RESERVE_SOC,
+    "selfconsumptioinreservesoc": RESERVE_SOC,
+    "evchargerreservesoc": RESERVE_SOC,
+
+    # Metriche derivate calcolate una volta per refresh (derived.py)
+    "battery_power": DERIVED_POWER,
+    "house_load_power": DERIVED_POWER,
+    "grid_import_power": DERIVED_POWER,
+    "grid_export_power": DERIVED_POWER,
+    "battery_direction": SensorSpec(
+        device_class=SensorDeviceClass.ENUM,
+        variants=False,
+        options=(BATTERY_CHARGING, BATTERY_DISCHARGING, BATTERY_IDLE),
+    ),
+    "self_sufficiency": SensorSpec(PERCENTAGE, None, SensorStateClass.MEASUREMENT, variants=False),
+    "battery_time_to_full": DERIVED_DURATION,
+    "battery_time_to_empty": DERIVED_DURATION,
+
+    # Diagnostica
+    **dict.fromkeys((
         "status", "systemstatus", "workstatus", "isalert", "isfault",
         "backuploadsmode", "backuptype", "deftimezone", "devid",
         "faultwarningtype", "fromtimezone", "fromtype", "generatorlight",
         "gridlight", "isnewdevice", "off_on_grid_hint", "payloadversion",
-        "ressnumber", "version", "evlight", "defcreatetime", "fromcreatetime",
-        "gridpowerfailurenum", "activationdata", "warrantydata", "modeltype",
-        "allowchargingxiagrid", "daylightsavingtime", "offgridpowersupplytime",
-        "onlysave", "selfhelprate",
-        #Sensori di 'tempo di utilizzo'
-        "activeweek", "activeweeknonworkday", "activeweeknonworkday",
-        "daylightactiveWeek", "dayLightActiveweeknonWorkday", "daytype",
-        "isDayLightSaving", "weatherWatch",
-        "treenum", "coal",
-    ]
-
-    disabled_by_default = [
+        "ressnumber", "version", "evlight", "gridpowerfailurenum",
+        "activationdata", "warrantydata", "modeltype", "selfhelprate",
+    ), DIAGNOSTIC),
+    **dict.fromkeys((
         "defcreatetime", "fromcreatetime",
         "allowchargingxiagrid", "daylightsavingtime", "offgridpowersupplytime",
-        "onlysave",
-        #disabilito i sensori 'tempo di utilizzo'
-        "activeweek", "activeweeknonworkday", "activeWeekNonWorkDay",
-        "daylightactiveweek", "dayLightActiveWeekNonWorkDay", "dayType",
-        "isDayLightSaving", "weatherWatch", "treenum", "coal",
-        "defcreatetime", "fromcreatetime",
-        #Sensori ancora senza utilità o con valori uguali ad altri
-        "gridhalfpower", "solarflow", "backupflowpower",
-    ]
+        "onlysave", "treenum", "coal",
+        #Sensori 'tempo di utilizzo'
+        "activeweek", "activeweeknonworkday", "daylightactiveweek",
+        "daylightactiveweeknonworkday", "daytype", "isdaylightsaving", "weatherwatch",
+    ), HIDDEN_DIAGNOSTIC),
+}
+
+VARIANT_OPTIONS = {
+    "total": CONF_ENABLE_TOTAL,
+    "annual": CONF_ENABLE_ANNUAL,
+    "monthly": CONF_ENABLE_MONTHLY,
+}
+
+
+@lru_cache(maxsize=None)
+def _heuristic_spec(base_key):
+    """Classificazione di ripiego per le chiavi non presenti in SENSOR_TABLE."""
+    if "electricity" in base_key:
+        if "battery" in base_key:
+            return SENSOR_TABLE["batterycurrentelectricity"]
+        return ENERGY
+    if "soc" in base_key:
+        return RESERVE_SOC
+    if "flow" in base_key or "power" in base_key:
+        return POWER
+    return PLAIN
+
+
+def sensor_spec(base_key):
+    spec = SENSOR_TABLE.get(base_key)
+    return spec if spec is not None else _heuristic_spec(base_key)
+
+
+def split_variant(key):
+    """Divide una chiave in (chiave base, variante) con variante total/annual/monthly o ""."""
+    base_key, _, variant = key.rpartition("_")
+    if base_key and variant in VARIANT_OPTIONS:
+        return base_key, variant
+    return key, ""
 
-    diagnostic_sensors = [s.lower() for s in diagnostic_sensors]
-    disabled_by_default = [s.lower() for s in disabled_by_default]
 
-    disabled_by_variant = {
-        k.lower(): [v.lower() for v in vals]
-        for k, vals in disabled_by_variant.items()
-    }
+def generate_sensors(data, enable_total=False, enable_annual=False, enable_monthly=False):
+    """Genera i sensori per i dati ricevuti."""
+    variant_enabled = {"total": enable_total, "annual": enable_annual, "monthly": enable_monthly}
+    sensors = []
 
     for key, value in data.items():
-        key_lower = key.lower()
-        entity_category = None
-
-        suffix_label = ""
-        base_key = key_lower
-        for suffix, label in suffix_map.items():
-            if key_lower.endswith(suffix):
-                base_key = key_lower.removesuffix(suffix)
-                suffix_label = suffix[1:]
-                break
-
-        if suffix_label in disabled_by_variant.get(base_key, []):
+        base_key, variant = split_variant(key.lower())
+        spec = sensor_spec(base_key)
+        if variant and not spec.variants:
             continue
 
-        if base_key in diagnostic_sensors:
-            entity_category = EntityCategory.DIAGNOSTIC
-
-        #ectricity = kWh
-        #power = kW (none)
-        #power (i numeri arrivano in watt) = W
-        
-        if "electricity" in base_key:
-            unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-            device_class = SensorDeviceClass.ENERGY
-            state_class = SensorStateClass.TOTAL_INCREASING
-            
-            if 'battery' in base_key:
-                device_class = None
-                state_class = SensorStateClass.MEASUREMENT
-
-            
-        elif "flow" in base_key or "power" in base_key:
-            device_class = SensorDeviceClass.POWER
-            unit_of_measurement = UnitOfPower.WATT
-            state_class = SensorStateClass.MEASUREMENT
-
-        elif "soc" in base_key:
-            unit_of_measurement = PERCENTAGE
-            state_class = SensorStateClass.MEASUREMENT
-
-            if base_key == "batterysoc":
-                device_class = SensorDeviceClass.BATTERY
-                entity_category = None
-            else:
-                device_class = None
-                entity_category = EntityCategory.DIAGNOSTIC
-
-        else:
-            device_class = None
-            unit_of_measurement = None
-            state_class = None
-
-        if base_key == "batterysoc":
-            entity_registry_enabled_default = True
-
-        elif key_lower.endswith("_annual"):
-            entity_registry_enabled_default = enable_annual
-        elif key_lower.endswith("_monthly"):
-            entity_registry_enabled_default = enable_monthly
-        elif key_lower.endswith("_total"):
-            entity_registry_enabled_default = enable_total
-
+        if variant:
+            enabled = variant_enabled[variant]
         elif value is None:
-            entity_registry_enabled_default = False
-        elif base_key in disabled_by_default:
-            entity_registry_enabled_default = False
+            enabled = False
         else:
-            entity_registry_enabled_default = True
+            enabled = spec.enabled
 
-        translation_key = f"{base_key}_{suffix_label}" if suffix_label else base_key
-        sensor = SensorEntityDescription(
+        sensors.append(EpCubeSensorEntityDescription(
             key=key,
-            translation_key=translation_key,
-            native_unit_of_measurement=unit_of_measurement,
-            device_class=device_class,
-            entity_category=entity_category,
-            state_class=state_class,
-            entity_registry_enabled_default=entity_registry_enabled_default
-        )
-
-        sensors.append(sensor)
+            translation_key=f"{base_key}_{variant}" if variant else base_key,
+            native_unit_of_measurement=spec.unit,
+            device_class=spec.device_class,
+            entity_category=spec.category,
+            state_class=spec.state_class,
+            entity_registry_enabled_default=enabled,
+            scale=spec.scale,
+            options=list(spec.options) if spec.options else None,
+        ))
 
     return sensors
 
-async def fetch_device_info(session, token, dev_id):
-    url = f"https://monitoring-us.epcube.com/api/device/userDeviceInfo?devId={dev_id}"
-    headers = {
-        "accept": "*/*",
-        "accept-language": "it-IT",
-        "accept-encoding": "gzip, deflate, br",
-        "user-agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-        "authorization": f"Bearer {token}"
-    }
-
-    async with session.get(url, headers=headers) as resp:
-        json_data = await resp.json()
-        raw_data = json_data.get("data", {})
-        normalized = {k.lower(): v for k, v in raw_data.items()}
-        return normalized
-
-async def fetch_epcube_stats(session, token, dev_id, date_str, scope_type):
-    url = f"https://monitoring-us.epcube.com/api/device/queryDataElectricityV2?devId={dev_id}&queryDateStr={date_str}&scopeType={scope_type}"
-    headers = {
-        "accept": "*/*",
-        "accept-language": "it-IT",
-        "accept-encoding": "gzip, deflate, br",
-        "user-agent": "ReservoirMonitoring/2.1.0 (iPhone; iOS 18.3.2; Scale/3.00)",
-        "authorization": f"Bearer {token}"
-    }
-
-    async with session.get(url, headers=headers) as resp:
-        json_data = await resp.json()
-        raw_data = json_data.get("data", {})
-        normalized = {k.lower(): v for k, v in raw_data.items()}
-        return normalized
-
-async def async_update_data_with_stats(session, url, headers, dev_id_sn, token, hass, entry_id):
-    try:
-        with async_timeout.timeout(15):
-            async with session.get(url, headers=headers) as resp:
-                if resp.content_type != "application/json":
-                    raise UpdateFailed(f"Tipo MIME non gestito: {resp.content_type}")
-
-                live_data = await resp.json()
-                full_data_raw = live_data.get("data", {})
-                full_data = {k.lower(): v for k, v in full_data_raw.items()}
-                real_dev_id = full_data.get("devid")
-
-                now = datetime.now()
-                year_str = str(now.year)
-                month_str = now.strftime("%Y-%m")
-                today_str = now.strftime("%Y-%m-%d")
-
-                live_data = await fetch_epcube_stats(session, token, real_dev_id, today_str, 1)
-                total_data = await fetch_epcube_stats(session, token, real_dev_id, year_str, 0)
-                annual_data = await fetch_epcube_stats(session, token, real_dev_id, year_str, 3)
-                monthly_data = await fetch_epcube_stats(session, token, real_dev_id, month_str, 2)
-
-                device_info = await fetch_device_info(session, token, real_dev_id)
-
-                switch_url = f"https://monitoring-us.epcube.com/api/device/getSwitchMode?devId={real_dev_id}"
-                async with session.get(switch_url, headers=headers) as switch_resp:
-                    switch_json = await switch_resp.json()
-                    switch_data = switch_json.get("data", {})
-                    for k, v in switch_data.items():
-                        full_data[k.lower()] = v
-
-                for k in ["activationdata", "warrantydata", "modeltype", "batterycapacity"]:
-                    full_data[k] = device_info.get(k)
-
-                INCLUDED_LIVE_KEYS = {
-                    "gridelectricity", "gridelectricityfrom", "gridelectricityto",
-                    "solarelectricity", "backupelectricity", "selfhelprate", "treenum", "coal",
-                }
-
-                for k, v in live_data.items():
-                    key_lower = k.lower()
-                    if key_lower in INCLUDED_LIVE_KEYS:
-                        full_data[key_lower] = v
-
-                for k, v in total_data.items():
-                    full_data[f"{k}_total"] = v
-                for k, v in annual_data.items():
-                    full_data[f"{k}_annual"] = v
-                for k, v in monthly_data.items():
-                    full_data[f"{k}_monthly"] = v
-
-                battery_now = full_data.get("batterycurrentelectricity")
-                if battery_now is not None:
-                    try:
-                        state: EpCubeDataState = hass.data[DOMAIN][entry_id]["state"]
-                        state.update(float(battery_now))
-                    except Exception as e:
-                        _LOGGER.warning("Errore nel calcolo del SOC cumulativo: %s", e)
-
-                return {"data": full_data}
-
-    except Exception as err:
-        raise UpdateFailed(f"Errore nell'aggiornamento dei dati: {err}")
-
 async def async_setup_entry(hass, entry, async_add_entities):
     coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
     options = entry.options
-    enable_total = options.get(CONF_ENABLE_TOTAL, False)
-    enable_annual = options.get(CONF_ENABLE_ANNUAL, False)
-    enable_monthly = options.get(CONF_ENABLE_MONTHLY, False)
-
-    if not coordinator.data or "data" not in coordinator.data:
-        return
-
-    filtered_data = coordinator.data["data"]
-    
-    sensors = generate_sensors(
-        filtered_data,
-        enable_total=enable_total,
-        enable_annual=enable_annual,
-        enable_monthly=enable_monthly
-    )
+    registry = async_get(hass)
 
+    primary_sn = coordinator.sns[0]
     entities = [
-        EpCubeSensor(coordinator, sensor) for sensor in sensors
+        EpCubeLastUpdateSensor(coordinator, primary_sn),
+        EpCubeBytesReceivedSensor(coordinator, primary_sn),
+        EpCubeKeysMergedSensor(coordinator, primary_sn),
+        EpCubeCircuitBreakerSensor(coordinator, primary_sn),
+        EpCubeRetriesSensor(coordinator, primary_sn),
     ] + [
-        EpCubeLastUpdateSensor(coordinator),
-        EpCubeBatteryChargeSensor(coordinator),
-        EpCubeBatteryDischargeSensor(coordinator),
-        EpCubeBatteryDailyChargeSensor(coordinator),
-        EpCubeBatteryDailyDischargeSensor(coordinator),
-        EpCubeBatteryPowerSensor(coordinator),
+        EpCubeMetricSensor(coordinator, primary_sn, key) for key in METRIC_SENSORS
+    ]
+
+    # Chiavi del payload che hanno già un sensore, per dispositivo
+    known_keys = {}
+
+    def _new_entities():
+        new_entities = []
+        for sn, device_data in coordinator.data["devices"].items():
+            known = known_keys.get(sn)
+            if known is None:
+                known = known_keys[sn] = set()
+                new_entities += _device_entities(coordinator, sn)
+
+            # Le chiavi nuove risultano sempre tra quelle cambiate nell'ultimo ciclo
+            changed = coordinator.changed_keys
+            candidates = device_data.keys() if changed is None else changed.get(sn, device_data.keys())
+            new_keys = [k for k in candidates if k not in known and k in device_data]
+            if not new_keys:
+                continue
+            known.update(new_keys)
+            sensors = generate_sensors(
+                {k: device_data[k] for k in new_keys},
+                enable_total=options.get(CONF_ENABLE_TOTAL, False),
+                enable_annual=options.get(CONF_ENABLE_ANNUAL, False),
+                enable_monthly=options.get(CONF_ENABLE_MONTHLY, False),
+            )
+            new_entities += [EpCubeSensor(coordinator, sn, sensor) for sensor in sensors]
+        return new_entities
+
+    @callback
+    def _async_discover():
+        if not coordinator.last_update_success or not coordinator.data:
+            return
+        new_entities = _new_entities()
+        if new_entities:
+            _LOGGER.debug("Nuove entità EP Cube rilevate: %d", len(new_entities))
+            _async_register_entities(registry, entry, new_entities)
+            async_add_entities(new_entities)
+
+    entities += _new_entities()
+    _async_register_entities(registry, entry, entities)
+    # I dati sono già nel coordinator (anche quelli ripristinati): niente update prima dell'aggiunta
+    async_add_entities(entities)
+
+    entry.async_on_unload(coordinator.async_add_listener(_async_discover))
+
+
+def _device_entities(coordinator, sn):
+    """Entità calcolate localmente, indipendenti dalle chiavi del payload."""
+    return [
+        EpCubeBatteryChargeSensor(coordinator, sn),
+        EpCubeBatteryDischargeSensor(coordinator, sn),
+        EpCubeBatteryDailyChargeSensor(coordinator, sn),
+        EpCubeBatteryDailyDischargeSensor(coordinator, sn),
+    ] + [
+        EpCubeIntegratedEnergySensor(coordinator, sn, key) for key in INTEGRATED_ENERGY_SENSORS
+    ] + [
+        EpCubePowerAggregateSensor(coordinator, sn, channel, stat, window)
+        for channel in POWER_AGGREGATE_CHANNELS
+        for stat in POWER_AGGREGATE_STATS
+        for window in coordinator.aggregate_windows
     ]
 
-    registry = async_get(hass)
 
+@callback
+def _async_register_entities(registry, entry, entities):
+    """Pre-registra in blocco le entità nuove, disattivando le varianti non abilitate nelle opzioni.
+
+    Le entità già registrate vengono escluse con un solo passaggio sul registro
+    della config entry: ad un avvio normale non viene creato nulla.
+    """
+    registered = {
+        registry_entry.unique_id
+        for registry_entry in async_entries_for_config_entry(registry, entry.entry_id)
+        if registry_entry.domain == "sensor"
+    }
     for entity in entities:
-        if registry.async_get_entity_id("sensor", DOMAIN, entity.unique_id) is None:
-            disabled_by = None
-            if entity.unique_id.endswith("_total") and not enable_total:
-                disabled_by = RegistryEntryDisabler.INTEGRATION
-            elif entity.unique_id.endswith("_annual") and not enable_annual:
-                disabled_by = RegistryEntryDisabler.INTEGRATION
-            elif entity.unique_id.endswith("_monthly") and not enable_monthly:
-                disabled_by = RegistryEntryDisabler.INTEGRATION
-
-            registry.async_get_or_create(
-                domain="sensor",
-                platform=DOMAIN,
-                unique_id=entity.unique_id,
-                suggested_object_id=entity.unique_id,
-                disabled_by=disabled_by
-            )
+        if entity.unique_id in registered:
+            continue
+        disabled_by = None
+        _, variant = split_variant(entity.unique_id)
+        if variant and not entry.options.get(VARIANT_OPTIONS[variant], False):
+            disabled_by = RegistryEntryDisabler.INTEGRATION
+
+        registry.async_get_or_create(
+            domain="sensor",
+            platform=DOMAIN,
+            unique_id=entity.unique_id,
+            suggested_object_id=entity.unique_id,
+            config_entry=entry,
+            disabled_by=disabled_by
+        )
 
-    async_add_entities(entities, True)
-    
 
-class EpCubeSensor(CoordinatorEntity, SensorEntity):
-    def __init__(self, coordinator, description):
-        super().__init__(coordinator)
+class EpCubeSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn, description):
+        super().__init__(coordinator, sn)
         self.coordinator = coordinator
         self.entity_description = description
-        self._attr_unique_id = f"epcube_{description.key}"
-        self._attr_entity_id = f"sensor.epcube_{description.key}"
+        self._attr_unique_id = f"epcube_{sn}_{description.key}"
+        self._watched_keys = (description.key,)
         self._attr_has_entity_name = True
         self._attr_unit_of_measurement = description.native_unit_of_measurement
         self._attr_device_class = description.device_class
         self._attr_state_class = description.state_class
         self._attr_entity_category = description.entity_category
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-            "entry_type": "service",
-            "configuration_url": "https://monitoring-us.epcube.com/"
-        }
+        self._scale = description.scale
 
-    @property
-    def native_value(self):
-        value = self.coordinator.data["data"].get(self.entity_description.key)
-
-        if value is not None:
-            if self.entity_description.device_class == SensorDeviceClass.POWER:
-                try:
-                    return round(float(value) * 10, 1)
-                except (ValueError, TypeError):
-                    return None
-        return value
-
-class EpCubeLastUpdateSensor(CoordinatorEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
+        self._process_data()
+
+    def _process_data(self):
+        # Il valore scalato viene calcolato una volta per refresh, non ad ogni lettura
+        value = self.device_data.get(self.entity_description.key)
+        if value is not None and self._scale is not None:
+            # Il cloud a volte invia i numeri come stringhe ("12.4")
+            try:
+                value = round(float(value) * self._scale, 1)
+            except (TypeError, ValueError):
+                value = None
+        self._attr_native_value = value
+
+class EpCubeLastUpdateSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
         self._attr_name = "EP CUBE Ultimo Aggiornamento"
-        self._attr_unique_id = "epcube_last_update"
+        self._attr_unique_id = f"epcube_{sn}_last_update"
         self._attr_device_class = SensorDeviceClass.TIMESTAMP
         self._attr_entity_category = EntityCategory.DIAGNOSTIC
         self._attr_entity_registry_enabled_default = True
@@ -355,173 +360,197 @@ class EpCubeLastUpdateSensor(CoordinatorEntity, SensorEntity):
     def native_value(self):
         return dt_util.utcnow()
 
+    @property
+    def extra_state_attributes(self):
+        return self.coordinator.refresh_stats
+
+class EpCubeMetricSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn, key):
+        super().__init__(coordinator, sn)
+        name, self._value_fn = METRIC_SENSORS[key]
+        self._attr_name = f"EP CUBE {name}"
+        self._attr_unique_id = f"epcube_{sn}_{key}"
+        self._attr_device_class = SensorDeviceClass.DURATION
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+        self._attr_suggested_display_precision = 0
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def native_value(self):
+        return self._value_fn(self.coordinator.metrics)
+
+class EpCubeBytesReceivedSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._attr_name = "EP CUBE Bytes Received"
+        self._attr_unique_id = f"epcube_{sn}_bytes_received"
+        self._attr_device_class = SensorDeviceClass.DATA_SIZE
+        self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        self._attr_native_unit_of_measurement = UnitOfInformation.BYTES
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def native_value(self):
+        return self.coordinator.metrics.bytes_received
+
+class EpCubeKeysMergedSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._attr_name = "EP CUBE Keys Merged"
+        self._attr_unique_id = f"epcube_{sn}_keys_merged"
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def native_value(self):
+        return self.coordinator.metrics.keys_merged
+
+class EpCubeCircuitBreakerSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._attr_name = "EP CUBE API Circuit"
+        self._attr_unique_id = f"epcube_{sn}_api_circuit"
+        self._attr_device_class = SensorDeviceClass.ENUM
+        self._attr_options = [BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN]
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def available(self):
+        # Deve restare leggibile proprio quando il cloud non risponde
+        return True
+
+    @property
+    def native_value(self):
+        return self.coordinator.breaker.state
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            "stale": self.coordinator.stale,
+            "consecutive_failures": self.coordinator.breaker.consecutive_failures,
+        }
+
+class EpCubeRetriesSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._attr_name = "EP CUBE API Retries Pending"
+        self._attr_unique_id = f"epcube_{sn}_api_retries"
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def available(self):
+        return True
+
+    @property
+    def native_value(self):
+        return self.coordinator.backoff.retries_pending
+
+    @property
+    def extra_state_attributes(self):
+        return {"rate_limited_requests": self.coordinator.client.rate_limiter_throttled}
+
 # Cumulativo totale: energia caricata nella batteria
-class EpCubeBatteryChargeSensor(CoordinatorEntity, RestoreEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self._attr_unique_id = "epcube_battery_energy_in"
+class EpCubeBatteryChargeSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._energy_state = coordinator.hass.data[DOMAIN][coordinator.entry.entry_id]["states"][sn]
+        self._attr_unique_id = f"epcube_{sn}_battery_energy_in"
+        self._watched_keys = (INTEGRATED_KEY,)
         self._attr_name = "Battery Energy In"
         self._attr_device_class = SensorDeviceClass.ENERGY
         self._attr_state_class = SensorStateClass.TOTAL_INCREASING
         self._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-        }
-
-    async def async_added_to_hass(self):
-        await super().async_added_to_hass()
-        last_state = await self.async_get_last_state()
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        if last_state is not None:
-            try:
-                state_obj.total_in = float(last_state.state)
-            except ValueError:
-                pass
 
     @property
     def native_value(self):
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        return round(state_obj.total_in, 3)
+        return round(self._energy_state.total_in, 3)
 
 
 # Cumulativo totale: energia scaricata dalla batteria
-class EpCubeBatteryDischargeSensor(CoordinatorEntity, RestoreEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self._attr_unique_id = "epcube_battery_energy_out"
+class EpCubeBatteryDischargeSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._energy_state = coordinator.hass.data[DOMAIN][coordinator.entry.entry_id]["states"][sn]
+        self._attr_unique_id = f"epcube_{sn}_battery_energy_out"
+        self._watched_keys = (INTEGRATED_KEY,)
         self._attr_name = "Battery Energy Out"
         self._attr_device_class = SensorDeviceClass.ENERGY
         self._attr_state_class = SensorStateClass.TOTAL_INCREASING
         self._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-        }
-
-    async def async_added_to_hass(self):
-        await super().async_added_to_hass()
-        last_state = await self.async_get_last_state()
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        if last_state is not None:
-            try:
-                state_obj.total_out = float(last_state.state)
-            except ValueError:
-                pass
 
     @property
     def native_value(self):
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        return round(state_obj.total_out, 3)
+        return round(self._energy_state.total_out, 3)
 
 
 # Giornaliero: carica accumulata oggi
-class EpCubeBatteryDailyChargeSensor(CoordinatorEntity, RestoreEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self._attr_unique_id = "epcube_battery_daily_charge"
+class EpCubeBatteryDailyChargeSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._energy_state = coordinator.hass.data[DOMAIN][coordinator.entry.entry_id]["states"][sn]
+        self._attr_unique_id = f"epcube_{sn}_battery_daily_charge"
+        self._watched_keys = (INTEGRATED_KEY,)
         self._attr_name = "Battery Daily Charge"
         self._attr_device_class = SensorDeviceClass.ENERGY
         self._attr_state_class = SensorStateClass.TOTAL
         self._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-        }
-
-    async def async_added_to_hass(self):
-        await super().async_added_to_hass()
-        last_state = await self.async_get_last_state()
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-
-        if state_obj.last_reset != date.today():
-            state_obj.daily_in = 0.0
-            state_obj.last_reset = date.today()
-        elif last_state is not None:
-            try:
-                state_obj.daily_in = float(last_state.state)
-            except ValueError:
-                state_obj.daily_in = 0.0
 
     @property
     def native_value(self):
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        return round(state_obj.daily_in, 3)
+        return round(self._energy_state.daily_in, 3)
 
 
 # Giornaliero: scarica erogata oggi
-class EpCubeBatteryDailyDischargeSensor(CoordinatorEntity, RestoreEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self._attr_unique_id = "epcube_battery_daily_discharge"
+class EpCubeBatteryDailyDischargeSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn):
+        super().__init__(coordinator, sn)
+        self._energy_state = coordinator.hass.data[DOMAIN][coordinator.entry.entry_id]["states"][sn]
+        self._attr_unique_id = f"epcube_{sn}_battery_daily_discharge"
+        self._watched_keys = (INTEGRATED_KEY,)
         self._attr_name = "Battery Daily Discharge"
         self._attr_device_class = SensorDeviceClass.ENERGY
         self._attr_state_class = SensorStateClass.TOTAL
         self._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-        }
 
-    async def async_added_to_hass(self):
-        await super().async_added_to_hass()
-        last_state = await self.async_get_last_state()
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-
-        if state_obj.last_reset != date.today():
-            state_obj.daily_out = 0.0
-            state_obj.last_reset = date.today()
-        elif last_state is not None:
-            try:
-                state_obj.daily_out = float(last_state.state)
-            except ValueError:
-                state_obj.daily_out = 0.0
+    @property
+    def native_value(self):
+        return round(self._energy_state.daily_out, 3)
+
+# Energia dei canali solare, rete e backup integrata dalle potenze live
+class EpCubeIntegratedEnergySensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn, key):
+        super().__init__(coordinator, sn)
+        self._energy_state = coordinator.hass.data[DOMAIN][coordinator.entry.entry_id]["states"][sn]
+        self._channel, self._direction, name = INTEGRATED_ENERGY_SENSORS[key]
+        self._attr_unique_id = f"epcube_{sn}_{key}"
+        self._watched_keys = (INTEGRATED_KEY,)
+        self._attr_name = name
+        self._attr_device_class = SensorDeviceClass.ENERGY
+        self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        self._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
 
     @property
     def native_value(self):
-        state_obj = self.coordinator.hass.data[DOMAIN][self.coordinator.config_entry.entry_id]["state"]
-        return round(state_obj.daily_out, 3)
-
-class EpCubeBatteryPowerSensor(CoordinatorEntity, SensorEntity):
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self._attr_unique_id = "epcube_battery_power"
-        self._attr_name = "Battery Power (Live)"
+        return round(self._energy_state.energy[self._channel][self._direction], 3)
+
+# Min/max/media di una potenza live sugli ultimi `window` minuti
+class EpCubePowerAggregateSensor(EpCubeCoordinatorEntity, SensorEntity):
+    def __init__(self, coordinator, sn, channel, stat, window):
+        super().__init__(coordinator, sn)
+        self._key = (channel, window)
+        self._index = POWER_AGGREGATE_STATS[stat]
+        self._attr_unique_id = f"epcube_{sn}_{channel}_power_{stat}_{window}m"
+        self._attr_name = f"{POWER_AGGREGATE_CHANNELS[channel]} {stat.capitalize()} {window} min"
         self._attr_device_class = SensorDeviceClass.POWER
         self._attr_state_class = SensorStateClass.MEASUREMENT
-        self._attr_native_unit_of_measurement = UnitOfPower.KILO_WATT
-        self._attr_device_info = {
-            "identifiers": {("epcube", "epcube_device")},
-            "name": "EPCUBE",
-            "manufacturer": "CanadianSolar",
-            "model": "EPCUBE",
-        }
+        self._attr_native_unit_of_measurement = UnitOfPower.WATT
+        self._attr_suggested_display_precision = 0
 
     @property
     def native_value(self):
-        data = self.coordinator.data.get("data", {})
-        
-        produzione = data.get("solarpower")
-        consumo = data.get("backuppower")
-        rete = data.get("gridtotalpower")
-
-        if produzione is None or consumo is None or rete is None:
+        aggregate = self.coordinator.power_aggregates[self._sn].get(self._key)
+        if aggregate is None:
             return None
-
-        power_kw = 10 * (produzione - consumo - abs(rete)) / 1000
-        value = round(power_kw, 3)
-
-        _LOGGER.debug(
-            "[EPCube BatteryPower] Produzione: %.1f W | Consumo: %.1f W | Grid: %.1f W → Batteria: %.3f kW",
-            produzione * 10, consumo * 10, rete * 10, value
-        )
-
-        return value
\ No newline at end of file
+        return round(aggregate[self._index], 1)
@@ -0,0 +1,166 @@
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Chiave minuscola → chiave originale, una mappa per schema (tupla delle chiavi grezze)
+_SCHEMAS = {}
+MAX_SCHEMAS = 64
+
+_MISSING = object()
+
+# Sorgente vuota condivisa: stessa identità tra un refresh e l'altro
+EMPTY_LAYER = MappingProxyType({})
+
+
+def _schema(keys):
+    mapping = _SCHEMAS.get(keys)
+    if mapping is None:
+        if len(_SCHEMAS) >= MAX_SCHEMAS:
+            _SCHEMAS.clear()
+        mapping = _SCHEMAS[keys] = {k.lower(): k for k in keys}
+    return mapping
+
+
+class LowerKeyView(Mapping):
+    """Vista in sola lettura con chiavi minuscole su un dizionario dell'API, senza copiarlo."""
+
+    __slots__ = ("_raw", "_keys")
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._keys = _schema(tuple(raw))
+
+    def __getitem__(self, key):
+        return self._raw[self._keys[key]]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key, default=None):
+        raw_key = self._keys.get(key)
+        return default if raw_key is None else self._raw[raw_key]
+
+    def __repr__(self):
+        return f"LowerKeyView({dict(self)!r})"
+
+    def changed_keys(self, old):
+        """Chiavi con valore diverso da `old`; con lo stesso schema confronta i dizionari grezzi."""
+        if isinstance(old, LowerKeyView) and old._keys is self._keys:
+            new_raw, old_raw = self._raw, old._raw
+            return {k for k, raw_key in self._keys.items() if new_raw[raw_key] != old_raw[raw_key]}
+        return _changed_keys(self, old)
+
+
+def _changed_keys(new, old):
+    return {k for k in new.keys() | old.keys() if new.get(k, _MISSING) != old.get(k, _MISSING)}
+
+
+class DeviceSnapshot(Mapping):
+    """Snapshot a livelli di un EP Cube, alla maniera di ChainMap.
+
+    Ogni sorgente resta referenziata così com'è: `layers` sono in ordine di
+    priorità decrescente, `suffixed` associa un suffisso (total, annual,
+    monthly) alla sorgente da cui risolvere al volo le chiavi `<chiave>_<suffisso>`.
+    Le sorgenti non vanno mai modificate: due snapshot che condividono lo
+    stesso oggetto per una sorgente hanno per costruzione gli stessi valori.
+    """
+
+    __slots__ = ("_layers", "_suffixed", "_keys")
+
+    def __init__(self, layers, suffixed):
+        self._layers = tuple(layers)
+        self._suffixed = suffixed
+        self._keys = None
+
+    def __getitem__(self, key):
+        base, sep, suffix = key.rpartition("_")
+        if sep:
+            layer = self._suffixed.get(suffix)
+            if layer is not None and base in layer:
+                return layer[base]
+        for layer in self._layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _key_index(self):
+        if self._keys is None:
+            keys = {}
+            for layer in reversed(self._layers):
+                keys.update(dict.fromkeys(layer))
+            for suffix, layer in self._suffixed.items():
+                keys.update(dict.fromkeys(f"{k}_{suffix}" for k in layer))
+            self._keys = keys
+        return self._keys
+
+    def __iter__(self):
+        return iter(self._key_index())
+
+    def __len__(self):
+        if self._keys is not None:
+            return len(self._keys)
+        # Le chiavi suffissate non collidono con quelle dei livelli: niente f-string qui
+        unsuffixed = set().union(*self._layers)
+        return len(unsuffixed) + sum(len(layer) for layer in self._suffixed.values())
+
+    def __repr__(self):
+        return f"DeviceSnapshot({dict(self)!r})"
+
+    def changed_keys(self, old):
+        """Chiavi con valore diverso da `old`, esaminando solo le sorgenti cambiate.
+
+        Un valore cambiato in una sorgente viene accettato direttamente se la
+        chiave è presente in entrambe le versioni e nessun livello superiore
+        può coprirla; chiavi aggiunte, rimosse o coperte vengono verificate
+        risolvendole in entrambi gli snapshot.
+        """
+        if (
+            not isinstance(old, DeviceSnapshot)
+            or len(old._layers) != len(self._layers)
+            or old._suffixed.keys() != self._suffixed.keys()
+        ):
+            return _changed_keys(self, old)
+
+        changed = set()
+        to_verify = set()
+        for index, (new_layer, old_layer) in enumerate(zip(self._layers, old._layers)):
+            if new_layer is old_layer:
+                continue
+            shadow = set().union(*self._layers[:index], *old._layers[:index])
+            for k in _layer_changes(new_layer, old_layer):
+                if (
+                    k in shadow
+                    or k not in new_layer
+                    or k not in old_layer
+                    or k.rpartition("_")[2] in self._suffixed
+                ):
+                    to_verify.add(k)
+                else:
+                    changed.add(k)
+        for suffix, new_layer in self._suffixed.items():
+            old_layer = old._suffixed[suffix]
+            if new_layer is not old_layer:
+                to_verify.update(f"{k}_{suffix}" for k in _layer_changes(new_layer, old_layer))
+
+        changed.update(k for k in to_verify if self.get(k, _MISSING) != old.get(k, _MISSING))
+        return changed
+
+
+def _layer_changes(new, old):
+    if isinstance(new, LowerKeyView):
+        return new.changed_keys(old)
+    return _changed_keys(new, old)
@@ -1,36 +1,148 @@
 from datetime import date
+import time
+
+# Un intervallo senza campioni più lungo di così conta al massimo per questi secondi
+MAX_INTEGRATION_GAP = 5 * 60
+
+# W·s → kWh
+JOULES_PER_KWH = 3_600_000
+
+# Chiave sintetica in changed_keys: energia integrata aggiornata in questo ciclo
+INTEGRATED_KEY = "_integrated"
+
+
+def power_balance(data):
+    """Bilancio delle potenze in W: (solare, rete, carichi, batteria).
+
+    La rete è positiva in prelievo e negativa in immissione, i carichi sono
+    backup più non backup; la batteria è ciò che resta, positiva in carica e
+    negativa in scarica. L'API fornisce le potenze in decine di W.
+    """
+    solar = 10 * float(data["solarpower"])
+    grid = 10 * float(data["gridtotalpower"])
+    load = 10 * (float(data["backuppower"]) + float(data.get("nonbackuppower") or 0))
+    return solar, grid, load, solar + grid - load
+
+
+def battery_power(data):
+    """Potenza della batteria in W: positiva in carica, negativa in scarica."""
+    return power_balance(data)[3]
+
+
+# Potenze integrate nel tempo (W); l'API le fornisce in decine di W
+POWER_CHANNELS = {
+    "battery": battery_power,
+    "solar": lambda data: 10 * data["solarpower"],
+    "grid": lambda data: 10 * data["gridtotalpower"],
+    "backup": lambda data: 10 * data["backuppower"],
+}
+
+
+class PowerIntegrator:
+    """Integra una potenza con la regola dei trapezi su timestamp monotoni.
+
+    L'energia positiva e negativa è separata, spezzando il trapezio nel punto
+    in cui la potenza passa per lo zero. Se tra due campioni passa più di
+    `max_gap` secondi si usa una somma di Riemann sinistra limitata a
+    `max_gap`, per non inventare energia durante un'interruzione lunga.
+    """
+
+    def __init__(self, max_gap=MAX_INTEGRATION_GAP):
+        self.max_gap = max_gap
+        self._last = None
+
+    def reset(self):
+        self._last = None
+
+    def add(self, timestamp, power):
+        """Aggiunge un campione e restituisce (kWh positivi, kWh negativi) dal precedente."""
+        last = self._last
+        self._last = (timestamp, power)
+        if last is None:
+            return 0.0, 0.0
+
+        last_time, last_power = last
+        dt = timestamp - last_time
+        if dt <= 0:
+            return 0.0, 0.0
+
+        if dt > self.max_gap:
+            area = last_power * self.max_gap
+            areas = (area, 0.0) if area > 0 else (0.0, -area)
+        elif last_power * power >= 0:
+            area = (last_power + power) / 2 * dt
+            areas = (area, 0.0) if area > 0 else (0.0, -area)
+        else:
+            zero_at = dt * last_power / (last_power - power)
+            first = last_power * zero_at / 2
+            second = power * (dt - zero_at) / 2
+            areas = (max(first, second), -min(first, second))
+
+        return areas[0] / JOULES_PER_KWH, areas[1] / JOULES_PER_KWH
+
 
 class EpCubeDataState:
     def __init__(self):
-        self.last_battery_energy = None
         self.total_in = 0.0
         self.total_out = 0.0
         self.daily_in = 0.0
         self.daily_out = 0.0
         self.last_reset = date.today()
+        # Energia integrata (kWh) dei canali diversi dalla batteria: {canale: [positiva, negativa]}
+        self.energy = {channel: [0.0, 0.0] for channel in POWER_CHANNELS if channel != "battery"}
+        self._integrators = {channel: PowerIntegrator() for channel in POWER_CHANNELS}
+
+    def as_dict(self):
+        return {
+            "total_in": self.total_in,
+            "total_out": self.total_out,
+            "daily_in": self.daily_in,
+            "daily_out": self.daily_out,
+            "last_reset": self.last_reset.isoformat(),
+            "energy": self.energy,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Ricostruisce lo stato salvato; i campi mancanti restano ai valori iniziali."""
+        state = cls()
+        for field in ("total_in", "total_out", "daily_in", "daily_out"):
+            setattr(state, field, float(data.get(field, 0.0)))
+        if "last_reset" in data:
+            state.last_reset = date.fromisoformat(data["last_reset"])
+        for channel, values in data.get("energy", {}).items():
+            if channel in state.energy:
+                state.energy[channel] = [float(values[0]), float(values[1])]
+        if state.last_reset != date.today():
+            state.reset_daily()
+        return state
 
     def reset_daily(self):
         self.daily_in = 0.0
         self.daily_out = 0.0
         self.last_reset = date.today()
 
-    def update(self, battery_now: float):
+    def update(self, data, timestamp=None):
+        """Integra le potenze di un nuovo snapshot del dispositivo."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+
         today = date.today()
         if today != self.last_reset:
             self.reset_daily()
 
-        if self.last_battery_energy is None:
-            self.last_battery_energy = battery_now
-            return
-
-        delta = battery_now - self.last_battery_energy
-
-        if delta > 0:
-            self.total_in += delta
-            self.daily_in += delta
-        elif delta < 0:
-            self.total_out += abs(delta)
-            self.daily_out += abs(delta)
-
-        self.last_battery_energy = battery_now
+        for channel, power_fn in POWER_CHANNELS.items():
+            try:
+                power = float(power_fn(data))
+            except (KeyError, TypeError, ValueError):
+                continue
 
+            energy_in, energy_out = self._integrators[channel].add(timestamp, power)
+            if channel == "battery":
+                self.total_in += energy_in
+                self.daily_in += energy_in
+                self.total_out += energy_out
+                self.daily_out += energy_out
+            else:
+                self.energy[channel][0] += energy_in
+                self.energy[channel][1] += energy_out
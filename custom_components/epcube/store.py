@@ -0,0 +1,125 @@
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er, restore_state
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+from .state import EpCubeDataState
+
+import logging
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_MINOR_VERSION = 2
+
+# Ritardo (secondi) con cui vengono raggruppate le scritture su disco
+STATE_SAVE_DELAY = 60
+
+# Sensori che prima salvavano gli accumulatori tramite RestoreEntity
+LEGACY_RESTORE_FIELDS = {
+    "battery_energy_in": "total_in",
+    "battery_energy_out": "total_out",
+    "battery_daily_charge": "daily_in",
+    "battery_daily_discharge": "daily_out",
+}
+
+
+class EpCubeStateStore(Store):
+    """Store versionato degli accumulatori di energia di una config entry.
+
+    Le migrazioni di schema sono in `MIGRATIONS`: {versione: funzione} che
+    porta i dati dalla versione indicata alla successiva.
+    """
+
+    MIGRATIONS = {}
+
+    async def _async_migrate_func(self, old_major_version, old_minor_version, old_data):
+        if old_major_version > STORAGE_VERSION:
+            raise NotImplementedError(f"Versione dello store non supportata: {old_major_version}")
+        for version in range(old_major_version, STORAGE_VERSION):
+            old_data = self.MIGRATIONS[version](old_data)
+        # Le versioni minori aggiungono solo campi: from_dict usa i default
+        return old_data
+
+
+class EpCubeStatePersistence:
+    """Carica e salva in blocco gli EpCubeDataState di tutti i dispositivi.
+
+    Insieme agli accumulatori viene salvato l'ultimo snapshot valido di ogni
+    dispositivo (chiavi e valori), usato per popolare le entità all'avvio.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id):
+        self._store = EpCubeStateStore(
+            hass,
+            STORAGE_VERSION,
+            f"{DOMAIN}.{entry_id}",
+            minor_version=STORAGE_MINOR_VERSION,
+            atomic_writes=True,
+        )
+        self.states = {}
+        # {sn: snapshot}: quelli del coordinator da salvare, o quelli caricati dal disco
+        self.snapshots = {}
+        self._save_scheduled = False
+
+    async def async_load(self, sns):
+        """Ripristina lo stato salvato; restituisce False se lo store è vuoto."""
+        stored = await self._store.async_load() or {}
+        devices = stored.get("devices", {})
+        # Tutti gli stati vengono costruiti prima di sostituire quelli correnti
+        self.states = {sn: EpCubeDataState.from_dict(devices.get(sn, {})) for sn in sns}
+        self.snapshots = stored.get("snapshots", {})
+        return bool(devices)
+
+    def _data(self):
+        return {
+            "devices": {sn: state.as_dict() for sn, state in self.states.items()},
+            "snapshots": {sn: dict(snapshot) for sn, snapshot in self.snapshots.items()},
+        }
+
+    def _delayed_data(self):
+        self._save_scheduled = False
+        return self._data()
+
+    @callback
+    def async_schedule_save(self):
+        """Salva entro STATE_SAVE_DELAY secondi, con al più una scrittura in attesa."""
+        # async_delay_save riparte da capo ad ogni chiamata: con un refresh ogni
+        # pochi secondi la scrittura verrebbe rimandata fino allo spegnimento
+        if self._save_scheduled:
+            return
+        self._save_scheduled = True
+        self._store.async_delay_save(self._delayed_data, STATE_SAVE_DELAY)
+
+    async def async_save(self):
+        # Il salvataggio immediato annulla anche quello ritardato
+        self._save_scheduled = False
+        await self._store.async_save(self._data())
+
+    async def async_remove(self):
+        await self._store.async_remove()
+
+
+@callback
+def async_import_restore_states(hass: HomeAssistant, states):
+    """Importa gli accumulatori dagli ultimi stati salvati da RestoreEntity."""
+    registry = er.async_get(hass)
+    last_states = restore_state.async_get(hass).last_states
+    today = dt_util.now().date()
+    imported = False
+    for sn, state in states.items():
+        for suffix, field in LEGACY_RESTORE_FIELDS.items():
+            entity_id = registry.async_get_entity_id("sensor", DOMAIN, f"epcube_{sn}_{suffix}")
+            stored = last_states.get(entity_id) if entity_id else None
+            if stored is None:
+                continue
+            if field.startswith("daily") and dt_util.as_local(stored.state.last_updated).date() != today:
+                continue
+            try:
+                setattr(state, field, float(stored.state.state))
+            except ValueError:
+                continue
+            imported = True
+    if imported:
+        _LOGGER.info("Accumulatori di energia importati dagli stati ripristinati")
+    return imported
@@ -0,0 +1,68 @@
+from array import array
+
+
+class PowerSeries:
+    """Buffer circolare di campioni (timestamp monotono, W) su array compatti.
+
+    Con `horizon` (secondi) il campione più vecchio viene sovrascritto solo se
+    è fuori orizzonte; altrimenti il buffer raddoppia, così poll più fitti del
+    previsto non accorciano le finestre degli aggregati.
+    """
+
+    def __init__(self, capacity, horizon=None):
+        self.capacity = max(1, capacity)
+        self.horizon = horizon
+        self._times = array("d", bytes(8 * self.capacity))
+        self._values = array("d", bytes(8 * self.capacity))
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _oldest(self):
+        return (self._head - self._count) % self.capacity
+
+    def _grow(self):
+        # Campioni in ordine cronologico, poi spazio libero in coda
+        start = self._oldest()
+        order = [(start + i) % self.capacity for i in range(self._count)]
+        self._times = array("d", (self._times[i] for i in order)) + array("d", bytes(8 * self.capacity))
+        self._values = array("d", (self._values[i] for i in order)) + array("d", bytes(8 * self.capacity))
+        self._head = self._count
+        self.capacity *= 2
+
+    def append(self, timestamp, value):
+        if (
+            self.horizon is not None
+            and self._count == self.capacity
+            and self._times[self._oldest()] >= timestamp - self.horizon
+        ):
+            self._grow()
+        self._times[self._head] = timestamp
+        self._values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def aggregate(self, window, now):
+        """(min, max, media) dei campioni degli ultimi `window` secondi, None se non ce ne sono."""
+        since = now - window
+        low = high = None
+        total = 0.0
+        count = 0
+        # Dal più recente al più vecchio: ci si ferma al primo campione fuori finestra
+        index = self._head
+        for _ in range(self._count):
+            index = (index - 1) % self.capacity
+            if self._times[index] < since:
+                break
+            value = self._values[index]
+            if low is None or value < low:
+                low = value
+            if high is None or value > high:
+                high = value
+            total += value
+            count += 1
+        if not count:
+            return None
+        return low, high, total / count
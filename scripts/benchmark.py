@@ -0,0 +1,137 @@
+"""Benchmark offline della pipeline di aggiornamento EP Cube.
+
+Avvia il server finto, esegue una serie di refresh del coordinator e misura:
+tempo per refresh, memoria allocata per refresh, costo di generate_sensors e
+throughput delle letture native_value delle entità.
+
+    python scripts/benchmark.py --refreshes 200 --devices 3 --latency 20 --pad-keys 100
+
+Richiede un ambiente con homeassistant installato.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from custom_components.epcube.api import EpCubeApiClient  # noqa: E402
+from custom_components.epcube.const import DOMAIN  # noqa: E402
+from custom_components.epcube.coordinator import EpCubeCoordinator  # noqa: E402
+from custom_components.epcube.metrics import create_trace_config  # noqa: E402
+from custom_components.epcube.sensor import EpCubeSensor, generate_sensors  # noqa: E402
+from custom_components.epcube.state import EpCubeDataState  # noqa: E402
+from fake_epcube_server import FakeEpCubeServer  # noqa: E402
+
+
+class BenchEntry:
+    entry_id = "benchmark"
+
+    def __init__(self, sns):
+        self.data = {"token": "Bearer benchmark", "sn": sns[0], "sns": sns}
+        self.options = {}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def _report(name, values, unit):
+    print(
+        f"{name:<28} media {statistics.mean(values):10.3f} {unit}  "
+        f"p50 {_percentile(values, 50):10.3f}  p95 {_percentile(values, 95):10.3f}  "
+        f"max {max(values):10.3f}"
+    )
+
+
+async def run(args):
+    server = FakeEpCubeServer(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        pad_keys=args.pad_keys,
+        devices=args.devices,
+        seed=0,
+    )
+    base_url = await server.start()
+
+    hass = HomeAssistant(tempfile.mkdtemp())
+    entry = BenchEntry(server.sns())
+    # Stessa sessione della produzione: il trace config misura DNS, connessione e TTFB
+    async with aiohttp.ClientSession(trace_configs=[create_trace_config()]) as session:
+        client = EpCubeApiClient(session, entry.data["token"], base_url=base_url)
+        coordinator = EpCubeCoordinator(hass, entry, client, 5)
+        hass.data[DOMAIN] = {
+            entry.entry_id: {
+                "coordinator": coordinator,
+                "client": client,
+                "states": {sn: EpCubeDataState() for sn in entry.data["sns"]},
+            }
+        }
+
+        # Primo refresh fuori misura: scarica tutte le sorgenti a livelli
+        await coordinator.async_refresh()
+
+        wall_ms = []
+        alloc_kib = []
+        tracemalloc.start()
+        for _ in range(args.refreshes):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            await coordinator.async_refresh()
+            wall_ms.append((time.perf_counter() - start) * 1000)
+            _, peak = tracemalloc.get_traced_memory()
+            alloc_kib.append((peak - before) / 1024)
+        tracemalloc.stop()
+
+    print(f"dispositivi: {args.devices}  refresh: {args.refreshes}  richieste HTTP: {server.requests}  "
+          f"byte ricevuti: {server.bytes_sent}")
+    print(f"refresh riusciti: {coordinator.last_update_success}  ultime statistiche: {coordinator.refresh_stats}")
+    _report("refresh (wall)", wall_ms, "ms ")
+    _report("memoria di picco/refresh", alloc_kib, "KiB")
+    metrics = coordinator.metrics
+    print(f"{'cloud p95 / locale p95':<28} {metrics.cloud_percentile(95):10.3f} ms / "
+          f"{metrics.processing_percentile(95):.3f} ms")
+
+    sn, device_data = next(iter(coordinator.data["devices"].items()))
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        descriptions = generate_sensors(device_data)
+    generate_us = (time.perf_counter() - start) / args.iterations * 1e6
+    print(f"{'generate_sensors':<28} {generate_us:10.1f} us/chiamata ({len(descriptions)} sensori)")
+
+    entities = [EpCubeSensor(coordinator, sn, description) for description in descriptions]
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for entity in entities:
+            entity.native_value
+    elapsed = time.perf_counter() - start
+    reads = args.iterations * len(entities)
+    print(f"{'native_value':<28} {reads / elapsed:10.0f} letture/s")
+
+    await server.stop()
+    await hass.async_stop(force=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--refreshes", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=200, help="ripetizioni per i micro-benchmark")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="latenza del server in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="jitter massimo in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--pad-keys", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
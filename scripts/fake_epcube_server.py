@@ -0,0 +1,127 @@
+"""Server locale che imita il cloud EP Cube a partire dalle fixture JSON.
+
+Serve tutti gli endpoint usati dall'integrazione con latenza, errori e
+dimensione del payload configurabili, così da poter misurare la pipeline
+di aggiornamento senza rete:
+
+    python scripts/fake_epcube_server.py --latency 80 --error-rate 0.05 --pad-keys 200
+"""
+import argparse
+import asyncio
+import copy
+import json
+import random
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+ROUTES = {
+    "/api/user/user/base": "user_base.json",
+    "/api/device/homeDeviceInfo": "home_device_info.json",
+    "/api/device/queryDataElectricityV2": "stats.json",
+    "/api/device/userDeviceInfo": "user_device_info.json",
+    "/api/device/getSwitchMode": "switch_mode.json",
+}
+
+
+class FakeEpCubeServer:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, pad_keys=0, devices=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pad_keys = pad_keys
+        self.devices = devices
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._fixtures = {
+            name: json.loads((FIXTURES / name).read_text())
+            for name in {*ROUTES.values(), "switch_mode_post.json"}
+        }
+        self._runner = None
+        self.base_url = None
+
+    def sns(self):
+        return [f"EPCUBE{i:010d}" for i in range(1, self.devices + 1)]
+
+    def _payload(self, path, query):
+        body = copy.deepcopy(self._fixtures[ROUTES[path]])
+        data = body.get("data")
+
+        if path == "/api/user/user/base":
+            data["devices"] = [{"sgSn": sn} for sn in self.sns()]
+        elif path == "/api/device/homeDeviceInfo":
+            sn = query.get("sgSn", self.sns()[0])
+            data["devId"] = 500000 + (self.sns().index(sn) + 1 if sn in self.sns() else 1)
+        elif "devId" in query and isinstance(data, dict):
+            data["devId"] = int(query["devId"])
+
+        if isinstance(data, dict):
+            for i in range(self.pad_keys):
+                data[f"padKey{i}"] = i * 0.1
+        return body
+
+    async def _handle(self, request):
+        self.requests += 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self._random.random() < self.error_rate:
+            return web.Response(status=500, text="injected error")
+
+        if request.method == "POST":
+            body = self._fixtures["switch_mode_post.json"]
+        else:
+            body = self._payload(request.path, request.query)
+        raw = json.dumps(body).encode()
+        self.bytes_sent += len(raw)
+        return web.Response(body=raw, content_type="application/json")
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        for path in ROUTES:
+            app.router.add_get(path, self._handle)
+        app.router.add_post("/api/device/switchMode", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _main(args):
+    server = FakeEpCubeServer(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        pad_keys=args.pad_keys,
+        devices=args.devices,
+    )
+    url = await server.start(port=args.port)
+    print(f"Fake EP Cube API in ascolto su {url} (dispositivi: {', '.join(server.sns())})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="latenza in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="jitter massimo in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di risposte HTTP 500")
+    parser.add_argument("--pad-keys", type=int, default=0, help="chiavi extra per payload")
+    parser.add_argument("--devices", type=int, default=1)
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
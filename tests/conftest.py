@@ -0,0 +1,114 @@
+"""Fixture comuni: server EP Cube finto e coordinator su un'istanza Home Assistant minima.
+
+I test non usano la rete: il cloud è sostituito da scripts/fake_epcube_server.py
+e ogni test ha un event loop dedicato, così anche i benchmark sincroni di
+pytest-benchmark possono eseguire i refresh con run_until_complete.
+"""
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+import aiohttp
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from custom_components.epcube.api import EpCubeApiClient  # noqa: E402
+from custom_components.epcube.const import DOMAIN  # noqa: E402
+from custom_components.epcube.coordinator import EpCubeCoordinator  # noqa: E402
+from custom_components.epcube.metrics import create_trace_config  # noqa: E402
+from custom_components.epcube.state import EpCubeDataState  # noqa: E402
+from fake_epcube_server import FakeEpCubeServer  # noqa: E402
+
+TOKEN = "Bearer test"
+
+
+class FakeEntry:
+    """Il minimo di ConfigEntry letto da coordinator ed entità."""
+
+    entry_id = "test"
+    title = "EP Cube"
+
+    def __init__(self, sns, options=None):
+        self.data = {"token": TOKEN, "sn": sns[0], "sns": sns}
+        self.options = options or {}
+        self.reauth_started = 0
+
+    def async_start_reauth(self, hass):
+        self.reauth_started += 1
+
+
+class Harness:
+    """Server finto, client e coordinator di una config entry, sul loop del test."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.server = None
+        self.hass = None
+        self.session = None
+        self.client = None
+        self.entry = None
+        self.coordinator = None
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def refresh(self):
+        self.run(self.coordinator.async_refresh())
+
+    async def async_setup(self, devices=1, pad_keys=0, error_rate=0.0, latency=0.0, options=None, scan_interval=5):
+        self.server = FakeEpCubeServer(
+            latency=latency, pad_keys=pad_keys, error_rate=error_rate, devices=devices, seed=0
+        )
+        base_url = await self.server.start()
+        self.hass = HomeAssistant(tempfile.mkdtemp())
+        self.session = aiohttp.ClientSession(trace_configs=[create_trace_config()])
+        self.client = EpCubeApiClient(self.session, TOKEN, base_url=base_url)
+        self.entry = FakeEntry(self.server.sns(), options)
+        self.coordinator = EpCubeCoordinator(self.hass, self.entry, self.client, scan_interval)
+        self.hass.data[DOMAIN] = {
+            self.entry.entry_id: {
+                "coordinator": self.coordinator,
+                "client": self.client,
+                "states": {sn: EpCubeDataState() for sn in self.entry.data["sns"]},
+            }
+        }
+        return self
+
+    async def async_close(self):
+        if self.coordinator is not None:
+            for queue in self.coordinator.commands.values():
+                queue.async_cancel()
+        if self.session is not None:
+            await self.session.close()
+        if self.server is not None:
+            await self.server.stop()
+        if self.hass is not None:
+            await self.hass.async_stop(force=True)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def make_harness(loop):
+    """Crea l'ambiente di un test: make_harness(devices=2, options={...})."""
+    harnesses = []
+
+    def _make(**kwargs):
+        harness = Harness(loop)
+        harnesses.append(harness)
+        return loop.run_until_complete(harness.async_setup(**kwargs))
+
+    yield _make
+    for harness in harnesses:
+        loop.run_until_complete(harness.async_close())
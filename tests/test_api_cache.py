@@ -0,0 +1,112 @@
+"""Richieste condizionali e cache delle risposte del client API."""
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.epcube.api import EpCubeApiClient, EpCubeApiError
+from conftest import TOKEN
+
+STATS_PATH = "/api/device/queryDataElectricityV2"
+
+
+class FakeResponse:
+    def __init__(self, status=200, body=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.content_type = "application/json"
+        self._body = json.dumps({"status": 200, "data": body}).encode() if body is not None else b""
+
+    async def read(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Risponde con le risposte in coda e registra gli header di ogni GET."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, headers=None, params=None, trace_request_ctx=None):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    calls = []
+    original = EpCubeApiClient._parse
+
+    async def _parse(self, path, body):
+        calls.append(path)
+        return await original(self, path, body)
+
+    monkeypatch.setattr(EpCubeApiClient, "_parse", _parse)
+    return calls
+
+
+def _today():
+    return date.today().isoformat()
+
+
+def test_etag_round_trip_and_304_reuse(loop, parses):
+    session = FakeSession(
+        FakeResponse(body={"solarElectricity": 1.5}, headers={"ETag": '"v1"', "Last-Modified": "Mon"}),
+        FakeResponse(status=304),
+    )
+    client = EpCubeApiClient(session, TOKEN)
+
+    first = loop.run_until_complete(client.async_get_stats(1, _today(), 1))
+    second = loop.run_until_complete(client.async_get_stats(1, _today(), 1))
+
+    assert "if-none-match" not in session.sent_headers[0]
+    assert session.sent_headers[1]["if-none-match"] == '"v1"'
+    assert session.sent_headers[1]["if-modified-since"] == "Mon"
+    assert second is first
+    assert second["solarelectricity"] == 1.5
+    assert parses == [STATS_PATH]
+    assert (client.cache.hits, client.cache.misses) == (1, 1)
+
+
+def test_identical_body_skips_parsing(loop, parses):
+    body = {"solarElectricity": 2.0}
+    session = FakeSession(FakeResponse(body=body), FakeResponse(body=body), FakeResponse(body={"solarElectricity": 3.0}))
+    client = EpCubeApiClient(session, TOKEN)
+
+    first = loop.run_until_complete(client.async_get_stats(1, _today(), 1))
+    second = loop.run_until_complete(client.async_get_stats(1, _today(), 1))
+    third = loop.run_until_complete(client.async_get_stats(1, _today(), 1))
+
+    assert second is first
+    assert third["solarelectricity"] == 3.0
+    assert len(parses) == 2
+
+
+def test_entries_expire_at_period_end(loop, parses):
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    session = FakeSession(
+        FakeResponse(body={"solarElectricity": 4.0}, headers={"ETag": '"old"'}),
+        FakeResponse(body={"solarElectricity": 4.0}),
+    )
+    client = EpCubeApiClient(session, TOKEN)
+
+    loop.run_until_complete(client.async_get_stats(1, yesterday, 1))
+    loop.run_until_complete(client.async_get_stats(1, yesterday, 1))
+
+    # Il giorno è finito: nessuna richiesta condizionale e nuovo parsing
+    assert "if-none-match" not in session.sent_headers[1]
+    assert len(parses) == 2
+    assert client.cache.misses == 2
+
+
+def test_304_without_cached_response_is_an_error(loop):
+    client = EpCubeApiClient(FakeSession(FakeResponse(status=304)), TOKEN)
+    with pytest.raises(EpCubeApiError):
+        loop.run_until_complete(client.async_get_stats(1, _today(), 1))
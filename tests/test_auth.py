@@ -0,0 +1,132 @@
+"""Token dell'account: scadenza del JWT, credenziali non valide e reauth anticipato."""
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from custom_components.epcube.api import EpCubeAuthError
+from custom_components.epcube.auth import EpCubeCredentials, jwt_expiry, normalize_token
+from custom_components.epcube.const import TOKEN_RENEW_MARGIN
+
+
+def _segment(value):
+    raw = value if isinstance(value, bytes) else json.dumps(value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def make_jwt(claims):
+    return f"Bearer {_segment({'alg': 'HS256', 'typ': 'JWT'})}.{_segment(claims)}.firma"
+
+
+def _expiring_in(delta):
+    return make_jwt({"sub": "utente", "exp": int((datetime.now(timezone.utc) + delta).timestamp())})
+
+
+@pytest.mark.parametrize(
+    "token",
+    ["abc", "  abc\n", "Bearer abc", "  Bearer abc  "],
+)
+def test_normalize_token_adds_bearer_once(token):
+    assert normalize_token(token) == "Bearer abc"
+
+
+def test_jwt_expiry_reads_exp():
+    assert jwt_expiry(make_jwt({"exp": 1700000000})) == datetime.fromtimestamp(1700000000, timezone.utc)
+    # Anche senza prefisso e con `exp` come stringa numerica
+    assert jwt_expiry(make_jwt({"exp": "1700000000"}).removeprefix("Bearer ")) is not None
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "Bearer test",
+        "Bearer a.b",
+        "Bearer a.b.c.d",
+        f"Bearer x.{_segment(b'non json')}.y",
+        f"Bearer x.{_segment(b'%%%')}.y",
+        "Bearer x.!!!.y",
+        make_jwt({"sub": "utente"}),
+        make_jwt({"exp": "domani"}),
+        make_jwt({"exp": None}),
+        make_jwt({"exp": 10 ** 20}),
+        make_jwt(["exp", 1700000000]),
+    ],
+    ids=[
+        "opaque", "two_parts", "four_parts", "not_json", "bad_bytes", "bad_base64",
+        "no_exp", "exp_text", "exp_null", "exp_overflow", "claims_list",
+    ],
+)
+def test_jwt_expiry_without_valid_exp_is_none(token):
+    assert jwt_expiry(token) is None
+
+
+def test_credentials_without_exp_never_expire():
+    credentials = EpCubeCredentials("test")
+    assert credentials.expires_at is None
+    assert not credentials.expired
+    assert credentials.valid
+
+
+def test_credentials_expired_token_is_invalid():
+    credentials = EpCubeCredentials(_expiring_in(timedelta(minutes=-1)))
+    assert credentials.expired
+    assert not credentials.valid
+
+
+def test_credentials_rejected_token_is_invalid():
+    credentials = EpCubeCredentials(_expiring_in(timedelta(days=30)))
+    assert credentials.valid
+    credentials.reject()
+    assert not credentials.expired
+    assert not credentials.valid
+
+
+def _track(harness, token):
+    harness.client.credentials = EpCubeCredentials(token)
+
+    async def _run():
+        unsub = harness.coordinator.async_track_token_expiry()
+        await harness.hass.async_block_till_done()
+        return unsub
+
+    return harness.run(_run())
+
+
+def test_reauth_starts_within_renew_margin(make_harness):
+    harness = make_harness()
+    _track(harness, _expiring_in(timedelta(seconds=TOKEN_RENEW_MARGIN - 60)))
+    assert harness.entry.reauth_started == 1
+
+
+def test_reauth_starts_for_expired_token(make_harness):
+    harness = make_harness()
+    _track(harness, _expiring_in(timedelta(minutes=-1)))
+    assert harness.entry.reauth_started == 1
+
+
+def test_reauth_waits_for_renew_margin(make_harness):
+    harness = make_harness()
+    unsub = _track(harness, _expiring_in(timedelta(seconds=TOKEN_RENEW_MARGIN + 3600)))
+    assert harness.entry.reauth_started == 0
+    unsub()
+
+
+@pytest.mark.parametrize("token", ["Bearer test", make_jwt({"sub": "utente"}), "Bearer a.b.c"])
+def test_no_reauth_tracking_without_exp(make_harness, token):
+    harness = make_harness()
+    unsub = _track(harness, token)
+    assert harness.entry.reauth_started == 0
+    unsub()
+
+
+def test_expired_token_sends_no_requests(make_harness):
+    harness = make_harness()
+    harness.client.credentials = EpCubeCredentials(_expiring_in(timedelta(minutes=-1)))
+    requests = harness.server.requests
+
+    harness.refresh()
+    assert not harness.coordinator.last_update_success
+    with pytest.raises(EpCubeAuthError):
+        harness.run(harness.client.async_get_device_sns())
+    assert harness.server.requests == requests
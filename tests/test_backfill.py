@@ -0,0 +1,146 @@
+"""Backfill delle statistiche: checkpoint, blocchi da BACKFILL_BATCH_DAYS e priorità del polling live."""
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from custom_components.epcube import backfill as backfill_module
+from custom_components.epcube import coordinator as coordinator_module
+from custom_components.epcube.api import EpCubeApiError
+from custom_components.epcube.backfill import BACKFILL_KEYS, EpCubeStatisticsBackfill, statistic_id
+from custom_components.epcube.const import BACKFILL_BATCH_DAYS
+
+DAYS = BACKFILL_BATCH_DAYS + 9
+# Valori giornalieri della fixture stats.json
+SOLAR_KWH = 18.4
+
+
+@pytest.fixture
+def backfill_harness(make_harness, monkeypatch):
+    monkeypatch.setattr(coordinator_module, "BACKFILL_REQUEST_INTERVAL", 0)
+    imported = []
+
+    def _add_external_statistics(hass, metadata, statistics):
+        imported.append((metadata["statistic_id"], list(statistics)))
+
+    monkeypatch.setattr(backfill_module, "async_add_external_statistics", _add_external_statistics)
+    harness = make_harness()
+    harness.refresh()
+    harness.sn = harness.entry.data["sn"]
+    harness.imported = imported
+    harness.backfill = EpCubeStatisticsBackfill(harness.hass, harness.entry, harness.coordinator)
+    harness.run(harness.backfill.async_load())
+    harness.start = date.today() - timedelta(days=DAYS)
+    return harness
+
+
+def _solar_rows(harness):
+    solar = statistic_id(harness.sn, "solarelectricity")
+    return [rows for stat_id, rows in harness.imported if stat_id == solar]
+
+
+def test_backfill_imports_in_batches(backfill_harness):
+    harness = backfill_harness
+    requests = harness.server.requests
+    harness.run(harness.backfill.async_backfill([harness.sn], harness.start))
+
+    assert harness.server.requests - requests == DAYS
+    # Una chiamata per statistica e per blocco: 31 giorni e poi i 9 restanti
+    batches = _solar_rows(harness)
+    assert [len(rows) for rows in batches] == [BACKFILL_BATCH_DAYS, DAYS - BACKFILL_BATCH_DAYS]
+    assert len(harness.imported) == len(BACKFILL_KEYS) * len(batches)
+
+    rows = [row for batch in batches for row in batch]
+    assert all(row["state"] == SOLAR_KWH for row in rows)
+    assert [row["sum"] for row in rows] == pytest.approx([SOLAR_KWH * (i + 1) for i in range(DAYS)])
+    starts = [row["start"] for row in rows]
+    assert starts == sorted(starts)
+    assert all(start.minute == 0 and start.second == 0 for start in starts)
+
+
+def test_checkpoint_is_saved_and_resumed(backfill_harness):
+    harness = backfill_harness
+    harness.run(harness.backfill.async_backfill([harness.sn], harness.start))
+    checkpoint = harness.backfill.checkpoints[harness.sn]
+    assert checkpoint["first"] == harness.start.isoformat()
+    assert checkpoint["last"] == (date.today() - timedelta(days=1)).isoformat()
+    assert checkpoint["sums"]["solarelectricity"] == pytest.approx(SOLAR_KWH * DAYS)
+
+    # Il checkpoint salvato viene riletto e i giorni già importati non vengono richiesti
+    resumed = EpCubeStatisticsBackfill(harness.hass, harness.entry, harness.coordinator)
+    harness.run(resumed.async_load())
+    assert resumed.checkpoints == harness.backfill.checkpoints
+    requests = harness.server.requests
+    harness.run(resumed.async_backfill([harness.sn]))
+    assert harness.server.requests == requests
+
+
+def test_failed_day_stops_at_last_imported(backfill_harness, monkeypatch):
+    harness = backfill_harness
+    failing = harness.start + timedelta(days=5)
+    fetch = harness.client.async_get_history_stats
+
+    async def _history_stats(dev_id, date_str):
+        if date_str == failing.isoformat():
+            raise EpCubeApiError("HTTP 500")
+        return await fetch(dev_id, date_str)
+
+    monkeypatch.setattr(harness.client, "async_get_history_stats", _history_stats)
+    harness.run(harness.backfill.async_backfill([harness.sn], harness.start))
+
+    # Le somme sono cumulative: nessun giorno importato dopo quello mancante
+    checkpoint = harness.backfill.checkpoints[harness.sn]
+    assert checkpoint["last"] == (failing - timedelta(days=1)).isoformat()
+    assert [len(rows) for rows in _solar_rows(harness)] == [5]
+
+    monkeypatch.setattr(harness.client, "async_get_history_stats", fetch)
+    harness.imported.clear()
+    harness.run(harness.backfill.async_backfill([harness.sn]))
+    rows = [row for batch in _solar_rows(harness) for row in batch]
+    assert len(rows) == DAYS - 5
+    assert rows[0]["sum"] == pytest.approx(SOLAR_KWH * 6)
+
+
+def test_background_requests_yield_to_live_polls(make_harness):
+    harness = make_harness()
+    coordinator = harness.coordinator
+    order = []
+
+    async def _request(name, release=None):
+        order.append(f"{name} start")
+        if release is not None:
+            await release.wait()
+        order.append(f"{name} end")
+
+    async def _run():
+        release = asyncio.Event()
+        live = asyncio.create_task(coordinator.async_limited(_request("live", release)))
+        await asyncio.sleep(0)
+        background = asyncio.create_task(coordinator.async_limited_background(_request("backfill")))
+        await asyncio.sleep(0.05)
+        # Con una richiesta live in corso il backfill aspetta
+        assert order == ["live start"]
+        release.set()
+        await asyncio.gather(live, background)
+
+    harness.run(_run())
+    assert order == ["live start", "live end", "backfill start", "backfill end"]
+
+
+def test_background_requests_run_one_at_a_time(make_harness, monkeypatch):
+    monkeypatch.setattr(coordinator_module, "BACKFILL_REQUEST_INTERVAL", 0)
+    harness = make_harness()
+    running = []
+    peak = []
+
+    async def _request():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def _run():
+        await asyncio.gather(*(harness.coordinator.async_limited_background(_request()) for _ in range(5)))
+
+    harness.run(_run())
+    assert max(peak) == 1
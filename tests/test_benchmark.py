@@ -0,0 +1,62 @@
+"""Benchmark della pipeline di aggiornamento (pytest-benchmark).
+
+    pytest tests/test_benchmark.py --benchmark-only
+
+Con --benchmark-disable ogni caso viene eseguito una volta, come smoke test.
+"""
+import tracemalloc
+
+import pytest
+
+from custom_components.epcube.sensor import EpCubeSensor, generate_sensors
+
+DEVICES = 3
+PAD_KEYS = 100
+
+
+@pytest.fixture
+def harness(make_harness):
+    harness = make_harness(devices=DEVICES, pad_keys=PAD_KEYS)
+    # Primo refresh fuori misura: scarica tutte le sorgenti a livelli
+    harness.refresh()
+    return harness
+
+
+def test_refresh_wall_time(benchmark, harness):
+    benchmark(harness.refresh)
+    assert harness.coordinator.last_update_success
+
+
+def test_refresh_allocations(benchmark, harness):
+    peaks = []
+
+    def _refresh():
+        tracemalloc.start()
+        harness.refresh()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    benchmark.pedantic(_refresh, rounds=20)
+    benchmark.extra_info["peak_kib_per_refresh"] = max(peaks) / 1024
+    assert harness.coordinator.last_update_success
+
+
+def test_generate_sensors(benchmark, harness):
+    device_data = next(iter(harness.coordinator.data["devices"].values()))
+    descriptions = benchmark(generate_sensors, device_data)
+    assert descriptions
+
+
+def test_entity_update_throughput(benchmark, harness):
+    coordinator = harness.coordinator
+    sn, device_data = next(iter(coordinator.data["devices"].items()))
+    entities = [EpCubeSensor(coordinator, sn, description) for description in generate_sensors(device_data)]
+
+    def _update():
+        # Lo stesso lavoro di un refresh: ricalcolo dei valori e lettura di native_value
+        for entity in entities:
+            entity._process_data()
+            entity.native_value
+
+    benchmark(_update)
+    benchmark.extra_info["entities"] = len(entities)
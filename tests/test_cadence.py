@@ -0,0 +1,78 @@
+"""Phase lock: stima della cadenza del cloud da un aggiornamento upstream sintetico."""
+import math
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.epcube import coordinator as coordinator_module
+from custom_components.epcube.cadence import PHASE_MARGIN, PHASE_STAGGER, UpstreamCadence
+from custom_components.epcube.const import CONF_PHASE_LOCK
+
+PERIOD = 30.0
+PHASE = 7.3
+SCAN_INTERVAL = 5
+
+
+def _upstream_index(now, period=PERIOD, phase=PHASE):
+    return math.floor((now - phase) / period)
+
+
+def _simulate(cadence, duration, period=PERIOD, offset=0.0):
+    """Poll come farebbe il coordinator; restituisce i ritardi rispetto agli aggiornamenti."""
+    now, last_index, delays = 0.0, None, []
+    while now < duration:
+        index = _upstream_index(now, period)
+        changed = last_index is not None and index != last_index
+        if changed:
+            delays.append(now - (PHASE + index * period))
+        last_index = index
+        cadence.observe(now, changed)
+        target = cadence.next_poll(now, offset)
+        now = target if target is not None else now + SCAN_INTERVAL
+    return delays
+
+
+def test_cadence_locks_onto_upstream_period():
+    cadence = UpstreamCadence(SCAN_INTERVAL)
+    delays = _simulate(cadence, 20 * PERIOD)
+
+    assert cadence.locked
+    assert abs(cadence.period - PERIOD) < 1
+    # A regime il poll arriva poco dopo l'aggiornamento, non fino a un intervallo dopo
+    assert max(delays[-5:]) <= 1 + PHASE_MARGIN
+
+
+def test_cadence_offset_applies_to_every_poll():
+    cadence = UpstreamCadence(SCAN_INTERVAL)
+    _simulate(cadence, 20 * PERIOD)
+    now = 1000.0
+    assert cadence.next_poll(now, PHASE_STAGGER) - cadence.next_poll(now) == pytest.approx(PHASE_STAGGER)
+
+
+def test_cadence_ignores_updates_faster_than_polling():
+    cadence = UpstreamCadence(SCAN_INTERVAL)
+    _simulate(cadence, 300, period=SCAN_INTERVAL)
+    assert not cadence.locked
+    assert cadence.next_poll(300) is None
+
+
+def test_coordinator_phase_lock_engages(make_harness, monkeypatch):
+    harness = make_harness(options={CONF_PHASE_LOCK: True}, scan_interval=SCAN_INTERVAL)
+    coordinator = harness.coordinator
+    clock = SimpleNamespace(now=0.0, perf_counter=time.perf_counter)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(coordinator_module, "time", clock)
+    live = harness.server._fixtures["home_device_info.json"]["data"]
+
+    for _ in range(100):
+        # Il cloud pubblica un nuovo campione live ogni PERIOD secondi
+        live["solarPower"] = _upstream_index(clock.now)
+        harness.refresh()
+        assert coordinator.last_update_success
+        clock.now += coordinator.update_interval.total_seconds()
+
+    cadence = coordinator.cadence[harness.entry.data["sn"]]
+    assert cadence.locked
+    assert abs(cadence.period - PERIOD) < 1
+    assert coordinator.update_interval.total_seconds() > SCAN_INTERVAL
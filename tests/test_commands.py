@@ -0,0 +1,66 @@
+"""Coda switchMode: unione delle modifiche e modifiche arrivate durante un invio."""
+import asyncio
+
+import pytest
+
+from custom_components.epcube import commands
+
+
+@pytest.fixture
+def queue_harness(make_harness, monkeypatch):
+    monkeypatch.setattr(commands, "SWITCH_MODE_DEBOUNCE", 0.01)
+    harness = make_harness()
+    harness.refresh()
+    harness.queue = harness.coordinator.commands[harness.entry.data["sn"]]
+    harness.payloads = []
+    send = harness.client.async_switch_mode
+
+    async def _switch_mode(payload):
+        harness.payloads.append(payload)
+        if harness.on_send is not None:
+            await harness.on_send(len(harness.payloads))
+        return await send(payload)
+
+    harness.on_send = None
+    monkeypatch.setattr(harness.client, "async_switch_mode", _switch_mode)
+    return harness
+
+
+async def _wait_for(predicate, timeout=2):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+def test_changes_within_debounce_are_coalesced(queue_harness):
+    queue = queue_harness.queue
+
+    async def _run():
+        await queue.async_update({"workstatus": "3"})
+        await queue.async_update({"backuppowerreservesoc": 60})
+        await _wait_for(lambda: queue_harness.payloads and not queue._in_flight)
+
+    queue_harness.run(_run())
+    assert len(queue_harness.payloads) == 1
+    assert queue_harness.payloads[0]["workStatus"] == "3"
+    assert queue_harness.payloads[0]["backupPowerReserveSoc"] == "60"
+
+
+def test_change_during_flush_is_sent_afterwards(queue_harness):
+    queue = queue_harness.queue
+
+    async def _change_mid_flush(count):
+        if count == 1:
+            await queue.async_update({"backuppowerreservesoc": 70})
+
+    queue_harness.on_send = _change_mid_flush
+
+    async def _run():
+        await queue.async_update({"workstatus": "3"})
+        await _wait_for(lambda: len(queue_harness.payloads) == 2 and not queue._in_flight)
+
+    queue_harness.run(_run())
+    assert queue_harness.payloads[1]["backupPowerReserveSoc"] == "70"
+    assert not queue._pending
+    # Dopo la conferma il valore mostrato torna quello letto dal cloud
+    assert queue.value("backuppowerreservesoc") == "50"
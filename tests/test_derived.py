@@ -0,0 +1,87 @@
+"""Metriche derivate da uno snapshot."""
+import pytest
+
+from custom_components.epcube.derived import (
+    BATTERY_CHARGING,
+    BATTERY_DISCHARGING,
+    BATTERY_IDLE,
+    DERIVED_KEYS,
+    derive_metrics,
+)
+
+
+def _data(solar=0, grid=0, backup=0, nonbackup=0, **extra):
+    # Potenze in decine di W, come nell'API
+    return {"solarpower": solar, "gridtotalpower": grid, "backuppower": backup, "nonbackuppower": nonbackup, **extra}
+
+
+def _assert_balanced(derived, solar_kw):
+    # Solare + prelievo = carichi + carica della batteria + immissione
+    assert solar_kw + derived["grid_import_power"] == pytest.approx(
+        derived["house_load_power"] + derived["battery_power"] + derived["grid_export_power"]
+    )
+
+
+def test_importing_from_grid():
+    derived = derive_metrics(_data(grid=100, backup=60))
+    assert derived["grid_import_power"] == 1.0
+    assert derived["grid_export_power"] == 0.0
+    assert derived["house_load_power"] == 0.6
+    assert derived["battery_power"] == 0.4
+    assert derived["battery_direction"] == BATTERY_CHARGING
+    assert derived["self_sufficiency"] == 0.0
+    _assert_balanced(derived, 0.0)
+
+
+def test_exporting_to_grid():
+    derived = derive_metrics(_data(solar=300, grid=-50, backup=100, nonbackup=30))
+    assert derived["grid_import_power"] == 0.0
+    assert derived["grid_export_power"] == 0.5
+    assert derived["house_load_power"] == 1.3
+    assert derived["battery_power"] == 1.2
+    assert derived["self_sufficiency"] == 100.0
+    _assert_balanced(derived, 3.0)
+
+
+def test_discharging_while_importing():
+    derived = derive_metrics(_data(grid=20, backup=100))
+    assert derived["battery_power"] == -0.8
+    assert derived["battery_direction"] == BATTERY_DISCHARGING
+    assert derived["self_sufficiency"] == 80.0
+    _assert_balanced(derived, 0.0)
+
+
+def test_zero_power_is_idle():
+    derived = derive_metrics(_data(batterysoc=50, batterycapacity=10))
+    assert derived["battery_power"] == 0.0
+    assert derived["battery_direction"] == BATTERY_IDLE
+    assert derived["self_sufficiency"] is None
+    assert derived["battery_time_to_full"] is None
+    assert derived["battery_time_to_empty"] is None
+
+
+def test_missing_keys_leave_everything_unknown():
+    assert derive_metrics({"solarpower": 10}) == dict.fromkeys(DERIVED_KEYS)
+
+
+@pytest.mark.parametrize(("soc", "capacity", "expected"), [(50, 10, 300), (50, 10000, 300), (100, 10, 0)])
+def test_time_to_full(soc, capacity, expected):
+    # 1000 W in carica; capacità in kWh o, oltre 1000, in Wh
+    derived = derive_metrics(_data(solar=100, batterysoc=soc, batterycapacity=capacity))
+    assert derived["battery_time_to_full"] == expected
+    assert derived["battery_time_to_empty"] is None
+
+
+@pytest.mark.parametrize(("soc", "expected"), [(65, 300), (15, 0), (10, 0)])
+def test_time_to_empty_stops_at_reserve(soc, expected):
+    # 1000 W in scarica in autoconsumo con riserva al 15%
+    data = _data(backup=100, batterysoc=soc, batterycapacity=10, workstatus="1", selfconsumptioinreservesoc=15)
+    derived = derive_metrics(data)
+    assert derived["battery_time_to_empty"] == expected
+    assert derived["battery_time_to_full"] is None
+
+
+def test_unknown_capacity_has_no_times():
+    derived = derive_metrics(_data(backup=100, batterysoc=50))
+    assert derived["battery_direction"] == BATTERY_DISCHARGING
+    assert derived["battery_time_to_empty"] is None
@@ -0,0 +1,25 @@
+"""Energia integrata dalle potenze live e scritture delle relative entità."""
+from custom_components.epcube.sensor import EpCubeBatteryChargeSensor, EpCubeIntegratedEnergySensor
+from custom_components.epcube.state import INTEGRATED_KEY
+
+
+def test_energy_sensors_write_with_constant_power(make_harness):
+    harness = make_harness()
+    harness.refresh()
+    coordinator = harness.coordinator
+    sn = harness.entry.data["sn"]
+    sensors = [
+        EpCubeBatteryChargeSensor(coordinator, sn),
+        EpCubeIntegratedEnergySensor(coordinator, sn, "integrated_solar_energy"),
+    ]
+    writes = []
+    for sensor in sensors:
+        sensor.async_write_ha_state = lambda sensor=sensor: writes.append(sensor)
+
+    for _ in range(3):
+        # Il server finto risponde sempre con le stesse potenze
+        harness.refresh()
+        assert INTEGRATED_KEY in coordinator.changed_keys[sn]
+        for sensor in sensors:
+            sensor._handle_coordinator_update()
+    assert len(writes) == 3 * len(sensors)
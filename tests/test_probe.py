@@ -0,0 +1,70 @@
+"""Misura degli host cloud: host che falliscono, vanno in timeout o non hanno dispositivi."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.epcube import api
+from custom_components.epcube.api import (
+    EpCubeApiClient,
+    EpCubeApiError,
+    EpCubeAuthError,
+    async_probe_base_url,
+    async_select_base_url,
+)
+from conftest import TOKEN
+
+GOOD = "https://good.example"
+BAD = "https://bad.example"
+
+
+@pytest.fixture
+def hosts(monkeypatch):
+    """Risposta di user/base per host: lista di SN, eccezione o "slow" per un timeout."""
+    hosts = SimpleNamespace(responses={}, calls=[])
+
+    async def _get_device_sns(self):
+        hosts.calls.append(self._base_url)
+        response = hosts.responses[self._base_url]
+        if isinstance(response, Exception):
+            raise response
+        if response == "slow":
+            await asyncio.sleep(1)
+        return response
+
+    monkeypatch.setattr(EpCubeApiClient, "async_get_device_sns", _get_device_sns)
+    monkeypatch.setattr(api, "PROBE_TIMEOUT", 0.05)
+    return hosts
+
+
+def test_probe_returns_latency_and_sns(loop, hosts):
+    hosts.responses[GOOD] = ["SN1"]
+    latency, sns = loop.run_until_complete(async_probe_base_url(None, TOKEN, GOOD))
+    assert sns == ["SN1"]
+    assert latency >= 0
+    assert hosts.calls == [GOOD] * api.PROBE_ATTEMPTS
+
+
+@pytest.mark.parametrize(
+    "response",
+    [EpCubeApiError("HTTP 500"), EpCubeAuthError("HTTP 401"), ValueError("risposta non valida"), "slow", []],
+    ids=["api_error", "auth_error", "unexpected", "timeout", "no_devices"],
+)
+def test_probe_failures_return_none(loop, hosts, response):
+    hosts.responses[BAD] = response
+    assert loop.run_until_complete(async_probe_base_url(None, TOKEN, BAD)) is None
+
+
+def test_probe_stops_at_first_failure(loop, hosts):
+    hosts.responses[BAD] = EpCubeApiError("HTTP 500")
+    loop.run_until_complete(async_probe_base_url(None, TOKEN, BAD))
+    assert hosts.calls == [BAD]
+
+
+def test_select_skips_failing_hosts(loop, hosts):
+    hosts.responses[BAD] = EpCubeApiError("HTTP 500")
+    hosts.responses[GOOD] = ["SN1"]
+    assert loop.run_until_complete(async_select_base_url(None, TOKEN, [BAD, GOOD])) == (GOOD, ["SN1"])
+
+    hosts.responses[GOOD] = "slow"
+    assert loop.run_until_complete(async_select_base_url(None, TOKEN, [BAD, GOOD])) is None
@@ -0,0 +1,74 @@
+"""Smoke test della pipeline di aggiornamento contro il server EP Cube finto."""
+from custom_components.epcube.api import EpCubeApiError, EpCubeAuthError
+from custom_components.epcube.derived import DERIVED_KEYS
+from custom_components.epcube.sensor import generate_sensors
+
+
+def test_fake_server_lists_devices(make_harness):
+    harness = make_harness(devices=3)
+    sns = harness.run(harness.client.async_get_device_sns())
+    assert sns == harness.server.sns()
+
+
+def test_first_refresh_reads_every_device(make_harness):
+    harness = make_harness(devices=2)
+    harness.refresh()
+
+    coordinator = harness.coordinator
+    assert coordinator.last_update_success
+    assert coordinator.data["stale"] is False
+    assert set(coordinator.data["devices"]) == set(harness.server.sns())
+    for device_data in coordinator.data["devices"].values():
+        assert device_data["batterysoc"] == 78
+        assert set(DERIVED_KEYS) <= set(device_data)
+        assert generate_sensors(device_data)
+
+
+def test_later_refresh_only_polls_live_data(make_harness):
+    harness = make_harness(devices=2)
+    harness.refresh()
+    requests = harness.server.requests
+
+    harness.refresh()
+    # Le sorgenti a livelli non sono ancora scadute: una sola richiesta live per dispositivo
+    assert harness.server.requests - requests == 2
+    assert harness.coordinator.last_update_success
+
+
+def test_refresh_fails_when_cloud_errors(make_harness):
+    harness = make_harness(error_rate=1.0)
+    harness.refresh()
+    assert not harness.coordinator.last_update_success
+
+
+def test_partial_refresh_reports_only_fresh_sources(make_harness, monkeypatch):
+    harness = make_harness()
+    harness.refresh()
+    poller = next(iter(harness.coordinator._pollers.values()))
+
+    async def _failing(dev_id):
+        raise EpCubeApiError("switch non disponibile")
+
+    monkeypatch.setattr(harness.client, "async_get_switch_mode", _failing)
+    # Il poll completo precedente aveva letto anche switch: non deve sembrare appena aggiornato
+    assert not harness.run(harness.coordinator.async_refresh_groups(("switch",)))
+    assert poller.last_fetched == set()
+
+
+def test_partial_refresh_auth_error_starts_reauth(make_harness, monkeypatch):
+    harness = make_harness()
+    harness.refresh()
+
+    async def _rejected(dev_id):
+        raise EpCubeAuthError("HTTP 401")
+
+    monkeypatch.setattr(harness.client, "async_get_switch_mode", _rejected)
+    assert not harness.run(harness.coordinator.async_refresh_groups(("switch",)))
+    assert harness.entry.reauth_started == 1
+
+
+def test_cloud_latency_includes_time_to_first_byte(make_harness):
+    harness = make_harness(latency=0.02)
+    harness.refresh()
+    # Con il trace config la latenza copre tutta la richiesta, non solo la lettura del corpo
+    assert harness.coordinator.metrics.cloud_percentile(50) >= 20
@@ -0,0 +1,117 @@
+"""Backoff, token bucket e circuit breaker."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.epcube import resilience
+from custom_components.epcube.resilience import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    Backoff,
+    CircuitBreaker,
+    TokenBucket,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Orologio monotono finto; asyncio.sleep del modulo lo fa avanzare."""
+    clock = SimpleNamespace(now=1000.0)
+    clock.monotonic = lambda: clock.now
+
+    async def _sleep(seconds):
+        clock.now += seconds
+
+    monkeypatch.setattr(resilience, "time", clock)
+    monkeypatch.setattr(resilience, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=_sleep))
+    return clock
+
+
+def test_token_bucket_burst_then_throttle(loop, clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    async def _acquire(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    loop.run_until_complete(_acquire(3))
+    assert bucket.throttled == 0
+    start = clock.now
+    loop.run_until_complete(_acquire(1))
+    assert bucket.throttled == 1
+    assert clock.now - start == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_burst(loop, clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    async def _acquire(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    loop.run_until_complete(_acquire(3))
+    clock.now += 60
+    # Dopo una lunga pausa si recupera solo il burst, non 120 token
+    loop.run_until_complete(_acquire(3))
+    assert bucket.throttled == 0
+    loop.run_until_complete(_acquire(1))
+    assert bucket.throttled == 1
+
+
+def test_backoff_grows_caps_and_resets():
+    backoff = Backoff(base=5, maximum=60)
+    key = ("SN", "live")
+    delays = [backoff.failure(key, now=0.0) for _ in range(8)]
+    for failures, delay in enumerate(delays, start=1):
+        expected = min(60, 5 * 2 ** (failures - 1))
+        assert expected / 2 <= delay <= expected
+    assert backoff.retries_pending == 1
+    assert not backoff.ready(key, now=delays[-1] - 0.1)
+    assert backoff.ready(key, now=delays[-1])
+
+    backoff.success(key)
+    assert backoff.retries_pending == 0
+    assert backoff.ready(key, now=0.0)
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(threshold=3, open_time=120)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN and not breaker.allow_request()
+
+    clock.now += 120
+    assert breaker.allow_request()
+    assert breaker.state == BREAKER_HALF_OPEN
+    # Un probe fallito riapre subito il circuito
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+
+    clock.now += 120
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+def test_backoff_wait_is_not_a_breaker_failure(make_harness):
+    harness = make_harness()
+    harness.refresh()
+    coordinator = harness.coordinator
+
+    harness.server.error_rate = 1.0
+    harness.refresh()
+    assert coordinator.breaker.consecutive_failures == 1
+
+    # Il live è in backoff: i refresh successivi non inviano richieste
+    requests = harness.server.requests
+    for _ in range(10):
+        harness.refresh()
+    assert harness.server.requests == requests
+    assert coordinator.breaker.consecutive_failures == 1
+    assert coordinator.breaker.state == BREAKER_CLOSED
+    assert coordinator.stale
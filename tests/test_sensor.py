@@ -0,0 +1,74 @@
+"""Valori delle entità sensore calcolati una volta per refresh."""
+import pytest
+from homeassistant.components.sensor import SensorDeviceClass
+from homeassistant.const import PERCENTAGE, UnitOfEnergy, UnitOfPower
+from homeassistant.helpers.entity import EntityCategory
+
+from custom_components.epcube.sensor import EpCubeSensor, generate_sensors
+
+
+@pytest.mark.parametrize(("raw", "expected"), [(12.4, 124.0), ("12.4", 124.0), ("n/d", None), ([], None)])
+def test_scaled_value_coerces_numeric_strings(make_harness, raw, expected):
+    harness = make_harness()
+    harness.refresh()
+    coordinator = harness.coordinator
+    sn, device_data = next(iter(coordinator.data["devices"].items()))
+    description = next(d for d in generate_sensors(device_data) if d.key == "gridtotalpower")
+
+    coordinator.data = {"devices": {sn: {**device_data, "gridtotalpower": raw}}, "stale": False}
+    sensor = EpCubeSensor(coordinator, sn, description)
+    assert sensor.native_value == expected
+
+
+def _description(key, data=None, **options):
+    data = data if data is not None else {key: 1}
+    return next(d for d in generate_sensors(data, **options) if d.key == key)
+
+
+@pytest.mark.parametrize("key", ["backuppowerreservesoc", "selfconsumptioinreservesoc"])
+def test_reserve_soc_is_a_percentage(key):
+    description = _description(key)
+    assert description.native_unit_of_measurement == PERCENTAGE
+    assert description.device_class is None
+    assert description.scale is None
+    assert description.entity_category == EntityCategory.DIAGNOSTIC
+
+
+def test_grid_failure_count_is_an_unscaled_diagnostic():
+    description = _description("gridpowerfailurenum")
+    assert description.native_unit_of_measurement is None
+    assert description.device_class is None
+    assert description.scale is None
+    assert description.entity_category == EntityCategory.DIAGNOSTIC
+    assert description.entity_registry_enabled_default
+
+
+def test_off_grid_supply_time_is_a_hidden_diagnostic():
+    description = _description("offgridpowersupplytime")
+    assert description.native_unit_of_measurement is None
+    assert description.scale is None
+    assert description.entity_category == EntityCategory.DIAGNOSTIC
+    assert not description.entity_registry_enabled_default
+
+
+def test_live_power_is_scaled_to_watts():
+    description = _description("solarPower")
+    assert description.translation_key == "solarpower"
+    assert description.native_unit_of_measurement == UnitOfPower.WATT
+    assert description.device_class == SensorDeviceClass.POWER
+    assert description.scale == 10
+
+
+def test_unknown_keys_fall_back_to_heuristics():
+    assert _description("heatpumpelectricity").native_unit_of_measurement == UnitOfEnergy.KILO_WATT_HOUR
+    assert _description("heatpumppower").scale == 10
+    assert _description("heatpumpmode").native_unit_of_measurement is None
+
+
+def test_variants_follow_options():
+    data = {"solarelectricity_total": 1, "solarpower_total": 1}
+    descriptions = generate_sensors(data, enable_total=True)
+    # Le potenze live non hanno varianti; quelle abilitate seguono le opzioni
+    assert [d.key for d in descriptions] == ["solarelectricity_total"]
+    assert descriptions[0].entity_registry_enabled_default
+    assert not _description("solarelectricity_total", data).entity_registry_enabled_default
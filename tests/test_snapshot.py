@@ -0,0 +1,83 @@
+"""Snapshot a livelli e rilevamento delle chiavi cambiate."""
+import random
+
+import pytest
+
+from custom_components.epcube.snapshot import EMPTY_LAYER, DeviceSnapshot, LowerKeyView
+
+
+def _brute_force(new, old):
+    missing = object()
+    return {k for k in set(new) | set(old) if new.get(k, missing) != old.get(k, missing)}
+
+
+def test_lower_key_view_folds_case():
+    view = LowerKeyView({"solarPower": 1, "gridTotalPower": 2})
+    assert view["solarpower"] == 1
+    assert "gridtotalpower" in view
+    assert "solarPower" not in view
+    assert set(view) == {"solarpower", "gridtotalpower"}
+    assert view.get("missing", 0) == 0
+
+
+@pytest.mark.parametrize(
+    ("old", "new", "expected"),
+    [
+        ({"solarPower": 1, "batterySoc": 50}, {"solarPower": 2, "batterySoc": 50}, {"solarpower"}),
+        ({"solarPower": 1}, {"solarPower": 1, "evPower": 0}, {"evpower"}),
+        ({"solarPower": 1, "evPower": 0}, {"solarPower": 1}, {"evpower"}),
+        # Stesse chiavi con un'altra grafia: nessun cambiamento
+        ({"solarPower": 1}, {"SolarPower": 1}, set()),
+    ],
+)
+def test_lower_key_view_changed_keys(old, new, expected):
+    assert LowerKeyView(new).changed_keys(LowerKeyView(old)) == expected
+
+
+def _snapshot(live, switch=EMPTY_LAYER, today=EMPTY_LAYER, total=EMPTY_LAYER):
+    return DeviceSnapshot((today, switch, live), {"total": total})
+
+
+def test_snapshot_resolves_layers_and_suffixes():
+    live = LowerKeyView({"workStatus": "1", "solarElectricity": 5})
+    snapshot = _snapshot(live, switch={"workstatus": "3"}, total={"solarelectricity": 900})
+    assert snapshot["workstatus"] == "3"
+    assert snapshot["solarelectricity"] == 5
+    assert snapshot["solarelectricity_total"] == 900
+    assert len(snapshot) == len(set(snapshot)) == 3
+
+
+def test_snapshot_changed_keys_added_removed_changed():
+    live = LowerKeyView({"solarPower": 1, "evPower": 0})
+    old = _snapshot(live, switch={"workstatus": "1"})
+    new = _snapshot(
+        LowerKeyView({"solarPower": 2, "gridPower": 3}),
+        switch={"workstatus": "1"},
+        total={"solarelectricity": 10},
+    )
+    expected = {"solarpower", "gridpower", "evpower", "solarelectricity_total"}
+    assert new.changed_keys(old) == expected == _brute_force(new, old)
+
+
+def test_snapshot_shadowed_change_is_ignored():
+    # workstatus cambia nel live ma il livello switch lo copre
+    old = _snapshot(LowerKeyView({"workStatus": "1"}), switch={"workstatus": "3"})
+    new = _snapshot(LowerKeyView({"workStatus": "2"}), switch=old._layers[1])
+    assert new.changed_keys(old) == set()
+    # Se la copertura sparisce il valore visibile cambia
+    uncovered = _snapshot(LowerKeyView({"workStatus": "2"}))
+    assert uncovered.changed_keys(old) == {"workstatus"}
+
+
+def test_snapshot_changed_keys_matches_brute_force():
+    rng = random.Random(0)
+    keys = ["a", "b", "c", "a_total"]
+
+    def _layer():
+        return {k: rng.randint(0, 2) for k in keys if rng.random() < 0.6}
+
+    for _ in range(500):
+        old = DeviceSnapshot((_layer(), _layer()), {"total": _layer()})
+        layers = tuple(layer if rng.random() < 0.5 else _layer() for layer in old._layers)
+        new = DeviceSnapshot(layers, {"total": _layer()})
+        assert new.changed_keys(old) == _brute_force(new, old)
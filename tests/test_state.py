@@ -0,0 +1,44 @@
+"""Bilancio delle potenze e integrazione dell'energia della batteria."""
+import pytest
+
+from custom_components.epcube.state import EpCubeDataState, PowerIntegrator, battery_power
+
+# Valori di scripts/fixtures/home_device_info.json, in decine di W
+IMPORTING = {"solarpower": 312.5, "gridtotalpower": 12.4, "backuppower": 64.2, "nonbackuppower": 0}
+
+
+def test_battery_power_while_importing():
+    # 3125 W di solare + 124 W dalla rete - 642 W di carichi
+    assert battery_power(IMPORTING) == pytest.approx(2607)
+
+
+def test_battery_power_while_exporting_counts_every_load():
+    data = {"solarpower": 300, "gridtotalpower": -50, "backuppower": 100, "nonbackuppower": 30}
+    assert battery_power(data) == pytest.approx(1200)
+
+
+def test_battery_power_discharging_without_nonbackup_key():
+    data = {"solarpower": 0, "gridtotalpower": 0, "backuppower": "80"}
+    assert battery_power(data) == pytest.approx(-800)
+
+
+def test_battery_energy_integrates_in_and_out():
+    state = EpCubeDataState()
+    charging = dict(IMPORTING, solarpower=164.2, gridtotalpower=0)  # 1000 W in carica
+    state.update(charging, 0.0)
+    state.update(charging, 180.0)
+    assert state.total_in == pytest.approx(1000 * 180 / 3_600_000)
+    assert state.total_out == 0
+
+    discharging = dict(IMPORTING, solarpower=0, gridtotalpower=0)  # 642 W in scarica
+    state.update(discharging, 180.0 + 1e-9)
+    state.update(discharging, 360.0)
+    assert state.total_out == pytest.approx(642 * 180 / 3_600_000, rel=1e-6)
+
+
+def test_integrator_splits_zero_crossing():
+    integrator = PowerIntegrator()
+    integrator.add(0.0, 100.0)
+    energy_in, energy_out = integrator.add(10.0, -100.0)
+    assert energy_in == pytest.approx(250 / 3_600_000)
+    assert energy_out == pytest.approx(250 / 3_600_000)
@@ -0,0 +1,33 @@
+"""Persistenza degli accumulatori: scritture periodiche anche con refresh frequenti."""
+import asyncio
+import os
+import tempfile
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.epcube import store
+from custom_components.epcube.store import EpCubeStatePersistence
+
+SN = "EPCUBE0000000001"
+
+
+def test_frequent_schedules_still_write(loop, monkeypatch):
+    monkeypatch.setattr(store, "STATE_SAVE_DELAY", 0.1)
+
+    async def _run():
+        hass = HomeAssistant(tempfile.mkdtemp())
+        persistence = EpCubeStatePersistence(hass, "test")
+        await persistence.async_load([SN])
+        path = hass.config.path(".storage", "epcube.test")
+        written = False
+        # Un salvataggio richiesto ad ogni refresh, più spesso del ritardo
+        for tick in range(30):
+            persistence.states[SN].total_in = float(tick)
+            persistence.async_schedule_save()
+            await asyncio.sleep(0.02)
+            await hass.async_block_till_done()
+            written = written or os.path.exists(path)
+        await hass.async_stop(force=True)
+        return written
+
+    assert loop.run_until_complete(_run())
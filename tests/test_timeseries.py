@@ -0,0 +1,36 @@
+"""Buffer circolare delle potenze e aggregati per finestra."""
+import pytest
+
+from custom_components.epcube.timeseries import PowerSeries
+
+
+def test_empty_series_has_no_aggregate():
+    assert PowerSeries(4).aggregate(60, 100.0) is None
+
+
+def test_aggregate_covers_only_the_window():
+    series = PowerSeries(10)
+    for timestamp, value in [(0, 900.0), (50, 100.0), (55, 300.0), (60, 200.0)]:
+        series.append(timestamp, value)
+    assert series.aggregate(10, 60.0) == (100.0, 300.0, pytest.approx(200.0))
+
+
+def test_fixed_capacity_overwrites_oldest():
+    series = PowerSeries(3)
+    for timestamp in range(5):
+        series.append(float(timestamp), float(timestamp))
+    assert len(series) == 3
+    assert series.aggregate(100, 4.0) == (2.0, 4.0, 3.0)
+
+
+def test_horizon_grows_buffer_for_faster_polls():
+    # Dimensionato per un poll ogni 5 s su 5 minuti, riceve un campione al secondo
+    series = PowerSeries(int(300 / 5) + 2, horizon=300)
+    for timestamp in range(1000):
+        series.append(float(timestamp), float(timestamp))
+
+    low, high, mean = series.aggregate(300, 999.0)
+    assert (low, high) == (699.0, 999.0)
+    assert mean == pytest.approx(849.0)
+    # Una volta coperto l'orizzonte il buffer torna a sovrascrivere
+    assert series.capacity < 2 * 302